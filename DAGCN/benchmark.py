@@ -0,0 +1,198 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""
+End-to-end training throughput of the real train_utils pipeline
+
+    python benchmark.py --batch_sizes 32 64 --threads 1 4 --num_workers 0 2 --out bench.json
+    python benchmark.py --amp none bf16 --threads 4
+
+Every configuration runs in a fresh process: a fixed number of source-only steps,
+then the same number of adaptation steps (DAN and AdversarialNet active), without
+evaluation. Unknown arguments are passed on to train_advanced.py, e.g. --transfer_task.
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import itertools
+import subprocess
+import contextlib
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import torch
+import warnings
+from train_advanced import parse_args as parse_train_args
+from utils.train_utils_combines import train_utils
+
+warnings.filterwarnings('ignore')
+
+
+class StopBenchmark(Exception):
+    pass
+
+
+class Step_Timer(object):
+    """
+    Step callback of train_utils recording the end time and size of every step,
+    stops training after warmup + steps steps
+    """
+    def __init__(self, steps, warmup):
+        self.steps = steps
+        self.warmup = warmup
+        self.times = []
+        self.samples = []
+
+    def __call__(self, epoch, step, num_inputs):
+        self.times.append(time.perf_counter())
+        self.samples.append(num_inputs)
+        if len(self.times) > self.warmup + self.steps:
+            raise StopBenchmark()
+
+    def summary(self):
+        times = np.array(self.times[self.warmup:])
+        latency = np.diff(times) * 1000
+        return {
+            'steps': len(latency),
+            'samples_per_sec': float(sum(self.samples[self.warmup + 1:]) / (times[-1] - times[0])),
+            'p50_ms': float(np.percentile(latency, 50)),
+            'p90_ms': float(np.percentile(latency, 90)),
+            'p99_ms': float(np.percentile(latency, 99)),
+        }
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process and of its largest finished child (dataloader workers)
+    """
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    unit = 2**20 if sys.platform == 'darwin' else 2**10
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit)
+
+
+def run_phase(trainer, middle_epoch, steps, warmup):
+    trainer.args.middle_epoch = middle_epoch
+    trainer.start_epoch = 0
+    trainer.end_epoch = sys.maxsize
+    timer = Step_Timer(steps, warmup)
+    trainer.step_callbacks = [timer]
+    try:
+        trainer.train()
+    except StopBenchmark:
+        pass
+    return timer.summary()
+
+
+def run_config(train_argv, batch_size, threads, num_workers, steps, warmup, amp='none'):
+    """
+    Build the pipeline with train_advanced.py arguments and time both training phases
+    """
+    torch.set_num_threads(threads)
+    args = parse_train_args(train_argv)
+    args.batch_size = batch_size
+    args.num_workers = num_workers
+    args.amp = amp
+    args.print_step = sys.maxsize
+    if args.seed is None:
+        args.seed = 0
+    save_dir = tempfile.mkdtemp()
+    trainer = train_utils(args, save_dir)
+    with contextlib.redirect_stdout(io.StringIO()):
+        trainer.setup()
+    trainer.val_phases = []
+
+    result = {'batch_size': batch_size, 'threads': threads, 'num_workers': num_workers, 'amp': amp}
+    # A source-only epoch never draws target batches, adaptation epochs draw one per step
+    result['source_only'] = run_phase(trainer, sys.maxsize, steps, warmup)
+    result['adaptation'] = run_phase(trainer, 0, steps, warmup)
+    result['peak_rss_mb'], result['worker_peak_rss_mb'] = peak_rss_mb()
+    if num_workers == 0:
+        result['worker_peak_rss_mb'] = None
+    shutil.rmtree(save_dir, ignore_errors=True)
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Training throughput benchmark')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[64], help='the batch sizes to run')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1], help='the torch thread counts to run')
+    parser.add_argument('--num_workers', type=int, nargs='+', default=[0], help='the dataloader workers to run')
+    parser.add_argument('--amp', type=str, nargs='+', choices=['none', 'bf16', 'fp16'], default=['none'],
+                        help='the autocast precisions to run')
+    parser.add_argument('--steps', type=int, default=50, help='timed steps per phase')
+    parser.add_argument('--warmup', type=int, default=5, help='untimed steps before each phase')
+    parser.add_argument('--synthetic_length', type=int, default=121000,
+                        help='samples per synthetic recording when --data_dir is not given')
+    parser.add_argument('--in_process', action='store_true',
+                        help='run all configurations in this process, peak RSS is then cumulative')
+    parser.add_argument('--out', type=str, default=None, help='the json file to save the results')
+    return parser.parse_known_args()
+
+
+if __name__ == '__main__':
+    args, train_argv = parse_args()
+
+    synthetic_dir = None
+    if parse_train_args(train_argv).data_dir == parse_train_args([]).data_dir:
+        # No data given: generate a CWRU-sized synthetic dataset
+        from scripts.make_synthetic_data import generate
+        data_dir = synthetic_dir = tempfile.mkdtemp(prefix='dagcn_bench_')
+        with contextlib.redirect_stderr(io.StringIO()):
+            generate(data_dir, length=args.synthetic_length)
+        train_argv = train_argv + ['--data_dir', data_dir]
+    data_dir = parse_train_args(train_argv).data_dir
+
+    results = []
+    for batch_size, threads, num_workers, amp in itertools.product(args.batch_sizes, args.threads, args.num_workers,
+                                                                   args.amp):
+        if args.in_process:
+            result = run_config(train_argv, batch_size, threads, num_workers, args.steps, args.warmup, amp)
+        else:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                result = executor.submit(run_config, train_argv, batch_size, threads, num_workers,
+                                         args.steps, args.warmup, amp).result()
+        results.append(result)
+        for phase in ['source_only', 'adaptation']:
+            r = result[phase]
+            print('batch {:<4} threads {:<3} workers {:<3} amp {:<5} {:<12} {:>9.1f} samples/sec  '
+                  'p50 {:>8.2f} ms  p90 {:>8.2f} ms  p99 {:>8.2f} ms  peak rss {} MB'.format(
+                    batch_size, threads, num_workers, amp, phase, r['samples_per_sec'], r['p50_ms'], r['p90_ms'],
+                    r['p99_ms'], '-' if result['peak_rss_mb'] is None else '{:.0f}'.format(result['peak_rss_mb'])))
+
+    best = max(results, key=lambda r: r['adaptation']['samples_per_sec'])
+    print('best adaptation throughput: {:.1f} samples/sec (batch {}, threads {}, workers {}, amp {})'.format(
+        best['adaptation']['samples_per_sec'], best['batch_size'], best['threads'], best['num_workers'], best['amp']))
+
+    if args.out:
+        meta = {
+            'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'commit': git_commit(),
+            'torch': torch.__version__, 'python': platform.python_version(),
+            'platform': platform.platform(), 'processor': platform.processor(), 'cpu_count': os.cpu_count(),
+            'cuda': torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
+            'data_dir': data_dir, 'train_args': train_argv, 'steps': args.steps, 'warmup': args.warmup,
+        }
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
+        print('saved to {}'.format(args.out))
+
+    if synthetic_dir is not None:
+        shutil.rmtree(synthetic_dir, ignore_errors=True)
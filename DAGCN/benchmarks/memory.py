@@ -0,0 +1,325 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""
+Memory profile of one training step per component and batch size, no CWRU data needed
+
+    python benchmarks/memory.py --batch_sizes 32 64 128 256 --budget_mb 4096 --out memory.json
+    python benchmarks/memory.py --batch_sizes 64 128 256 --compare_checkpointing
+
+Every tensor storage allocated during an adaptation step (source and target batch,
+classifier loss, AdversarialNet, DAN, backward and Adam update) is tracked, and the
+forward/backward hooks of each component record the memory it allocates. Unknown
+arguments are passed on to train_advanced.py, e.g. --hidden_size 512. The step time
+is the median of untracked steps. --compare_checkpointing profiles every batch size
+without and with activation checkpointing (--checkpoint_gcn, --checkpoint_cnn).
+"""
+import sys
+import json
+import time
+import weakref
+import argparse
+import warnings
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import numpy as np
+import torch
+from torch import nn
+from torch.utils._python_dispatch import TorchDispatchMode
+from torch.utils._pytree import tree_flatten
+from torch.utils.weak import WeakIdKeyDictionary
+import datasets
+from benchmark import peak_rss_mb
+from train_advanced import parse_args as parse_train_args
+from utils.train_utils_combines import train_utils
+from loss.DAN import DAN
+warnings.filterwarnings('ignore')
+
+MB = 2**20
+PHASES = {'forward': 'fwd', 'backward': 'bwd'}
+CHECKPOINTING = {'none': [], 'gcn': ['--checkpoint_gcn'], 'gcn+cnn': ['--checkpoint_gcn', '--checkpoint_cnn']}
+
+
+class Memory_Tracker(TorchDispatchMode):
+    """
+    Bytes of the tensor storages allocated while active and still alive.
+    CPU tensors are invisible to tracemalloc, so every op output is tracked
+    until its storage is freed, including storages only held by autograd.
+    """
+    def __init__(self):
+        super(Memory_Tracker, self).__init__()
+        self.storages = WeakIdKeyDictionary()
+        self.current = 0
+        self.peak = 0
+        # (name, phase) -> [start bytes, peak bytes] of the components running now
+        self.frames = {}
+
+    def _free(self, nbytes):
+        self.current -= nbytes
+
+    def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+        out = func(*args, **(kwargs or {}))
+        inputs = {id(t.untyped_storage()) for t in tree_flatten((args, kwargs))[0] if isinstance(t, torch.Tensor)}
+        for t in tree_flatten(out)[0]:
+            if not isinstance(t, torch.Tensor):
+                continue
+            storage = t.untyped_storage()
+            # Views and in-place results share the storage of an input
+            if storage in self.storages or id(storage) in inputs or storage.nbytes() == 0:
+                continue
+            self.storages[storage] = storage.nbytes()
+            weakref.finalize(storage, self._free, storage.nbytes())
+            self.current += storage.nbytes()
+        self.peak = max(self.peak, self.current)
+        for frame in self.frames.values():
+            frame[1] = max(frame[1], self.current)
+        return out
+
+    def reset_peak(self):
+        self.peak = self.current
+
+    def enter(self, name, phase):
+        self.frames[(name, phase)] = [self.current, self.current]
+
+    def exit(self, name, phase):
+        start, peak = self.frames.pop((name, phase), (self.current, self.current))
+        return peak - start, self.current - start
+
+
+class Loss_Module(nn.Module):
+    """Wrap a loss function so it can be hooked like the other components"""
+    def __init__(self, fn):
+        super(Loss_Module, self).__init__()
+        self.fn = fn
+
+    def forward(self, *inputs):
+        return self.fn(*inputs)
+
+
+def components(trainer):
+    """
+    The hooked modules, none of them has its output modified in place
+    """
+    model = trainer.model
+    named = [('CNN', model.model_cnn), ('MRF_GCN', model.model_GCN), ('GGL', model.model_GCN.atrr),
+             ('MultiChev', model.model_GCN.conv1), ('MultiChev_B', model.model_GCN.conv2),
+             ('classifier', trainer.classifier_layer), ('CrossEntropy', trainer.criterion)]
+    if trainer.args.bottleneck:
+        named.insert(5, ('bottleneck', trainer.bottleneck_layer))
+    if trainer.args.domain_adversarial:
+        named += [('AdversarialNet', trainer.AdversarialNet), ('BCE', trainer.adversarial_loss),
+                  ('DAN', trainer.structure_loss)]
+    return named
+
+
+def attach_hooks(named, tracker, records):
+    """
+    records[name][phase] = {'peak': MB allocated at the peak, 'retained': MB still allocated after}
+    """
+    handles = []
+    for name, module in named:
+        def pre_hook(phase, name=name):
+            return lambda *_: tracker.enter(name, phase)
+
+        def post_hook(phase, name=name):
+            def hook(*_):
+                peak, retained = tracker.exit(name, phase)
+                record = records.setdefault(name, {}).setdefault(phase, {'peak': 0.0, 'retained': 0.0})
+                record['peak'] = max(record['peak'], peak / MB)
+                record['retained'] = max(record['retained'], retained / MB)
+            return hook
+
+        handles += [module.register_forward_pre_hook(pre_hook('forward')),
+                    module.register_forward_hook(post_hook('forward')),
+                    module.register_full_backward_pre_hook(pre_hook('backward')),
+                    module.register_full_backward_hook(post_hook('backward'))]
+    return handles
+
+
+def build_trainer(train_argv, device):
+    args = parse_train_args(train_argv)
+    trainer = train_utils(args, None)
+    trainer.device = device
+    trainer.build_model(getattr(datasets, args.data_name).num_classes, args.max_epoch)
+    trainer.adversarial_loss = Loss_Module(nn.BCELoss())
+    trainer.structure_loss = Loss_Module(DAN)
+    trainer.criterion = Loss_Module(nn.CrossEntropyLoss())
+    modules = [trainer.model, trainer.classifier_layer]
+    if args.bottleneck:
+        modules.append(trainer.bottleneck_layer)
+    if args.domain_adversarial:
+        modules.append(trainer.AdversarialNet)
+    for module in modules:
+        module.to(device).train()
+    optimizer = torch.optim.Adam([p for module in modules for p in module.parameters()], lr=args.lr,
+                                 weight_decay=args.weight_decay)
+    return trainer, modules, optimizer
+
+
+def adaptation_step(trainer, optimizer, inputs, labels):
+    """One source_train step after middle_epoch, as in train_utils.train"""
+    args = trainer.args
+    features = trainer.model(inputs)
+    if args.bottleneck:
+        features = trainer.bottleneck_layer(features)
+    outputs = trainer.classifier_layer(features)
+    loss = trainer.criterion(outputs.narrow(0, 0, labels.size(0)), labels)
+    if args.domain_adversarial:
+        adversarial_label = torch.cat((torch.ones(labels.size(0)), torch.zeros(inputs.size(0) - labels.size(0))),
+                                      dim=0).to(inputs.device)
+        adversarial_loss = trainer.adversarial_loss(trainer.AdversarialNet(features), adversarial_label.unsqueeze(1))
+        structure_loss = trainer.structure_loss(features.narrow(0, 0, labels.size(0)),
+                                                features.narrow(0, labels.size(0), inputs.size(0) - labels.size(0)))
+        loss = loss + args.lam_adversarial * adversarial_loss + args.lam_adversarial * structure_loss
+    optimizer.zero_grad()
+    loss.backward()
+    optimizer.step()
+
+
+def profile_batch(train_argv, batch_size, device, signal_size=1024, repeat=3):
+    """
+    Profile the second step of a fresh model, the first one allocates the gradients and Adam state
+    :return: the per component records and the step totals in MB, and the step time in ms
+    """
+    torch.manual_seed(0)
+    trainer, modules, optimizer = build_trainer(train_argv, device)
+    num_classes = trainer.classifier_layer.out_features
+    # The backward hooks of the CNN only fire after its own backward when the input needs a gradient
+    inputs = torch.randn(2 * batch_size, 1, signal_size, device=device, requires_grad=True)
+    labels = torch.randint(num_classes, (batch_size,), device=device)
+    model_bytes = sum(t.numel() * t.element_size() for module in modules
+                      for t in list(module.parameters()) + list(module.buffers()))
+
+    records = {}
+    tracker = Memory_Tracker()
+    with tracker:
+        adaptation_step(trainer, optimizer, inputs, labels)
+        handles = attach_hooks(components(trainer), tracker, records)
+        tracker.reset_peak()
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+        adaptation_step(trainer, optimizer, inputs, labels)
+    for handle in handles:
+        handle.remove()
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        adaptation_step(trainer, optimizer, inputs, labels)
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        times.append((time.perf_counter() - start) * 1000)
+
+    totals = {
+        'model_mb': model_bytes / MB,
+        # gradients, Adam state and anything else kept between steps
+        'steady_mb': (model_bytes + tracker.current) / MB,
+        'peak_mb': (model_bytes + inputs.nbytes + labels.nbytes + tracker.peak) / MB,
+        'rss_mb': peak_rss_mb()[0],
+        'cuda_peak_mb': torch.cuda.max_memory_allocated() / MB if device.type == 'cuda' else None,
+        'step_ms': float(np.median(times)),
+    }
+    return records, totals
+
+
+def largest_batch(results, budget_mb):
+    """
+    The largest profiled batch within the budget, and the quadratic extrapolation of the
+    step peak (Gen_edge and guassian_kernel grow with the square of the batch)
+    """
+    batches = [r['batch_size'] for r in results]
+    peaks = [r['totals']['peak_mb'] for r in results]
+    fitting = [b for b, p in zip(batches, peaks) if p <= budget_mb]
+    measured = max(fitting) if fitting else None
+    if len(batches) < 3:
+        return measured, None
+    a, b, c = np.polyfit(batches, peaks, 2)
+    roots = [r.real for r in np.roots([a, b, c - budget_mb]) if abs(r.imag) < 1e-9 and r.real > 0]
+    return measured, int(max(roots)) if roots else None
+
+
+def print_table(results):
+    batches = [r['batch_size'] for r in results]
+    print('{:<30}'.format('MB') + ''.join('{:>12}'.format('batch ' + str(b)) for b in batches))
+    names = list(results[0]['components'])
+    for name in names:
+        for phase, short in PHASES.items():
+            for key in ['peak', 'retained']:
+                values = [r['components'].get(name, {}).get(phase, {}).get(key) for r in results]
+                print('{:<30}'.format('{} {} {}'.format(name, short, key)) +
+                      ''.join('{:>12}'.format('-' if v is None else '{:.2f}'.format(v)) for v in values))
+    for key, label in [('model_mb', 'parameters and buffers'), ('steady_mb', 'steady state'),
+                       ('peak_mb', 'step peak'), ('cuda_peak_mb', 'cuda allocator peak'),
+                       ('rss_mb', 'process peak rss'), ('step_ms', 'step ms')]:
+        values = [r['totals'][key] for r in results]
+        if all(v is None for v in values):
+            continue
+        print('{:<30}'.format(label) + ''.join('{:>12}'.format('-' if v is None else '{:.2f}'.format(v))
+                                               for v in values))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Memory profile of the DAGCN components per batch size')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[32, 64, 128], help='the batch sizes')
+    parser.add_argument('--device', type=str, default='cpu', help='the device to run on')
+    parser.add_argument('--budget_mb', type=float, default=None, help='report the largest batch within this memory')
+    parser.add_argument('--repeat', type=int, default=3, help='timed steps per batch size')
+    parser.add_argument('--compare_checkpointing', action='store_true',
+                        help='profile without and with activation checkpointing')
+    parser.add_argument('--out', type=str, default=None, help='the json file to save the results')
+    return parser.parse_known_args()
+
+
+def profile_batches(train_argv, batch_sizes, device, repeat=3):
+    results = []
+    # The process peak rss only grows, so the batch sizes are profiled in ascending order
+    for batch_size in sorted(batch_sizes):
+        records, totals = profile_batch(train_argv, batch_size, device, repeat=repeat)
+        results.append({'batch_size': batch_size, 'components': records, 'totals': totals})
+        print('batch {:<5} step peak {:>10.2f} MB  steady {:>10.2f} MB  step {:>9.1f} ms'.format(
+            batch_size, totals['peak_mb'], totals['steady_mb'], totals['step_ms']))
+    return results
+
+
+def print_comparison(modes):
+    """Step peak and time of every checkpointing mode relative to none"""
+    batches = [r['batch_size'] for r in modes['none']]
+    print('{:<30}'.format('checkpointing') + ''.join('{:>12}'.format('batch ' + str(b)) for b in batches))
+    for key, label in [('peak_mb', 'step peak MB'), ('step_ms', 'step ms')]:
+        for mode, results in modes.items():
+            print('{:<30}'.format('{} {}'.format(mode, label)) +
+                  ''.join('{:>12.2f}'.format(r['totals'][key]) for r in results))
+        for mode, results in modes.items():
+            if mode != 'none':
+                print('{:<30}'.format('{} / none {}'.format(mode, label.split()[-1])) +
+                      ''.join('{:>12.2f}'.format(r['totals'][key] / base['totals'][key])
+                              for r, base in zip(results, modes['none'])))
+
+
+if __name__ == '__main__':
+    args, train_argv = parse_args()
+    device = torch.device(args.device)
+    if args.compare_checkpointing:
+        modes = {}
+        for mode, mode_argv in CHECKPOINTING.items():
+            print('checkpointing: {}'.format(mode))
+            modes[mode] = profile_batches(train_argv + mode_argv, args.batch_sizes, device, args.repeat)
+        print_comparison(modes)
+        results = modes['none']
+    else:
+        results = profile_batches(train_argv, args.batch_sizes, device, args.repeat)
+        print_table(results)
+
+    if args.budget_mb is not None:
+        measured, estimated = largest_batch(results, args.budget_mb)
+        print('largest profiled batch within {:.0f} MB: {}'.format(args.budget_mb, measured or 'none'))
+        if estimated is not None:
+            print('extrapolated largest batch within {:.0f} MB: {}'.format(args.budget_mb, estimated))
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump({'train_args': train_argv, 'budget_mb': args.budget_mb,
+                       'results': modes if args.compare_checkpointing else results}, f, indent=2)
+        print('saved to {}'.format(args.out))
@@ -0,0 +1,287 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""
+Micro benchmarks of the hot components on synthetic inputs, no CWRU data needed
+
+    python benchmarks/micro.py run --out benchmarks/baseline.json
+    python benchmarks/micro.py compare benchmarks/baseline.json current.json --threshold 0.1
+
+Every case is timed over a sweep of batch sizes and feature widths. Modules with
+parameters are timed for a forward and backward pass, as in training.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import warnings
+from collections import namedtuple
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import numpy as np
+import torch
+from scipy.io import savemat
+from torch.profiler import profile, ProfilerActivity
+from models.MRF_GCN import Gen_edge, GGL, MultiChev, MultiChev_B, MRF_GCN
+from models.CNN import CNN
+from models.AdversarialNet import AdversarialNet
+from loss.DAN import DAN, guassian_kernel
+from datasets.CWRU import data_load, signal_size
+from datasets.sequence_aug import Compose, Reshape, Normalize, Retype
+warnings.filterwarnings('ignore')
+
+# build(batch, width, device) -> a function running one call of the component
+# memory: 'torch' measures tensor allocations, 'numpy' measures python/numpy allocations
+# fixed_width: the component only runs at its own widths, --widths does not apply to it
+Case = namedtuple('Case', ['name', 'widths', 'build', 'memory', 'fixed_width'], defaults=[False])
+
+# torch.profiler._memory_profiler is private, peak_memory relies on its layout as of this version
+MEMORY_PROFILER_TORCH = (2, 1)
+
+
+def train_step(module, *inputs):
+    def fn():
+        out = module(*inputs)
+        out = out[0] if isinstance(out, tuple) else out
+        out.float().sum().backward()
+    return fn
+
+
+def random_graph(batch, device):
+    values, edge_index = Gen_edge(torch.rand(batch, 10))
+    return edge_index.to(device), values.view(-1).to(device)
+
+
+def build_gen_edge(batch, width, device):
+    atrr = torch.rand(batch, width, device=device)
+    return lambda: Gen_edge(atrr)
+
+
+def build_ggl(batch, width, device):
+    return train_step(GGL().to(device), torch.randn(batch, width, device=device))
+
+
+def build_multichev(layer):
+    def build(batch, width, device):
+        edge_index, edge_weight = random_graph(batch, device)
+        return train_step(layer(width).to(device), torch.randn(batch, width, device=device), edge_index, edge_weight)
+    return build
+
+
+def build_mrf_gcn(batch, width, device):
+    return train_step(MRF_GCN(in_channel=width).to(device), torch.randn(batch, width, device=device))
+
+
+def build_cnn(batch, width, device):
+    return train_step(CNN().to(device), torch.randn(batch, 1, width, device=device))
+
+
+def build_kernel(loss):
+    def build(batch, width, device):
+        source = torch.randn(batch, width, device=device, requires_grad=True)
+        target = torch.randn(batch, width, device=device, requires_grad=True)
+        return train_step(loss, source, target)
+    return build
+
+
+def build_adversarial(batch, width, device):
+    return train_step(AdversarialNet(256, width).to(device), torch.randn(batch, 256, device=device, requires_grad=True))
+
+
+def build_data_load(batch, width, device):
+    # One recording holding batch segments, stored like the CWRU files
+    path = os.path.join(tempfile.gettempdir(), 'dagcn_bench_{}x{}'.format(batch, width), '097.mat')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    savemat(path, {'X097_DE_time': np.random.randn(batch * width, 1)})
+    return lambda: data_load(path, '097.mat', 0)
+
+
+def build_normalize(batch, width, device):
+    transform = Compose([Reshape(), Normalize('mean-std'), Retype()])
+    seqs = [np.random.randn(width).astype(np.float32) for _ in range(batch)]
+    return lambda: [transform(seq) for seq in seqs]
+
+
+CASES = [
+    Case('Gen_edge', [10, 64], build_gen_edge, 'torch'),
+    Case('GGL', [256], build_ggl, 'torch', fixed_width=True),
+    Case('MultiChev', [256, 512], build_multichev(MultiChev), 'torch'),
+    Case('MultiChev_B', [600, 1200], build_multichev(MultiChev_B), 'torch'),
+    Case('MRF_GCN', [256], build_mrf_gcn, 'torch', fixed_width=True),
+    Case('CNN', [1024, 2048], build_cnn, 'torch'),
+    Case('guassian_kernel', [256, 1024], build_kernel(guassian_kernel), 'torch'),
+    Case('DAN', [256, 1024], build_kernel(DAN), 'torch'),
+    Case('AdversarialNet', [256, 1024], build_adversarial, 'torch'),
+    Case('data_load', [signal_size], build_data_load, 'numpy'),
+    Case('Normalize', [1024, 4096], build_normalize, 'numpy'),
+]
+
+
+def time_fn(fn, warmup=3, repeat=20):
+    """return: per-call times in ms"""
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def torch_version():
+    return tuple(int(v) for v in torch.__version__.split('+')[0].split('.')[:2])
+
+
+def peak_memory(fn, kind, device):
+    """
+    Peak memory (MB) allocated during one call, None when it cannot be measured
+    """
+    if kind == 'numpy':
+        tracemalloc.start()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return peak / 2**20
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated()
+        fn()
+        torch.cuda.synchronize()
+        return (torch.cuda.max_memory_allocated() - base) / 2**20
+    if torch_version() < MEMORY_PROFILER_TORCH:
+        print('peak memory on cpu needs torch >= {}.{}, found {}'.format(
+            *MEMORY_PROFILER_TORCH, torch.__version__), file=sys.stderr)
+        return None
+    try:
+        # The memory timeline of torch.profiler is the only view of CPU tensor allocations
+        from torch.profiler._memory_profiler import MemoryProfileTimeline
+        with profile(activities=[ProfilerActivity.CPU], profile_memory=True, record_shapes=True,
+                     with_stack=True) as prof:
+            fn()
+        _, sizes = MemoryProfileTimeline(prof._memory_profile())._coalesce_timeline('cpu')
+        return max(sum(s) for s in sizes) / 2**20 if sizes else 0.0
+    except Exception as e:
+        print('peak memory failed: {!r}'.format(e), file=sys.stderr)
+        return None
+
+
+def run(cases, batch_sizes, widths=None, device='cpu', threads=0, warmup=3, repeat=20, memory=True):
+    """
+    :param widths: overrides the default widths of every case without fixed_width
+    :return: {'meta': ..., 'results': {'{name}/b{batch}/w{width}': {...}}}
+    """
+    device = torch.device(device)
+    if threads > 0:
+        torch.set_num_threads(threads)
+    results = {}
+    for case in cases:
+        if widths and case.fixed_width:
+            print('{}: --widths ignored, it only runs at {}'.format(case.name, case.widths))
+        for width in (case.widths if case.fixed_width else widths or case.widths):
+            for batch in batch_sizes:
+                torch.manual_seed(0)
+                np.random.seed(0)
+                fn = case.build(batch, width, device)
+                times = time_fn(fn, warmup, repeat)
+                key = '{}/b{}/w{}'.format(case.name, batch, width)
+                results[key] = {
+                    'name': case.name, 'batch': batch, 'width': width,
+                    'median_ms': float(np.median(times)), 'min_ms': float(np.min(times)),
+                    'p90_ms': float(np.percentile(times, 90)),
+                    'peak_mb': peak_memory(fn, case.memory, device) if memory else None,
+                }
+                r = results[key]
+                peak = '-' if r['peak_mb'] is None else '{:.2f}'.format(r['peak_mb'])
+                print('{:<32} median {:>9.3f} ms  min {:>9.3f} ms  peak {:>8} MB'.format(
+                    key, r['median_ms'], r['min_ms'], peak))
+    meta = {
+        'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'torch': torch.__version__, 'python': platform.python_version(),
+        'platform': platform.platform(), 'processor': platform.processor(),
+        'device': str(device), 'threads': torch.get_num_threads(),
+        'warmup': warmup, 'repeat': repeat,
+    }
+    return {'meta': meta, 'results': results}
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+    Compare two result files, a case regresses when its median time or peak memory
+    grows by more than threshold
+    :return: the list of regressed keys
+    """
+    regressions = []
+    print('{:<32} {:>12} {:>12} {:>8} {:>10} {:>10} {:>8}'.format(
+        'case', 'base ms', 'new ms', 'ratio', 'base MB', 'new MB', 'ratio'))
+    for key, base in baseline['results'].items():
+        new = current['results'].get(key)
+        if new is None:
+            continue
+        time_ratio = new['median_ms'] / max(base['median_ms'], 1e-9)
+        mem_ratio = None
+        if base['peak_mb'] is not None and new['peak_mb'] is not None and base['peak_mb'] > 0:
+            mem_ratio = new['peak_mb'] / base['peak_mb']
+        regressed = time_ratio > 1 + threshold or (mem_ratio is not None and mem_ratio > 1 + threshold)
+        if regressed:
+            regressions.append(key)
+        print('{:<32} {:>12.3f} {:>12.3f} {:>8.2f} {:>10} {:>10} {:>8} {}'.format(
+            key, base['median_ms'], new['median_ms'], time_ratio,
+            '-' if base['peak_mb'] is None else '{:.2f}'.format(base['peak_mb']),
+            '-' if new['peak_mb'] is None else '{:.2f}'.format(new['peak_mb']),
+            '-' if mem_ratio is None else '{:.2f}'.format(mem_ratio),
+            'REGRESSION' if regressed else ''))
+    missing = [key for key in baseline['results'] if key not in current['results']]
+    if missing:
+        print('not in the current results: {}'.format(', '.join(missing)))
+    print('{} of {} cases regressed by more than {:.0%}'.format(
+        len(regressions), len(baseline['results']) - len(missing), threshold))
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Micro benchmarks of the DAGCN components')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='run the benchmarks and save the results as json')
+    run_parser.add_argument('--cases', type=str, nargs='*', default=None, help='case names, default all')
+    run_parser.add_argument('--batch_sizes', type=int, nargs='+', default=[32, 64, 128], help='the batch sizes')
+    run_parser.add_argument('--widths', type=int, nargs='+', default=None,
+                            help='override the feature widths of every case that is not fixed to its own')
+    run_parser.add_argument('--device', type=str, default='cpu', help='the device to run on')
+    run_parser.add_argument('--threads', type=int, default=0, help='the number of torch threads, 0 keeps the default')
+    run_parser.add_argument('--warmup', type=int, default=3, help='untimed calls before timing')
+    run_parser.add_argument('--repeat', type=int, default=20, help='timed calls per configuration')
+    run_parser.add_argument('--no_memory', action='store_true', help='skip the peak memory measurement')
+    run_parser.add_argument('--out', type=str, default=None, help='the json file to save the results')
+
+    compare_parser = subparsers.add_parser('compare', help='flag regressions against a baseline')
+    compare_parser.add_argument('baseline', type=str, help='the baseline json')
+    compare_parser.add_argument('current', type=str, help='the json to check')
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help='the allowed relative slowdown')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.command == 'run':
+        cases = CASES if not args.cases else [case for case in CASES if case.name in args.cases]
+        report = run(cases, args.batch_sizes, args.widths, args.device, args.threads, args.warmup,
+                     args.repeat, not args.no_memory)
+        if args.out:
+            with open(args.out, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            print('saved to {}'.format(args.out))
+    else:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        with open(args.current, 'r', encoding='utf-8') as f:
+            current = json.load(f)
+        sys.exit(1 if compare(baseline, current, args.threshold) else 0)
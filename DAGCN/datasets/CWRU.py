@@ -17,54 +17,74 @@ DOMAIN_MAP = {0: '0HP', 1: '1HP', 2: '2HP', 3: '3HP'}
 CLASS_MAP = {'normal': 0, 'inner': 1, 'ball': 2, 'outer': 3}
 
 
-def get_files(root, N):
+def get_files(root, N, cache=None):
     """
     加载指定域的所有数据
     root: 数据根目录
     N: 域ID列表，如 [3] 表示加载3HP的数据
+    cache: 可选的dict，按 (root, 域ID) 缓存已加载的域，同一进程内多个任务共享
     return: [data_list, label_list] - 分段后的样本列表
     """
     data, lab = [], []
     
     for d in tqdm(N, desc="Loading domains"):
-        dom = DOMAIN_MAP[int(d)]
-        
-        for cname, cid in CLASS_MAP.items():
-            cdir = os.path.join(root, cname, dom)
-            
-            if not os.path.isdir(cdir):
-                print(f"警告: 目录不存在 {cdir}")
-                continue
-            
-            mat_files = [f for f in os.listdir(cdir) if f.lower().endswith('.mat')]
-            
-            if len(mat_files) == 0:
-                print(f"警告: {cdir} 中没有.mat文件")
-                continue
-            
-            print(f"  加载 {cname}/{dom}: {len(mat_files)} 个文件")
-            
-            for fn in mat_files:
-                filepath = os.path.join(cdir, fn)
-                try:
-                    data_segments, lab_segments = data_load(filepath, fn, cid)
-                    data.extend(data_segments)
-                    lab.extend(lab_segments)
-                except Exception as e:
-                    print(f"  错误: 无法加载 {filepath}: {e}")
-                    continue
+        if cache is not None and (root, int(d)) in cache:
+            dom_data, dom_lab = cache[(root, int(d))]
+            data.extend(dom_data)
+            lab.extend(dom_lab)
+            continue
+        dom_data, dom_lab = load_domain(root, d)
+        if cache is not None:
+            cache[(root, int(d))] = (dom_data, dom_lab)
+        data.extend(dom_data)
+        lab.extend(dom_lab)
     
     print(f"总共加载 {len(data)} 个样本")
     return [data, lab]
 
 
-def data_load(filename, axisname, label):
+def load_domain(root, d):
     """
-    从 .mat 文件中读取 DE 通道数据并分段
+    加载单个域的所有数据
+    return: (data_list, label_list)
+    """
+    data, lab = [], []
+    dom = DOMAIN_MAP[int(d)]
+
+    for cname, cid in CLASS_MAP.items():
+        cdir = os.path.join(root, cname, dom)
+        
+        if not os.path.isdir(cdir):
+            print(f"警告: 目录不存在 {cdir}")
+            continue
+        
+        mat_files = [f for f in os.listdir(cdir) if f.lower().endswith('.mat')]
+        
+        if len(mat_files) == 0:
+            print(f"警告: {cdir} 中没有.mat文件")
+            continue
+        
+        print(f"  加载 {cname}/{dom}: {len(mat_files)} 个文件")
+        
+        for fn in mat_files:
+            filepath = os.path.join(cdir, fn)
+            try:
+                data_segments, lab_segments = data_load(filepath, fn, cid)
+                data.extend(data_segments)
+                lab.extend(lab_segments)
+            except Exception as e:
+                print(f"  错误: 无法加载 {filepath}: {e}")
+                continue
+
+    return data, lab
+
+
+def read_signal(filename, axisname):
+    """
+    从 .mat 文件中读取 DE 通道数据
     filename: .mat 文件路径
     axisname: 文件名
-    label: 类别标签
-    return: (data_list, label_list)
+    return: 一维 float32 信号
     """
     # 载入 .mat 文件
     m = loadmat(filename)
@@ -101,6 +121,18 @@ def data_load(filename, axisname, label):
     fl = np.asarray(m[var]).squeeze().astype(np.float32)
     if fl.ndim != 1:
         fl = fl.reshape(-1).astype(np.float32)
+    return fl
+
+
+def data_load(filename, axisname, label):
+    """
+    从 .mat 文件中读取 DE 通道数据并分段
+    filename: .mat 文件路径
+    axisname: 文件名
+    label: 类别标签
+    return: (data_list, label_list)
+    """
+    fl = read_signal(filename, axisname)
 
     # 按 signal_size 分段
     data, lab = [], []
@@ -119,9 +151,12 @@ def data_load(filename, axisname, label):
 class CWRU(object):
     num_classes = 4  # normal, inner, ball, outer
     inputchannel = 1
+    signal_size = signal_size
+    class_names = list(CLASS_MAP)
     
-    def __init__(self, data_dir, transfer_task, normlizetype="mean-std"):
+    def __init__(self, data_dir, transfer_task, normlizetype="mean-std", cache=None):
         self.data_dir = data_dir
+        self.cache = cache
         self.source_N = transfer_task[0]
         self.target_N = transfer_task[1]
         self.normlizetype = normlizetype
@@ -138,54 +173,43 @@ class CWRU(object):
             ])
         }
 
+    def domain_split(self, N, name="目标域"):
+        """
+        加载域N并按8:2分层划分为训练集和验证集
+        name: 打印信息中的域名称
+        return: (train_dataset, val_dataset)
+        """
+        print(f"\n{'='*50}")
+        print(f"加载{name}: {N} ({[DOMAIN_MAP[i] for i in N]})")
+        print(f"{'='*50}")
+        list_data = get_files(self.data_dir, N, self.cache)
+        data_pd = pd.DataFrame({"data": list_data[0], "label": list_data[1]})
+
+        print(f"\n{name}类别分布:")
+        label_counts = data_pd['label'].value_counts().sort_index()
+        for label_id, count in label_counts.items():
+            class_name = [k for k, v in CLASS_MAP.items() if v == label_id][0]
+            print(f"  {class_name} (ID={label_id}): {count} 个样本")
+
+        # 检查是否有足够的样本进行分层划分
+        min_samples = label_counts.min()
+        if min_samples < 2:
+            raise ValueError(f"{name}中某些类别样本数少于2个，无法进行分层划分。最少样本数: {min_samples}")
+
+        train_pd, val_pd = train_test_split(
+            data_pd, test_size=0.2, random_state=40, stratify=data_pd["label"]
+        )
+        train_set = dataset(list_data=train_pd, transform=self.data_transforms['train'])
+        val_set = dataset(list_data=val_pd, transform=self.data_transforms['val'])
+        return train_set, val_set
+
     def data_split(self, transfer_learning=True):
         if transfer_learning:
             # 加载源域数据
-            print(f"\n{'='*50}")
-            print(f"加载源域: {self.source_N} ({[DOMAIN_MAP[i] for i in self.source_N]})")
-            print(f"{'='*50}")
-            list_data = get_files(self.data_dir, self.source_N)
-            data_pd = pd.DataFrame({"data": list_data[0], "label": list_data[1]})
-            
-            print("\n源域类别分布:")
-            label_counts = data_pd['label'].value_counts().sort_index()
-            for label_id, count in label_counts.items():
-                class_name = [k for k, v in CLASS_MAP.items() if v == label_id][0]
-                print(f"  {class_name} (ID={label_id}): {count} 个样本")
-            
-            # 检查是否有足够的样本进行分层划分
-            min_samples = label_counts.min()
-            if min_samples < 2:
-                raise ValueError(f"源域中某些类别样本数少于2个，无法进行分层划分。最少样本数: {min_samples}")
-            
-            train_pd, val_pd = train_test_split(
-                data_pd, test_size=0.2, random_state=40, stratify=data_pd["label"]
-            )
-            source_train = dataset(list_data=train_pd, transform=self.data_transforms['train'])
-            source_val = dataset(list_data=val_pd, transform=self.data_transforms['val'])
+            source_train, source_val = self.domain_split(self.source_N, "源域")
 
             # 加载目标域数据
-            print(f"\n{'='*50}")
-            print(f"加载目标域: {self.target_N} ({[DOMAIN_MAP[i] for i in self.target_N]})")
-            print(f"{'='*50}")
-            list_data = get_files(self.data_dir, self.target_N)
-            data_pd = pd.DataFrame({"data": list_data[0], "label": list_data[1]})
-            
-            print("\n目标域类别分布:")
-            label_counts = data_pd['label'].value_counts().sort_index()
-            for label_id, count in label_counts.items():
-                class_name = [k for k, v in CLASS_MAP.items() if v == label_id][0]
-                print(f"  {class_name} (ID={label_id}): {count} 个样本")
-            
-            min_samples = label_counts.min()
-            if min_samples < 2:
-                raise ValueError(f"目标域中某些类别样本数少于2个。最少样本数: {min_samples}")
-            
-            train_pd, val_pd = train_test_split(
-                data_pd, test_size=0.2, random_state=40, stratify=data_pd["label"]
-            )
-            target_train = dataset(list_data=train_pd, transform=self.data_transforms['train'])
-            target_val = dataset(list_data=val_pd, transform=self.data_transforms['val'])
+            target_train, target_val = self.domain_split(self.target_N, "目标域")
             
             print(f"\n{'='*50}")
             print("数据划分完成:")
@@ -199,7 +223,7 @@ class CWRU(object):
         
         else:
             # 非迁移学习模式
-            list_data = get_files(self.data_dir, self.source_N)
+            list_data = get_files(self.data_dir, self.source_N, self.cache)
             data_pd = pd.DataFrame({"data": list_data[0], "label": list_data[1]})
             train_pd, val_pd = train_test_split(
                 data_pd, test_size=0.2, random_state=40, stratify=data_pd["label"]
@@ -207,7 +231,7 @@ class CWRU(object):
             source_train = dataset(list_data=train_pd, transform=self.data_transforms['train'])
             source_val = dataset(list_data=val_pd, transform=self.data_transforms['val'])
 
-            list_data = get_files(self.data_dir, self.target_N)
+            list_data = get_files(self.data_dir, self.target_N, self.cache)
             data_pd = pd.DataFrame({"data": list_data[0], "label": list_data[1]})
             target_val = dataset(list_data=data_pd, transform=self.data_transforms['val'])
             
@@ -0,0 +1,223 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""
+Distill a trained DAGCN into graph-free CNN students for edge devices
+
+    python distill.py --model ./checkpoint/DAGCN_Task_0to1_20251023_172653 --students cnn-1.0 cnn-0.5 ds-1.0 ds-0.5 --out_dir students/
+
+A student is models.Student_CNN, cnn-<width> with plain and ds-<width> with depthwise-separable
+convolutions, width scaling the channels of the CNN of DAGCN_features. The teacher runs once,
+in eval mode and on graphs of batch_size windows, over the source_train split (labeled) and
+the target_train split (unlabeled) of the run. A student is trained on both with the
+temperature-scaled KL divergence to the teacher logits and the MSE to the teacher bottleneck
+features, plus cross entropy on the source labels. Neither the student nor its TorchScript
+artifact needs torch_geometric or a batch of windows, one window is classified on its own.
+The report lists the parameters, the latency on a batch and a single window, and the
+target_val accuracy and agreement with the teacher for every TRANSFER_TASKS task starting
+from the source domain of the run.
+"""
+import os
+import json
+import argparse
+import warnings
+import numpy as np
+import torch
+from torch import nn
+import torch.nn.functional as F
+import datasets
+from models import Student_CNN
+from export import load_pipeline, time_calls, normalize_batch
+from inference import find_best_model
+from quantize import domain_windows, predict
+from reference_bank import run_train_args
+from scripts.config import TRANSFER_TASKS
+
+warnings.filterwarnings('ignore')
+
+STUDENT_KINDS = {'cnn': False, 'ds': True}
+
+
+class Student_Pipeline(nn.Module):
+    """Normalize + Student_CNN on raw (batch, signal_size) windows, like export.Inference_Pipeline"""
+    def __init__(self, student, normlizetype='mean-std'):
+        super(Student_Pipeline, self).__init__()
+        self.normlizetype = normlizetype
+        self.student = student
+
+    def forward(self, x):
+        return self.student(normalize_batch(x, self.normlizetype).unsqueeze(1))
+
+
+def parse_student(spec):
+    """'cnn-0.5' -> (False, 0.5), 'ds-1.0' -> (True, 1.0)"""
+    kind, width = spec.split('-')
+    if kind not in STUDENT_KINDS:
+        raise ValueError('unknown student {}, expected cnn-<width> or ds-<width>'.format(spec))
+    return STUDENT_KINDS[kind], float(width)
+
+
+def count_parameters(model):
+    return sum(p.numel() for p in model.parameters())
+
+
+def teacher_targets(model_all, dataset, batch_size=64):
+    """
+    The normalized windows of dataset in a random order, with the teacher logits and bottleneck
+    features computed on graphs of batch_size consecutive windows
+    """
+    loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, shuffle=True)
+    inputs, labels, logits, features = [], [], [], []
+    with torch.inference_mode():
+        for x, y in loader:
+            feature = model_all[1](model_all[0](x))
+            inputs.append(x)
+            labels.append(y)
+            features.append(feature)
+            logits.append(model_all[2](feature))
+    return torch.cat(inputs), torch.cat(labels), torch.cat(logits), torch.cat(features)
+
+
+def distillation_loss(student, x, teacher_logits, teacher_features, temperature, feature_weight):
+    """The KL divergence to the softened teacher logits plus the feature MSE, and the student logits"""
+    features = student.features(x)
+    logits = student.classifier(features)
+    kl = F.kl_div(F.log_softmax(logits / temperature, dim=1), F.softmax(teacher_logits / temperature, dim=1),
+                  reduction='batchmean') * temperature ** 2
+    return kl + feature_weight * F.mse_loss(features, teacher_features), logits
+
+
+def train_student(student, source, target, args):
+    """
+    :param source: (windows, labels, teacher logits, teacher features) of source_train
+    :param target: the same for target_train, its labels are not used
+    """
+    optimizer = torch.optim.Adam(student.parameters(), lr=args.lr, weight_decay=args.weight_decay)
+    lr_scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, args.epochs)
+    n_source, n_target = len(source[0]), len(target[0])
+    for epoch in range(args.epochs):
+        student.train()
+        source_order, target_order = torch.randperm(n_source), torch.randperm(n_target)
+        epoch_loss, epoch_acc = 0.0, 0
+        for i in range(0, n_source, args.batch_size):
+            s = source_order[i:i + args.batch_size]
+            t = target_order[torch.arange(i, i + len(s)) % n_target]
+            source_loss, logits = distillation_loss(student, source[0][s], source[2][s], source[3][s],
+                                                    args.temperature, args.feature_weight)
+            target_loss, _ = distillation_loss(student, target[0][t], target[2][t], target[3][t],
+                                               args.temperature, args.feature_weight)
+            ce = F.cross_entropy(logits, source[1][s])
+            loss = args.alpha * (source_loss + target_loss) + (1 - args.alpha) * ce
+
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            epoch_loss += loss.item() * len(s)
+            epoch_acc += (logits.argmax(dim=1) == source[1][s]).sum().item()
+        lr_scheduler.step()
+        if (epoch + 1) % args.print_epoch == 0 or epoch == args.epochs - 1:
+            print('epoch {}/{} loss {:.4f} source acc {:.4f}'.format(epoch + 1, args.epochs,
+                                                                   epoch_loss / n_source, epoch_acc / n_source))
+    return student.eval()
+
+
+def latency(model, windows, batch_size, repeat):
+    """median ms of a batch_size call and of a single window call"""
+    return (float(np.median(time_calls(model, windows[:batch_size], repeat=repeat))),
+            float(np.median(time_calls(model, windows[:1], repeat=repeat))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Distill a trained DAGCN into graph-free CNN students')
+    parser.add_argument('--model', type=str, required=True, help='a *-best_model.pth file or a run directory')
+    parser.add_argument('--students', type=str, nargs='+', default=['cnn-1.0', 'cnn-0.5', 'ds-1.0', 'ds-0.5'],
+                        help='cnn-<width> or ds-<width> (depthwise-separable), width scales the channels')
+    parser.add_argument('--out_dir', type=str, default='students', help='the directory of the artifacts and the report')
+    parser.add_argument('--data_dir', type=str, default=None, help='the data directory, default the one of the run')
+    parser.add_argument('--tasks', type=str, nargs='*', default=None,
+                        help='TRANSFER_TASKS to report, default every task from the source domain of the run')
+    parser.add_argument('--epochs', type=int, default=60, help='training epochs of each student')
+    parser.add_argument('--batch_size', type=int, default=64, help='windows per step, also the graph size of the teacher')
+    parser.add_argument('--lr', type=float, default=1e-3, help='the initial learning rate, cosine annealed')
+    parser.add_argument('--weight_decay', type=float, default=1e-5, help='the weight decay')
+    parser.add_argument('--temperature', type=float, default=4.0, help='the softmax temperature of the distillation')
+    parser.add_argument('--alpha', type=float, default=0.7, help='the weight of the distillation against the source labels')
+    parser.add_argument('--feature_weight', type=float, default=0.1, help='the weight of the feature MSE')
+    parser.add_argument('--print_epoch', type=int, default=10, help='the interval of log training information')
+    parser.add_argument('--seed', type=int, default=0, help='the seed of the teacher batches and the students')
+    parser.add_argument('--threads', type=int, default=0, help='the number of torch threads, 0 keeps the default')
+    parser.add_argument('--repeat', type=int, default=30, help='timed calls for the latency')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(args.seed)
+    os.makedirs(args.out_dir, exist_ok=True)
+    model_path = find_best_model(args.model) if os.path.isdir(args.model) else args.model
+    run_dir = os.path.dirname(os.path.abspath(model_path))
+    pipeline, model_all, config = load_pipeline(model_path)
+    train_args, transfer_task = run_train_args(run_dir)
+    data_dir = args.data_dir or train_args['data_dir']
+    Dataset = getattr(datasets, train_args['data_name'])
+
+    source_train, _ = Dataset(data_dir, transfer_task, train_args['normlizetype']).domain_split(transfer_task[0], "源域")
+    target_train, _ = Dataset(data_dir, transfer_task, train_args['normlizetype']).domain_split(transfer_task[1])
+    source = teacher_targets(model_all, source_train, args.batch_size)
+    target = teacher_targets(model_all, target_train, args.batch_size)
+
+    tasks = args.tasks or [t for t, task in TRANSFER_TASKS.items() if task['source'] == transfer_task[0]]
+    task_windows = {}
+    for task_id in tasks:
+        _, target_val = Dataset(data_dir, [transfer_task[0], TRANSFER_TASKS[task_id]['target']],
+                                train_args['normlizetype']).domain_split(TRANSFER_TASKS[task_id]['target'])
+        task_windows[task_id] = domain_windows(target_val)
+    timing_windows = source[0][:args.batch_size].view(-1, config['signal_size'])
+
+    teacher_parameters = count_parameters(model_all)
+    batch_ms, _ = latency(pipeline, timing_windows, args.batch_size, args.repeat)
+    teacher_pred = {task_id: predict(pipeline, windows, args.batch_size) for task_id, (windows, _) in task_windows.items()}
+    report = {'teacher': {'model': model_path, 'parameters': teacher_parameters, 'batch_ms': batch_ms,
+                          'window_ms': batch_ms / args.batch_size, 'single_ms': None,
+                          'tasks': {task_id: float((teacher_pred[task_id] == labels).float().mean())
+                                    for task_id, (_, labels) in task_windows.items()}},
+              'batch_size': args.batch_size, 'config': vars(args), 'students': {}}
+
+    for spec in args.students:
+        separable, width = parse_student(spec)
+        print('\n' + '='*20 + ' student {} '.format(spec) + '='*20)
+        student = Student_CNN(config['num_classes'], config['inputchannel'], width, separable)
+        train_student(student, source, target, args)
+        student_pipeline = Student_Pipeline(student, config['normlizetype']).eval()
+        out_path = os.path.join(args.out_dir, 'student_{}.pt'.format(spec))
+        torch.jit.save(torch.jit.script(student_pipeline), out_path,
+                       _extra_files={'model_config.json': json.dumps(dict(config, model_name='Student_CNN',
+                                                                          width=width, separable=separable))})
+        print('saved to {}'.format(out_path))
+
+        batch_ms, single_ms = latency(student_pipeline, timing_windows, args.batch_size, args.repeat)
+        result = {'artifact': out_path, 'parameters': count_parameters(student), 'batch_ms': batch_ms,
+                  'window_ms': batch_ms / args.batch_size, 'single_ms': single_ms, 'tasks': {}, 'agreement': {}}
+        for task_id, (windows, labels) in task_windows.items():
+            pred = predict(student_pipeline, windows, args.batch_size)
+            result['tasks'][task_id] = float((pred == labels).float().mean())
+            result['agreement'][task_id] = float((pred == teacher_pred[task_id]).float().mean())
+        report['students'][spec] = result
+
+    print('\n{:<10} {:>10} {:>10} {:>10} {:>10} {:>10}'.format('model', 'params', 'batch ms', 'ms/window',
+                                                              'single ms', 'mean acc'))
+    for name, result in [('teacher', report['teacher'])] + list(report['students'].items()):
+        single = '{:.3f}'.format(result['single_ms']) if result['single_ms'] is not None else '-'
+        print('{:<10} {:>10} {:>10.2f} {:>10.3f} {:>10} {:>10.4f}'.format(
+            name, result['parameters'], result['batch_ms'], result['window_ms'], single,
+            float(np.mean(list(result['tasks'].values())))))
+    print('\n{:<12} {:>10}'.format('task', 'teacher') + ''.join(' {:>10}'.format(s) for s in report['students']))
+    for task_id in tasks:
+        print('{:<12} {:>10.4f}'.format(task_id, report['teacher']['tasks'][task_id]) +
+              ''.join(' {:>10.4f}'.format(r['tasks'][task_id]) for r in report['students'].values()))
+
+    report_path = os.path.join(args.out_dir, 'distill_report.json')
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print('saved to {}'.format(report_path))
@@ -0,0 +1,345 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""
+Export a trained model_all as a single artifact running on raw windows
+
+    python export.py torchscript --model ./checkpoint/DAGCN_Task_0to1_20251023_172653 --out dagcn.pt --inputs data/
+    python export.py onnx --model ./checkpoint/DAGCN_Task_0to1_20251023_172653 --out dagcn.onnx --inputs data/
+    python export.py optimize --model ./checkpoint/DAGCN_Task_0to1_20251023_172653 --inputs data/
+
+The artifact covers Normalize, the CNN, MRF_GCN with its graph generation and Chebyshev
+propagation rewritten in dense tensor ops (models/MRF_GCN_dense.py), the bottleneck and
+the classifier. It takes (batch, signal_size) raw windows of any batch size and returns
+the logits. Neither torch.jit.load nor ONNX Runtime needs this repository or
+torch_geometric; the model config is stored in the artifact (model_config.json, or the
+ONNX metadata). Edges are not dropped in the exported graph, so the eager model is
+compared with its edge dropout turned off. The onnx command needs the onnx and
+onnxruntime packages. The optimize command checks and times models/fold.py
+(BatchNorm folding, Dropout removal) on the eager model and the pipeline, --optimize
+exports the folded pipeline.
+"""
+import os
+import sys
+import copy
+import json
+import time
+import argparse
+import subprocess
+import warnings
+import numpy as np
+import torch
+from torch import nn
+from models.MRF_GCN_dense import MRF_GCN_dense
+from models.fold import optimize_for_inference
+from inference import load_model, find_best_model, find_recordings, read_recording, sliding_windows, normalize_windows
+
+warnings.filterwarnings('ignore')
+
+
+def normalize_batch(x, normlizetype: str):
+    # datasets.sequence_aug.Normalize per window
+    if normlizetype == '0-1':
+        low = x.min(dim=1, keepdim=True)[0]
+        return (x - low) / (x.max(dim=1, keepdim=True)[0] - low)
+    elif normlizetype == '-1-1':
+        low = x.min(dim=1, keepdim=True)[0]
+        return 2 * (x - low) / (x.max(dim=1, keepdim=True)[0] - low) - 1
+    elif normlizetype == 'mean-std':
+        return (x - x.mean(dim=1, keepdim=True)) / x.std(dim=1, unbiased=False, keepdim=True)
+    raise ValueError('This normalization is not included!')
+
+
+class Inference_Pipeline(nn.Module):
+    """
+    Normalize + CNN + MRF_GCN_dense + bottleneck + classifier on raw (batch, signal_size) windows
+    """
+    def __init__(self, model_all, normlizetype='mean-std'):
+        super(Inference_Pipeline, self).__init__()
+        features = model_all[0]
+        self.normlizetype = normlizetype
+        self.cnn = copy.deepcopy(features.model_cnn)
+        self.gcn = MRF_GCN_dense.from_mrf_gcn(features.model_GCN)
+        self.bottleneck = copy.deepcopy(model_all[1])
+        self.classifier = copy.deepcopy(model_all[2])
+
+    def normalize(self, x):
+        return normalize_batch(x, self.normlizetype)
+
+    def forward(self, x):
+        x = self.normalize(x).unsqueeze(1)
+        x = self.cnn(x)
+        x = self.gcn(x)
+        x = self.bottleneck(x)
+        return self.classifier(x)
+
+
+def load_pipeline(model_path, device='cpu', optimize=False):
+    """
+    :param optimize: fold the pipeline with models.fold.optimize_for_inference
+    :return: (pipeline in eval mode, eager model_all without edge dropout, model config)
+    """
+    if os.path.isdir(model_path):
+        model_path = find_best_model(model_path)
+    model_all, config = load_model(model_path, device)
+    model_all[0].model_GCN.edge_dropout_in_eval = False
+    pipeline = Inference_Pipeline(model_all, config['normlizetype']).to(device).eval()
+    if optimize:
+        pipeline = optimize_for_inference(pipeline)
+    return pipeline, model_all, config
+
+
+def eager_forward(model_all, config):
+    """model_all with the numpy preprocessing of inference.py, on raw windows"""
+    def forward(windows):
+        inputs = torch.from_numpy(normalize_windows(windows.numpy(), config['normlizetype'])).unsqueeze(1)
+        return model_all(inputs)
+    return forward
+
+
+def recorded_windows(inputs, size, limit=256):
+    """
+    Up to limit windows from the recordings, random windows when no recording is given
+    """
+    windows = []
+    for path in find_recordings(inputs or []):
+        windows.append(np.asarray(sliding_windows(read_recording(path), size, size)))
+        if sum(len(w) for w in windows) >= limit:
+            break
+    if not windows:
+        return torch.randn(limit, size)
+    return torch.from_numpy(np.concatenate(windows)[:limit].astype(np.float32))
+
+
+def check_parity(reference, candidate, windows, batch_size=64):
+    """
+    :return: the largest absolute logit difference and the share of equal predictions
+    """
+    max_diff, agree = 0.0, 0
+    with torch.inference_mode():
+        for i in range(0, len(windows), batch_size):
+            x = windows[i:i + batch_size]
+            ref, out = reference(x), candidate(x)
+            max_diff = max(max_diff, float((ref - out).abs().max()))
+            agree += int((ref.argmax(dim=1) == out.argmax(dim=1)).sum())
+    return max_diff, agree / len(windows)
+
+
+def time_calls(fn, x, warmup=5, repeat=50):
+    """return: per-call times in ms"""
+    with torch.inference_mode():
+        for _ in range(warmup):
+            fn(x)
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn(x)
+            times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def benchmark(candidates, windows, batch_sizes, warmup=5, repeat=50):
+    """
+    :param candidates: {name: callable on raw windows}
+    :return: {name: {batch size: median ms per call}}
+    """
+    results = {name: {} for name in candidates}
+    print('{:<16}'.format('ms per call') + ''.join('{:>12}'.format('batch ' + str(b)) for b in batch_sizes))
+    for name, fn in candidates.items():
+        for batch_size in batch_sizes:
+            x = windows[:batch_size]
+            if len(x) < batch_size:
+                x = x.repeat((batch_size + len(x) - 1) // len(x), 1)[:batch_size]
+            results[name][batch_size] = float(np.median(time_calls(fn, x, warmup, repeat)))
+        print('{:<16}'.format(name) + ''.join('{:>12.3f}'.format(results[name][b]) for b in batch_sizes))
+    return results
+
+
+def cold_start(code):
+    """
+    Seconds from interpreter start to the first prediction, in a fresh process
+    """
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__)))
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.strip().splitlines()[-1])
+    return time.perf_counter() - start, out.stdout.strip().splitlines()[-1]
+
+
+def export_torchscript(pipeline, config, out_path):
+    scripted = torch.jit.script(pipeline)
+    torch.jit.save(scripted, out_path, _extra_files={'model_config.json': json.dumps(config)})
+    return scripted
+
+
+def export_onnx(pipeline, config, out_path, opset=17):
+    """
+    Export with a dynamic batch axis, the model config goes into the metadata
+    """
+    import onnx
+    example = torch.randn(2, config['signal_size'])
+    torch.onnx.export(pipeline, (example,), out_path, input_names=['windows'], output_names=['logits'],
+                      dynamic_axes={'windows': {0: 'batch'}, 'logits': {0: 'batch'}}, opset_version=opset,
+                      dynamo=False)
+    model = onnx.load(out_path)
+    onnx.helper.set_model_props(model, {'model_config.json': json.dumps(config)})
+    onnx.checker.check_model(model)
+    onnx.save(model, out_path)
+
+
+def onnx_forward(path, threads=0):
+    """An onnxruntime CPU session as a callable on raw windows"""
+    import onnxruntime
+    options = onnxruntime.SessionOptions()
+    if threads > 0:
+        options.intra_op_num_threads = threads
+    session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+    def forward(windows):
+        return torch.from_numpy(session.run(None, {'windows': windows.numpy()})[0])
+    return forward
+
+
+def main_onnx(args):
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    pipeline, model_all, config = load_pipeline(args.model, optimize=args.optimize)
+    export_onnx(pipeline, config, args.out, args.opset)
+    print('saved to {} ({:.1f} MB)'.format(args.out, os.path.getsize(args.out) / 2**20))
+
+    windows = recorded_windows(args.inputs, config['signal_size'])
+    session = onnx_forward(args.out, args.threads)
+    eager = eager_forward(model_all, config)
+    max_diff, agree = check_parity(eager, session, windows)
+    print('parity on {} windows: max |logit diff| {:.2e}, equal predictions {:.2%}'.format(
+        len(windows), max_diff, agree))
+    if max_diff > args.atol:
+        print('WARNING: the logits differ by more than {:.0e}'.format(args.atol))
+
+    results = benchmark({'eager': eager, 'eager_dense': pipeline, 'onnxruntime': session}, windows,
+                        args.batch_sizes, args.warmup, args.repeat)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({'artifact': args.out, 'parity': {'windows': len(windows), 'max_abs_diff': max_diff,
+                                                        'agreement': agree},
+                       'median_ms': results}, f, indent=2)
+        print('saved to {}'.format(args.report))
+    if max_diff > args.atol:
+        sys.exit(1)
+
+
+def main_torchscript(args):
+    pipeline, model_all, config = load_pipeline(args.model, args.device, args.optimize)
+    scripted = export_torchscript(pipeline, config, args.out)
+    print('saved to {} ({:.1f} MB)'.format(args.out, os.path.getsize(args.out) / 2**20))
+
+    windows = recorded_windows(args.inputs, config['signal_size'])
+    loaded = torch.jit.load(args.out, map_location=args.device)
+    eager = eager_forward(model_all, config)
+    max_diff, agree = check_parity(eager, loaded, windows)
+    print('parity on {} windows: max |logit diff| {:.2e}, equal predictions {:.2%}'.format(
+        len(windows), max_diff, agree))
+
+    candidates = {'eager': eager, 'eager_dense': pipeline, 'torchscript': loaded}
+    if args.compile:
+        candidates['torch.compile'] = torch.compile(pipeline, dynamic=True)
+    results = benchmark(candidates, windows, args.batch_sizes, args.warmup, args.repeat)
+
+    x = 'torch.randn(64, {})'.format(config['signal_size'])
+    model_path = args.model if not os.path.isdir(args.model) else find_best_model(args.model)
+    eager_code = ('import sys, torch\nfrom inference import load_model\nm, _ = load_model({!r})\n'
+                  'm(torch.randn(64, 1, {}))\nprint("torch_geometric" in sys.modules)').format(
+        os.path.abspath(model_path), config['signal_size'])
+    script_code = ('import sys, torch\nm = torch.jit.load({!r})\nm({})\nprint("torch_geometric" in sys.modules)').format(
+        os.path.abspath(args.out), x)
+    eager_sec, _ = cold_start(eager_code)
+    script_sec, uses_pyg = cold_start(script_code)
+    print('cold start to the first prediction: eager {:.2f} sec, torchscript {:.2f} sec '
+          '(torch_geometric imported: {})'.format(eager_sec, script_sec, uses_pyg))
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({'artifact': args.out, 'parity': {'windows': len(windows), 'max_abs_diff': max_diff,
+                                                        'agreement': agree},
+                       'median_ms': results, 'cold_start_sec': {'eager': eager_sec, 'torchscript': script_sec}},
+                      f, indent=2)
+        print('saved to {}'.format(args.report))
+
+
+def main_optimize(args):
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    pipeline, model_all, config = load_pipeline(args.model)
+    folded_all = optimize_for_inference(model_all)
+    folded_pipeline = optimize_for_inference(pipeline)
+    windows = recorded_windows(args.inputs, config['signal_size'])
+    eager, eager_folded = eager_forward(model_all, config), eager_forward(folded_all, config)
+
+    parity = {}
+    for name, reference, candidate in [('eager', eager, eager_folded), ('eager_dense', pipeline, folded_pipeline)]:
+        max_diff, agree = check_parity(reference, candidate, windows)
+        parity[name] = {'max_abs_diff': max_diff, 'agreement': agree}
+        print('{} folded vs unfolded on {} windows: max |logit diff| {:.2e}, equal predictions {:.2%}'.format(
+            name, len(windows), max_diff, agree))
+
+    results = benchmark({'eager': eager, 'eager_folded': eager_folded, 'eager_dense': pipeline,
+                         'dense_folded': folded_pipeline}, windows, args.batch_sizes, args.warmup, args.repeat)
+    per_window = {name: {b: ms / b for b, ms in times.items()} for name, times in results.items()}
+    print('{:<16}'.format('ms per window') + ''.join('{:>12}'.format('batch ' + str(b)) for b in args.batch_sizes))
+    for name, times in per_window.items():
+        print('{:<16}'.format(name) + ''.join('{:>12.4f}'.format(times[b]) for b in args.batch_sizes))
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({'parity': parity, 'windows': len(windows), 'median_ms': results,
+                       'median_ms_per_window': per_window}, f, indent=2)
+        print('saved to {}'.format(args.report))
+    if max(p['max_abs_diff'] for p in parity.values()) > args.atol:
+        sys.exit(1)
+
+
+def add_common_args(parser):
+    parser.add_argument('--model', type=str, required=True, help='a *-best_model.pth file or a run directory')
+    parser.add_argument('--inputs', type=str, nargs='*', default=None,
+                        help='recordings for the parity check, random windows when not given')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 16, 64], help='the batch sizes to time')
+    parser.add_argument('--warmup', type=int, default=5, help='untimed calls before timing')
+    parser.add_argument('--repeat', type=int, default=50, help='timed calls per batch size')
+    parser.add_argument('--report', type=str, default=None, help='the json file to save the results')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Export a trained model for inference')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    script_parser = subparsers.add_parser('torchscript', help='export a TorchScript artifact and benchmark it')
+    add_common_args(script_parser)
+    script_parser.add_argument('--out', type=str, default='dagcn.pt', help='the artifact to write')
+    script_parser.add_argument('--compile', action='store_true', help='also time torch.compile of the pipeline')
+    script_parser.add_argument('--device', type=str, default='cpu', help='the device to run on')
+    script_parser.add_argument('--optimize', action='store_true', help='export the pipeline with BatchNorm folded')
+
+    onnx_parser = subparsers.add_parser('onnx', help='export an ONNX model and compare it with onnxruntime')
+    add_common_args(onnx_parser)
+    onnx_parser.add_argument('--out', type=str, default='dagcn.onnx', help='the model to write')
+    onnx_parser.add_argument('--opset', type=int, default=17, help='the ONNX opset version')
+    onnx_parser.add_argument('--threads', type=int, default=0,
+                             help='threads of torch and onnxruntime, 0 keeps the defaults')
+    onnx_parser.add_argument('--atol', type=float, default=1e-4, help='the allowed absolute logit difference')
+    onnx_parser.add_argument('--optimize', action='store_true', help='export the pipeline with BatchNorm folded')
+
+    optimize_parser = subparsers.add_parser('optimize', help='check and time the folded model for inference')
+    add_common_args(optimize_parser)
+    optimize_parser.add_argument('--threads', type=int, default=0, help='the number of torch threads, 0 keeps the default')
+    optimize_parser.add_argument('--atol', type=float, default=1e-4, help='the allowed absolute logit difference')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.command == 'torchscript':
+        main_torchscript(args)
+    elif args.command == 'onnx':
+        main_onnx(args)
+    else:
+        main_optimize(args)
@@ -0,0 +1,258 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""
+Offline batch inference of a trained model_all on raw .mat/.npy recordings
+
+    python inference.py --model ./checkpoint/DAGCN_Task_0to1_20251023_172653 --inputs data/ new.mat --out_dir preds
+
+--model is a *-best_model.pth file or a run directory (its best model is used). Each
+recording is cut into sliding windows of the training signal size, normalized like the
+training data and classified in batches; windows of consecutive recordings share a
+batch, so MRF_GCN always sees a full graph. Only one recording and one batch are held
+in memory at a time, .npy recordings are memory mapped. With --bank every window is
+classified against the reference bank of the run instead (see reference_bank.py), and
+its prediction no longer depends on the other windows of its batch.
+"""
+import os
+import re
+import csv
+import glob
+import json
+import time
+import argparse
+import warnings
+from collections import defaultdict
+import numpy as np
+import torch
+from train_advanced import parse_args as parse_train_args
+from utils.train_utils_combines import train_utils, set_seed
+from datasets.CWRU import read_signal
+
+warnings.filterwarnings('ignore')
+
+BEST_MODEL_PATTERN = re.compile(r'^(\d+)-([\d.]+)-best_model\.pth$')
+BANK_FILE = 'reference_bank.pth'
+
+
+def find_best_model(run_dir):
+    """
+    The best model of a run directory, by val accuracy and then by epoch
+    """
+    found = []
+    for path in glob.glob(os.path.join(run_dir, '*-best_model.pth')):
+        match = BEST_MODEL_PATTERN.match(os.path.basename(path))
+        if match:
+            found.append((float(match.group(2)), int(match.group(1)), path))
+    if not found:
+        raise FileNotFoundError('no *-best_model.pth in {}'.format(run_dir))
+    return max(found)[2]
+
+
+def load_model_config(run_dir):
+    """
+    The model_config.json written with the best model, runs saved before it existed fall back
+    to the arguments in run_config.json and the dataset defaults
+    """
+    path = os.path.join(run_dir, 'model_config.json')
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    args = parse_train_args([])
+    path = os.path.join(run_dir, 'run_config.json')
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            saved = json.load(f).get('args', {})
+        for k, v in saved.items():
+            setattr(args, k, v)
+    else:
+        warnings.warn('no model_config.json or run_config.json in {}, using the default arguments'.format(run_dir))
+    return train_utils(args, run_dir).model_config()
+
+
+def load_model(model_path, device='cpu', bank=False):
+    """
+    :param model_path: a *-best_model.pth file or a run directory
+    :param bank: connect every window to the reference bank of the run (reference_bank.py)
+    :return: (model_all in eval mode, model config)
+    """
+    if os.path.isdir(model_path):
+        model_path = find_best_model(model_path)
+    config = load_model_config(os.path.dirname(os.path.abspath(model_path)))
+    args = parse_train_args([])
+    for k in ['model_name', 'data_name', 'bottleneck', 'bottleneck_num', 'domain_adversarial', 'hidden_size']:
+        setattr(args, k, config[k])
+    trainer = train_utils(args, None)
+    trainer.build_model(config['num_classes'])
+    trainer.model_all.load_state_dict(torch.load(model_path, map_location=device))
+    if bank:
+        load_reference_bank(trainer.model_all, model_path)
+    return trainer.model_all.to(device).eval(), config
+
+
+def load_reference_bank(model_all, model_path):
+    """
+    Attach the bank saved next to model_path to the MRF_GCN of model_all
+    """
+    bank = torch.load(os.path.join(os.path.dirname(os.path.abspath(model_path)), BANK_FILE))
+    if bank['model'] != os.path.basename(model_path):
+        warnings.warn('the reference bank was built with {}, not {}'.format(bank['model'],
+                                                                             os.path.basename(model_path)))
+    model_all[0].model_GCN.set_bank(bank['features'], bank['atrr'])
+    return bank
+
+
+def find_recordings(inputs):
+    files = []
+    for path in inputs:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, '**', '*.mat'), recursive=True) +
+                            glob.glob(os.path.join(path, '**', '*.npy'), recursive=True))
+        else:
+            files.append(path)
+    return files
+
+
+def read_recording(path):
+    if path.lower().endswith('.npy'):
+        signal = np.load(path, mmap_mode='r')
+        return signal.reshape(-1) if signal.ndim != 1 else signal
+    return read_signal(path, os.path.basename(path))
+
+
+def sliding_windows(signal, size, stride):
+    """
+    Zero-copy (num_windows, size) view of the windows starting every stride samples
+    """
+    if len(signal) < size:
+        return np.empty((0, size), dtype=np.float32)
+    return np.lib.stride_tricks.sliding_window_view(signal, size)[::stride]
+
+
+def normalize_windows(windows, normlizetype):
+    """
+    datasets.sequence_aug.Normalize applied to every window at once
+    """
+    windows = windows.astype(np.float32)
+    if normlizetype == '0-1':
+        low, high = windows.min(axis=1, keepdims=True), windows.max(axis=1, keepdims=True)
+        return (windows - low) / (high - low)
+    elif normlizetype == '-1-1':
+        low, high = windows.min(axis=1, keepdims=True), windows.max(axis=1, keepdims=True)
+        return 2 * (windows - low) / (high - low) - 1
+    elif normlizetype == 'mean-std':
+        return (windows - windows.mean(axis=1, keepdims=True)) / windows.std(axis=1, keepdims=True)
+    raise NameError('This normalization is not included!')
+
+
+def iter_batches(files, size, stride, batch_size, stats):
+    """
+    Yield (windows, [(file index, window index)]) batches, windows of consecutive files share a batch
+    """
+    pending, index = [], []
+    for i, path in enumerate(files):
+        start = time.perf_counter()
+        try:
+            signal = read_recording(path)
+        except Exception as e:
+            print('skip {}: {}'.format(path, e))
+            continue
+        windows = sliding_windows(signal, size, stride)
+        stats['read_sec'] += time.perf_counter() - start
+        stats['samples'] += len(signal)
+        j = 0
+        while j < len(windows):
+            take = min(batch_size - len(index), len(windows) - j)
+            pending.append(windows[j:j + take])
+            index += [(i, k) for k in range(j, j + take)]
+            j += take
+            if len(index) == batch_size:
+                yield np.concatenate(pending), index
+                pending, index = [], []
+    if pending:
+        yield np.concatenate(pending), index
+
+
+def predict(model_all, config, files, out_dir, batch_size=64, stride=None, device='cpu'):
+    """
+    Write windows.csv (one row per window) and files.csv (mean probability per recording)
+    :return: the throughput summary
+    """
+    size = config['signal_size']
+    stride = stride or size
+    class_names = config['class_names']
+    stats = {'read_sec': 0.0, 'samples': 0}
+    # Running sums per recording, so memory does not grow with the recording length
+    file_probs = defaultdict(lambda: np.zeros(len(class_names)))
+    file_votes = defaultdict(lambda: np.zeros(len(class_names), dtype=np.int64))
+    windows_done = 0
+    start = time.perf_counter()
+    infer_sec = 0.0
+
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, 'windows.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['file', 'window', 'start', 'pred', 'class'] + ['p_' + c for c in class_names])
+        with torch.inference_mode():
+            for windows, index in iter_batches(files, size, stride, batch_size, stats):
+                batch_start = time.perf_counter()
+                inputs = torch.from_numpy(normalize_windows(windows, config['normlizetype'])).unsqueeze(1)
+                probs = torch.softmax(model_all(inputs.to(device)), dim=1).cpu().numpy()
+                infer_sec += time.perf_counter() - batch_start
+                for (i, j), p in zip(index, probs):
+                    pred = int(p.argmax())
+                    writer.writerow([files[i], j, j * stride, pred, class_names[pred]] +
+                                    ['{:.6f}'.format(v) for v in p])
+                    file_probs[i] += p
+                    file_votes[i][pred] += 1
+                windows_done += len(windows)
+
+    with open(os.path.join(out_dir, 'files.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['file', 'windows', 'pred', 'class', 'vote'] + ['p_' + c for c in class_names])
+        for i, probs in sorted(file_probs.items()):
+            count = file_votes[i].sum()
+            mean = probs / count
+            pred = int(mean.argmax())
+            writer.writerow([files[i], count, pred, class_names[pred], '{:.4f}'.format(file_votes[i][pred] / count)] +
+                            ['{:.6f}'.format(v) for v in mean])
+
+    total_sec = time.perf_counter() - start
+    summary = {
+        'files': len(file_probs), 'windows': windows_done, 'samples': stats['samples'],
+        'batch_size': batch_size, 'stride': stride, 'total_sec': total_sec,
+        'read_sec': stats['read_sec'], 'inference_sec': infer_sec,
+        'windows_per_sec': windows_done / total_sec if total_sec > 0 else None,
+        'inference_windows_per_sec': windows_done / infer_sec if infer_sec > 0 else None,
+    }
+    with open(os.path.join(out_dir, 'summary.json'), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Batch inference on .mat/.npy recordings')
+    parser.add_argument('--model', type=str, required=True, help='a *-best_model.pth file or a run directory')
+    parser.add_argument('--inputs', type=str, nargs='+', required=True, help='recordings or directories of them')
+    parser.add_argument('--out_dir', type=str, default='./predictions', help='the directory to write the results')
+    parser.add_argument('--batch_size', type=int, default=64, help='windows per forward, also the graph size')
+    parser.add_argument('--stride', type=int, default=None, help='samples between windows, default the window size')
+    parser.add_argument('--device', type=str, default='cpu', help='the device to run on')
+    parser.add_argument('--num_threads', type=int, default=0, help='the number of cpu threads used by torch, 0 keeps the default')
+    parser.add_argument('--seed', type=int, default=0, help='the random seed, MRF_GCN drops random edges')
+    parser.add_argument('--bank', action='store_true', help='classify every window against the reference bank of the run')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
+    set_seed(args.seed)
+    model_all, config = load_model(args.model, args.device, args.bank)
+    files = find_recordings(args.inputs)
+    summary = predict(model_all, config, files, args.out_dir, args.batch_size, args.stride, args.device)
+    print('{} files, {} windows in {:.2f} sec: {:.1f} windows/sec, {:.1f} windows/sec inference only '
+          '(read {:.2f} sec, inference {:.2f} sec)'.format(
+            summary['files'], summary['windows'], summary['total_sec'], summary['windows_per_sec'] or 0,
+            summary['inference_windows_per_sec'] or 0, summary['read_sec'], summary['inference_sec']))
+    print('saved to {}'.format(args.out_dir))
@@ -1,5 +1,6 @@
 
 import torch
+from torch.profiler import record_function
 
 def guassian_kernel(source, target, kernel_mul=2.0, kernel_num=5, fix_sigma=None):
     n_samples = int(source.size()[0])+int(target.size()[0])
@@ -19,11 +20,63 @@ def guassian_kernel(source, target, kernel_mul=2.0, kernel_num=5, fix_sigma=None
 
 def DAN(source, target, kernel_mul=2.0, kernel_num=5, fix_sigma=None):
     batch_size = int(source.size()[0])
-    kernels = guassian_kernel(source, target,
-        kernel_mul=kernel_mul, kernel_num=kernel_num, fix_sigma=fix_sigma)
+    with record_function('guassian_kernel'):
+        kernels = guassian_kernel(source, target,
+            kernel_mul=kernel_mul, kernel_num=kernel_num, fix_sigma=fix_sigma)
     XX = kernels[:batch_size, :batch_size]
     YY = kernels[batch_size:, batch_size:]
     XY = kernels[:batch_size, batch_size:]
     YX = kernels[batch_size:, :batch_size]
     loss = torch.mean(XX + YY - XY - YX)
     return loss
+
+
+class DAN_Accumulator(object):
+    """
+    DAN of an effective batch made of several micro-batches, for gradient accumulation.
+    Every micro-batch adds its kernel sums against itself and against the detached features
+    of the earlier micro-batches of the step, instead of a mean of independent small-batch
+    estimates. The gradient of a pair from two micro-batches flows through the later one.
+    With fix_sigma the shares of a step add up to the value of DAN of the whole effective
+    batch, not its gradient, which gets a pair twice from the later micro-batch. Otherwise
+    the bandwidth of a share comes from the distances of the features of the step so far,
+    so the sum only approximates it, e.g. 0.19129 against 0.19119 for 4 x 16 samples.
+    """
+    def __init__(self, kernel_mul=2.0, kernel_num=5, fix_sigma=None):
+        self.kernel_mul = kernel_mul
+        self.kernel_num = kernel_num
+        self.fix_sigma = fix_sigma
+        self.reset()
+
+    def reset(self):
+        self.features = []
+        self.signs = []
+        self.distance_sum = 0.0
+
+    def __call__(self, source, target, batch_size):
+        """
+        :param batch_size: the number of source samples of the whole effective batch, known
+            before its first micro-batch, the micro-batches may differ in size
+        :return: the share of this micro-batch
+        """
+        current = torch.cat([source, target], dim=0)
+        signs = torch.cat([current.new_ones(source.size(0)), -current.new_ones(target.size(0))])
+        total = torch.cat(self.features + [current], dim=0)
+        total_signs = torch.cat(self.signs + [signs])
+        # Distances of the micro-batch to the earlier ones and to itself
+        L2_distance = ((current.unsqueeze(1) - total.unsqueeze(0))**2).sum(2)
+        n_previous = total.size(0) - current.size(0)
+        self.distance_sum += 2 * float(L2_distance.data[:, :n_previous].sum()) + float(L2_distance.data[:, n_previous:].sum())
+        if self.fix_sigma:
+            bandwidth = self.fix_sigma
+        else:
+            bandwidth = self.distance_sum / (total.size(0)**2 - total.size(0))
+        bandwidth /= self.kernel_mul ** (self.kernel_num // 2)
+        with record_function('guassian_kernel'):
+            kernels = sum(torch.exp(-L2_distance / (bandwidth * self.kernel_mul**i)) for i in range(self.kernel_num))
+        # Pairs with an earlier micro-batch appear once here but twice in the full kernel matrix
+        weights = torch.cat([2 * total_signs[:n_previous], total_signs[n_previous:]])
+        share = (signs.unsqueeze(1) * kernels * weights.unsqueeze(0)).sum() / batch_size**2
+        self.features.append(current.detach())
+        self.signs.append(signs)
+        return share
@@ -28,6 +28,10 @@ class AdversarialNet(nn.Module):
         self.sigmoid = nn.Sigmoid()
         # parameters
         self.iter_num = 0
+        # With gradient accumulation iter_num counts groups of accumulation_steps forwards,
+        # the trainer resets micro_step at the start of every group
+        self.accumulation_steps = 1
+        self.micro_step = 0
         self.alpha = 10
         self.low = 0.0
         self.high = 1.0
@@ -37,7 +41,9 @@ class AdversarialNet(nn.Module):
     def forward(self, x):
 
         if self.training:
-            self.iter_num += 1
+            if self.micro_step % self.accumulation_steps == 0:
+                self.iter_num += 1
+            self.micro_step += 1
         coeff = calc_coeff(self.iter_num, self.high, self.low, self.alpha, self.max_iter)
         x = x * 1.0
         x.register_hook(grl_hook(coeff))
@@ -45,7 +51,8 @@ class AdversarialNet(nn.Module):
         x = self.ad_layer1(x)
         x = self.ad_layer2(x)
         y = self.ad_layer3(x)
-        y = self.sigmoid(y)
+        # In fp32 under autocast, a low precision sigmoid saturates to exactly 0 or 1
+        y = self.sigmoid(y.float())
         return y
 
     def output_num(self):
@@ -2,6 +2,8 @@
 # -*- coding:utf-8 -*-
 from torch import nn
 import warnings
+import torch
+from models.checkpoint import checkpoint_segment
 
 
 class CNN(nn.Module):
@@ -39,17 +41,25 @@ class CNN(nn.Module):
             nn.Linear(128 * 4, 256),
             nn.ReLU(inplace=True),
             nn.Dropout())
+        # Recompute the activations of layer1-4 in backward instead of keeping them
+        self.checkpoint = False
 
     def forward(self, x):
-        x = self.layer1(x)
-
-        x = self.layer2(x)
-
-        x = self.layer3(x)
-
-        x = self.layer4(x)
+        if self.checkpoint and self.training and torch.is_grad_enabled():
+            x = self.checkpointed_layers(x)
+        else:
+            x = self.layer1(x)
+            x = self.layer2(x)
+            x = self.layer3(x)
+            x = self.layer4(x)
 
         x = x.view(x.size(0), -1)
         x = self.layer5(x)
         return x
 
+    @torch.jit.unused
+    def checkpointed_layers(self, x):
+        # Kept out of TorchScript, the exported pipelines only run in eval mode
+        for layer in [self.layer1, self.layer2, self.layer3, self.layer4]:
+            x = checkpoint_segment(layer, layer, x)
+        return x
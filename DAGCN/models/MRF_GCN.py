@@ -3,8 +3,12 @@
 from torch import nn
 import warnings
 import torch
+import torch.distributed as dist
+import torch.distributed.nn.functional as dist_nn
 from torch_geometric.nn import  ChebConv, BatchNorm
 from torch_geometric.utils import dropout_adj
+from torch.profiler import record_function
+from models.checkpoint import checkpoint_segment
 
 
 class GGL(torch.nn.Module):
@@ -21,7 +25,8 @@ class GGL(torch.nn.Module):
     def forward(self, x):
         x = x.view(x.size(0), -1)
         atrr = self.layer(x)
-        values, edge_index = Gen_edge(atrr)
+        with record_function('Gen_edge'):
+            values, edge_index = Gen_edge(atrr)
         return values.view(-1), edge_index
 
 def Gen_edge(atrr):
@@ -41,6 +46,20 @@ def Gen_edge(atrr):
 
     return values, edge_index
 
+def Gen_edge_dense(atrr):
+    """
+    Gen_edge for a batch of graphs with the same number of nodes, atrr: (graphs, nodes, d)
+    Every node keeps all its edges as in Gen_edge, the graphs are numbered one after another
+    """
+    A = torch.bmm(atrr, atrr.transpose(1, 2))
+    # Broadcast like Gen_edge: A[i, j] is divided by the largest similarity of node j
+    A_norm = A / A.max(dim=2)[0].unsqueeze(1)
+    G, N = A.shape[:2]
+    index = torch.arange(G * N, device=atrr.device).view(G, N)
+    row = index.unsqueeze(2).expand(G, N, N)
+    col = index.unsqueeze(1).expand(G, N, N)
+    return A_norm.reshape(-1), torch.stack([row.reshape(-1), col.reshape(-1)])
+
 class MultiChev(torch.nn.Module):
     def __init__(self, in_channels,):
         super(MultiChev, self).__init__()
@@ -87,18 +106,92 @@ class MRF_GCN(nn.Module):
             nn.Linear(300, 256),
             nn.ReLU(inplace=True),
             nn.Dropout())
+        self.bank = None
+        self.bank_atrr = None
+        # Edges are also dropped in eval mode, as the validation accuracies were measured
+        self.edge_dropout_in_eval = True
+        # Recompute the conv/bn activations in backward instead of keeping them
+        self.checkpoint = False
+        # With DDP, train on one graph over the batches of all ranks instead of one graph per rank
+        self.gather_nodes = False
+        self.graph_seed = 0
+        self.graph_step = 0
+
+    def set_bank(self, features, atrr=None):
+        """
+        In eval mode, connect every sample to a fixed bank of reference nodes instead of the rest
+        of its batch, so its prediction no longer depends on the batch composition
+        :param features: (M, in_channel) inputs of MRF_GCN for the reference samples, None to disable
+        :param atrr: (M, 10) their GGL node attributes, computed from features when not given
+        """
+        if features is None:
+            self.bank, self.bank_atrr = None, None
+            return
+        if atrr is None:
+            with torch.no_grad():
+                atrr = self.atrr.layer(features.view(features.size(0), -1))
+        self.bank, self.bank_atrr = features.detach(), atrr.detach()
+
+    def forward_bank(self, x):
+        # One graph of the M bank nodes and the sample per sample, without edge dropout
+        x = x.view(x.size(0), -1)
+        Q, M = x.size(0), self.bank.size(0)
+        bank = self.bank.to(x.device).view(M, -1)
+        atrr = torch.cat([self.bank_atrr.to(x.device).unsqueeze(0).expand(Q, -1, -1),
+                          self.atrr.layer(x).unsqueeze(1)], dim=1)
+        with record_function('Gen_edge'):
+            edge_atrr, edge_index = Gen_edge_dense(atrr)
+        x = torch.cat([bank.unsqueeze(0).expand(Q, -1, -1), x.unsqueeze(1)], dim=1).reshape(Q * (M + 1), -1)
+        x = self.conv1(x, edge_index, edge_weight = edge_atrr)
+        x = self.bn1(x)
+        x = self.conv2(x, edge_index, edge_weight = edge_atrr)
+        x = self.bn2(x)
+        x = self.layer5(x)
+        return x.view(Q, M + 1, -1)[:, -1]
+
+    def block1(self, x, edge_index, edge_atrr):
+        return self.bn1(self.conv1(x, edge_index, edge_weight = edge_atrr))
 
+    def block2(self, x, edge_index, edge_atrr):
+        return self.bn2(self.conv2(x, edge_index, edge_weight = edge_atrr))
+
+    def run_block(self, block, *inputs):
+        if self.checkpoint and self.training and torch.is_grad_enabled():
+            return checkpoint_segment(self, block, *inputs)
+        return block(*inputs)
+
+    def forward_gathered(self, x):
+        """
+        Every rank runs MRF_GCN on the all-gathered batches with the same random state, so the
+        graph and its edge dropout are the same everywhere, and keeps the rows of its own batch.
+        The all_gather is differentiable, the gradient of a node returns to the rank it came from
+        """
+        x = x.view(x.size(0), -1)
+        sizes = [None] * dist.get_world_size()
+        dist.all_gather_object(sizes, x.size(0))
+        padded = torch.cat([x, x.new_zeros(max(sizes) - x.size(0), x.size(1))])
+        x_all = torch.cat([g[:n] for g, n in zip(dist_nn.all_gather(padded), sizes)])
+        self.graph_step += 1
+        with torch.random.fork_rng(devices=[x.device.index] if x.is_cuda else []):
+            torch.manual_seed(self.graph_seed + self.graph_step)
+            out = self.forward_graph(x_all)
+        start = sum(sizes[:dist.get_rank()])
+        return out[start:start + x.size(0)]
 
     def forward(self, x):
+        if self.bank is not None and not self.training:
+            return self.forward_bank(x)
+        if self.gather_nodes and self.training and dist.is_initialized():
+            return self.forward_gathered(x)
+        return self.forward_graph(x)
 
+    def forward_graph(self, x):
         edge_atrr, edge_index = self.atrr(x)
-        edge_atrr = edge_atrr.cuda()
-        edge_index = edge_index.cuda()
-        edge_index, edge_atrr = dropout_adj(edge_index,edge_atrr)
-        x = self.conv1(x, edge_index, edge_weight =  edge_atrr)
-        x = self.bn1(x)
-        x = self.conv2(x, edge_index, edge_weight =  edge_atrr)
-        x = self.bn2(x)
+        edge_atrr = edge_atrr.to(x.device)
+        edge_index = edge_index.to(x.device)
+        edge_index, edge_atrr = dropout_adj(edge_index,edge_atrr, training=self.training or self.edge_dropout_in_eval)
+        x = self.run_block(self.block1, x, edge_index, edge_atrr)
+        x = self.run_block(self.block2, x, edge_index, edge_atrr)
         x = x.view(x.size(0), -1)
         x = self.layer5(x)
         return x
\ No newline at end of file
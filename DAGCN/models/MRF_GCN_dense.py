@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+import copy
+import torch
+from torch import nn
+
+
+def cheb_propagation(atrr):
+    """
+    The Gen_edge graph and the ChebConv 'sym' laplacian as one dense (N, N) matrix P,
+    a propagation step of ChebConv is then P @ x
+    """
+    A = torch.mm(atrr, atrr.t())
+    # Broadcast like Gen_edge: A[i, j] is divided by the largest similarity of node j
+    W = A / A.max(dim=1)[0]
+    eye = torch.eye(W.size(0), dtype=W.dtype, device=W.device)
+    W = W * (1 - eye)
+    deg = W.sum(dim=1)
+    deg_inv_sqrt = deg.pow(-0.5)
+    deg_inv_sqrt = torch.where(torch.isinf(deg_inv_sqrt), torch.zeros_like(deg_inv_sqrt), deg_inv_sqrt)
+    L = eye - deg_inv_sqrt.unsqueeze(1) * W * deg_inv_sqrt.unsqueeze(0)
+    # ChebConv rescales 2 * L / lambda_max - I with lambda_max = 2.0 for the 'sym' normalization
+    L_hat = L - eye
+    # Messages flow from edge_index[0] to edge_index[1]
+    return L_hat.t()
+
+
+class MultiChev_dense(nn.Module):
+    """
+    MultiChev (ChebConv with K=1, 2, 3 side by side) on a dense propagation matrix,
+    the Chebyshev terms are computed once and shared by the three scales
+    """
+    def __init__(self, in_channels, out_channels):
+        super(MultiChev_dense, self).__init__()
+        self.out_channels = out_channels
+        self.lin0 = nn.Linear(in_channels, 3 * out_channels, bias=True)
+        self.lin1 = nn.Linear(in_channels, 2 * out_channels, bias=False)
+        self.lin2 = nn.Linear(in_channels, out_channels, bias=False)
+
+    @classmethod
+    def from_multichev(cls, layer):
+        scales = [layer.scale_1, layer.scale_2, layer.scale_3]
+        dense = cls(scales[0].in_channels, scales[0].out_channels)
+        with torch.no_grad():
+            dense.lin0.weight.copy_(torch.cat([s.lins[0].weight for s in scales], 0))
+            dense.lin0.bias.copy_(torch.cat([s.bias for s in scales], 0))
+            dense.lin1.weight.copy_(torch.cat([s.lins[1].weight for s in scales[1:]], 0))
+            dense.lin2.weight.copy_(scales[2].lins[2].weight)
+        return dense
+
+    def forward(self, x, P):
+        o = self.out_channels
+        Tx_1 = torch.mm(P, x)
+        Tx_2 = 2. * torch.mm(P, Tx_1) - x
+        y0 = self.lin0(x)
+        y1 = self.lin1(Tx_1)
+        y2 = self.lin2(Tx_2)
+        return torch.cat([y0[:, :o], y0[:, o:2 * o] + y1[:, :o], y0[:, 2 * o:] + y1[:, o:] + y2], 1)
+
+
+class MRF_GCN_dense(nn.Module):
+    '''
+    MRF_GCN in plain tensor ops for export, without torch_geometric and edge dropout
+    '''
+    def __init__(self, in_channel=256):
+        super(MRF_GCN_dense, self).__init__()
+        self.atrr = nn.Sequential(nn.Linear(in_channel, 10), nn.Sigmoid())
+        self.conv1 = MultiChev_dense(in_channel, 400)
+        self.bn1 = nn.BatchNorm1d(1200)
+        self.conv2 = MultiChev_dense(400 * 3, 100)
+        self.bn2 = nn.BatchNorm1d(300)
+        self.layer5 = nn.Sequential(
+            nn.Linear(300, 256),
+            nn.ReLU(inplace=True),
+            nn.Dropout())
+
+    @classmethod
+    def from_mrf_gcn(cls, model):
+        """Copy the weights of a trained MRF_GCN"""
+        dense = cls(model.atrr.layer[0].in_features)
+        dense.atrr = copy.deepcopy(model.atrr.layer)
+        dense.conv1 = MultiChev_dense.from_multichev(model.conv1)
+        dense.bn1 = copy.deepcopy(model.bn1.module)
+        dense.conv2 = MultiChev_dense.from_multichev(model.conv2)
+        dense.bn2 = copy.deepcopy(model.bn2.module)
+        dense.layer5 = copy.deepcopy(model.layer5)
+        return dense.train(model.training)
+
+    def forward(self, x):
+        x = x.view(x.size(0), -1)
+        P = cheb_propagation(self.atrr(x))
+        x = self.conv1(x, P)
+        x = self.bn1(x)
+        x = self.conv2(x, P)
+        x = self.bn2(x)
+        x = self.layer5(x)
+        return x
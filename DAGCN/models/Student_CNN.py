@@ -0,0 +1,45 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+from torch import nn
+
+
+def conv_block(in_channel, out_channel, kernel_size, separable=False):
+    """Conv1d, or a depthwise Conv1d followed by a pointwise one, + BatchNorm1d + ReLU"""
+    if separable and in_channel > 1:
+        conv = [nn.Conv1d(in_channel, in_channel, kernel_size=kernel_size, groups=in_channel),
+                nn.Conv1d(in_channel, out_channel, kernel_size=1)]
+    else:
+        conv = [nn.Conv1d(in_channel, out_channel, kernel_size=kernel_size)]
+    return conv + [nn.BatchNorm1d(out_channel), nn.ReLU(inplace=True)]
+
+
+class Student_CNN(nn.Module):
+    """
+    The CNN of DAGCN_features with a classifier and no graph, to distill a trained DAGCN into.
+    width scales the channels of the four conv stages, separable makes the convolutions
+    after the first one depthwise-separable
+    """
+    def __init__(self, num_classes, in_channel=1, width=1.0, separable=False, feature_num=256):
+        super(Student_CNN, self).__init__()
+        c1, c2, c3, c4 = [max(1, int(round(c * width))) for c in (16, 32, 64, 128)]
+        self.layer1 = nn.Sequential(*conv_block(in_channel, c1, 15, separable))
+        self.layer2 = nn.Sequential(*conv_block(c1, c2, 3, separable), nn.MaxPool1d(kernel_size=2, stride=2))
+        self.layer3 = nn.Sequential(*conv_block(c2, c3, 3, separable))
+        self.layer4 = nn.Sequential(*conv_block(c3, c4, 3, separable), nn.AdaptiveMaxPool1d(4))
+        self.layer5 = nn.Sequential(
+            nn.Linear(c4 * 4, feature_num),
+            nn.ReLU(inplace=True),
+            nn.Dropout())
+        self.classifier = nn.Linear(feature_num, num_classes)
+
+    def features(self, x):
+        """the feature_num-d input of the classifier, matched to the bottleneck output of the teacher"""
+        x = self.layer1(x)
+        x = self.layer2(x)
+        x = self.layer3(x)
+        x = self.layer4(x)
+        x = x.view(x.size(0), -1)
+        return self.layer5(x)
+
+    def forward(self, x):
+        return self.classifier(self.features(x))
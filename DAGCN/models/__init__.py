@@ -2,3 +2,4 @@
 # -*- coding:utf-8 -*-
 from models.DAGCN import DAGCN_features
 from models.AdversarialNet import AdversarialNet
+from models.Student_CNN import Student_CNN
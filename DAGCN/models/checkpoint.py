@@ -0,0 +1,29 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+import contextlib
+import torch
+from torch.utils.checkpoint import checkpoint
+
+
+@contextlib.contextmanager
+def frozen_bn_stats(module):
+    """Restore the BatchNorm running statistics of module on exit"""
+    buffers = [b for m in module.modules() if isinstance(m, torch.nn.modules.batchnorm._BatchNorm)
+               for b in (m.running_mean, m.running_var, m.num_batches_tracked) if b is not None]
+    saved = [b.clone() for b in buffers]
+    try:
+        yield
+    finally:
+        with torch.no_grad():
+            for b, s in zip(buffers, saved):
+                b.copy_(s)
+
+
+def checkpoint_segment(module, fn, *inputs):
+    """
+    fn(*inputs) without keeping its activations, they are recomputed in backward.
+    The recomputation replays the random state and does not update the BatchNorm
+    statistics of module a second time, so the result is the same as fn(*inputs)
+    """
+    return checkpoint(fn, *inputs, use_reentrant=False,
+                      context_fn=lambda: (contextlib.nullcontext(), frozen_bn_stats(module)))
@@ -0,0 +1,101 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+import copy
+import torch
+from torch import nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+from models.MRF_GCN import MRF_GCN
+from models.MRF_GCN_dense import MRF_GCN_dense
+
+
+MAX_POOLS = (nn.MaxPool1d, nn.AdaptiveMaxPool1d)
+
+
+def bn_affine(bn):
+    """
+    :return: (scale, shift) with bn(x) = x * scale + shift in eval mode
+    """
+    bn = getattr(bn, 'module', bn)  # torch_geometric BatchNorm wraps a BatchNorm1d
+    scale = torch.rsqrt(bn.running_var + bn.eps)
+    if bn.weight is not None:
+        scale = scale * bn.weight
+    shift = -bn.running_mean * scale
+    if bn.bias is not None:
+        shift = shift + bn.bias
+    return scale, shift
+
+
+def fold_sequential(seq):
+    """
+    Conv1d + BatchNorm1d -> Conv1d, drop Dropout, and ReLU + max pooling -> max pooling + ReLU.
+    ReLU is monotone, so it commutes with max pooling and then runs on the pooled output only
+    """
+    layers = []
+    for layer in seq:
+        if isinstance(layer, nn.BatchNorm1d) and layers and isinstance(layers[-1], nn.Conv1d):
+            layers[-1] = fuse_conv_bn_eval(layers[-1], layer)
+        elif isinstance(layer, nn.Dropout):
+            continue
+        elif isinstance(layer, MAX_POOLS) and layers and isinstance(layers[-1], nn.ReLU):
+            layers.insert(len(layers) - 1, layer)
+        else:
+            layers.append(layer)
+    return nn.Sequential(*layers)
+
+
+def fold_multichev_bn(conv, bn):
+    """
+    Fold the BatchNorm after a MultiChev(_B) into its projections. Every output channel is a
+    linear projection of the Chebyshev terms plus a bias, so scaling the rows of the projections
+    and the bias is exact. The BatchNorm before a MultiChev cannot be folded into it: the
+    propagation turns its shift into a graph dependent term
+    """
+    scale, shift = bn_affine(bn)
+    offset = 0
+    for cheb in [conv.scale_1, conv.scale_2, conv.scale_3]:
+        s = scale[offset:offset + cheb.out_channels]
+        for lin in cheb.lins:
+            lin.weight.mul_(s.unsqueeze(1))
+        cheb.bias.mul_(s).add_(shift[offset:offset + cheb.out_channels])
+        offset += cheb.out_channels
+
+
+def fold_multichev_dense_bn(conv, bn):
+    """fold_multichev_bn for MultiChev_dense, lin1 feeds the last two scales and lin2 the last one"""
+    scale, shift = bn_affine(bn)
+    o = conv.out_channels
+    conv.lin0.weight.mul_(scale.unsqueeze(1))
+    conv.lin0.bias.mul_(scale).add_(shift)
+    conv.lin1.weight.mul_(scale[o:].unsqueeze(1))
+    conv.lin2.weight.mul_(scale[2 * o:].unsqueeze(1))
+
+
+def optimize_for_inference(model):
+    """
+    An eval-only copy of DAGCN_features, model_all or the export pipeline with the BatchNorm layers
+    folded into the preceding Conv1d and MultiChev projections, Dropout removed and ReLU moved
+    behind max pooling. The model itself is not modified, edge dropout of MRF_GCN is kept as is
+    """
+    model = copy.deepcopy(model).eval()
+    with torch.no_grad():
+        for module in model.modules():
+            if isinstance(module, MRF_GCN):
+                fold_multichev_bn(module.conv1, module.bn1)
+                fold_multichev_bn(module.conv2, module.bn2)
+            elif isinstance(module, MRF_GCN_dense):
+                fold_multichev_dense_bn(module.conv1, module.bn1)
+                fold_multichev_dense_bn(module.conv2, module.bn2)
+            else:
+                continue
+            module.bn1, module.bn2 = nn.Identity(), nn.Identity()
+        _fold_children(model)
+    for param in model.parameters():
+        param.requires_grad_(False)
+    return model
+
+
+def _fold_children(module):
+    for name, child in module.named_children():
+        _fold_children(child)
+        if isinstance(child, nn.Sequential):
+            setattr(module, name, fold_sequential(child))
@@ -0,0 +1,139 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""
+Post-training int8 quantization of the exported inference pipeline for CPU
+
+    python quantize.py --model ./checkpoint/DAGCN_Task_0to1_20251023_172653 --out dagcn_int8.pt
+
+The CNN (Conv1d+BatchNorm1d+ReLU stacks and its Linear) is quantized statically, with
+activation ranges calibrated on the source_train split of the run. Every other Linear
+(the MultiChev projections, layer5, bottleneck and classifier) is quantized dynamically.
+The result is a TorchScript artifact on raw windows like export.py torchscript. The
+report compares the float and the int8 model on the target_val split of every
+TRANSFER_TASKS task starting from the source domain of the run.
+"""
+import os
+import copy
+import json
+import argparse
+import tempfile
+import warnings
+import numpy as np
+import torch
+from torch import nn
+from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+import datasets
+from export import load_pipeline, time_calls
+from inference import find_best_model
+from reference_bank import source_train_set, run_train_args
+from scripts.config import TRANSFER_TASKS
+
+warnings.filterwarnings('ignore')
+
+
+def domain_windows(dataset):
+    """All samples of a split as (windows, labels) tensors"""
+    loader = torch.utils.data.DataLoader(dataset, batch_size=1024, shuffle=False)
+    windows, labels = [], []
+    for inputs, targets in loader:
+        windows.append(inputs.view(inputs.size(0), -1))
+        labels.append(targets)
+    return torch.cat(windows), torch.cat(labels)
+
+
+def quantize_pipeline(pipeline, calibration, batch_size=64, backend='x86'):
+    """
+    :param calibration: raw (N, signal_size) windows to calibrate the CNN activations on
+    :return: the int8 pipeline, the float one is not modified
+    """
+    torch.backends.quantized.engine = backend
+    qpipeline = copy.deepcopy(pipeline).eval()
+    example = (torch.randn(2, 1, calibration.size(1)),)
+    qpipeline.cnn = prepare_fx(qpipeline.cnn, get_default_qconfig_mapping(backend), example)
+    with torch.inference_mode():
+        for i in range(0, len(calibration), batch_size):
+            qpipeline(calibration[i:i + batch_size])
+    qpipeline.cnn = convert_fx(qpipeline.cnn)
+    for name in ['gcn', 'bottleneck', 'classifier']:
+        setattr(qpipeline, name, quantize_dynamic(getattr(qpipeline, name), {nn.Linear}, dtype=torch.qint8))
+    return qpipeline
+
+
+def predict(model, windows, batch_size=64):
+    with torch.inference_mode():
+        return torch.cat([model(windows[i:i + batch_size]).argmax(dim=1) for i in range(0, len(windows), batch_size)])
+
+
+def model_size_mb(model):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'model.pt')
+        torch.jit.save(torch.jit.script(model), path)
+        return os.path.getsize(path) / 2**20
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Post-training int8 quantization with an accuracy report')
+    parser.add_argument('--model', type=str, required=True, help='a *-best_model.pth file or a run directory')
+    parser.add_argument('--out', type=str, default='dagcn_int8.pt', help='the int8 TorchScript artifact to write')
+    parser.add_argument('--data_dir', type=str, default=None, help='the data directory, default the one of the run')
+    parser.add_argument('--tasks', type=str, nargs='*', default=None,
+                        help='TRANSFER_TASKS to report, default every task from the source domain of the run')
+    parser.add_argument('--calibration_samples', type=int, default=512, help='source_train windows for calibration')
+    parser.add_argument('--batch_size', type=int, default=64, help='windows per forward, also the graph size')
+    parser.add_argument('--backend', type=str, default='x86', help='the quantized engine, x86 or qnnpack for arm')
+    parser.add_argument('--threads', type=int, default=0, help='the number of torch threads, 0 keeps the default')
+    parser.add_argument('--repeat', type=int, default=30, help='timed calls for the latency')
+    parser.add_argument('--report', type=str, default=None, help='the json file to save the report')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    model_path = find_best_model(args.model) if os.path.isdir(args.model) else args.model
+    run_dir = os.path.dirname(os.path.abspath(model_path))
+    pipeline, _, config = load_pipeline(model_path)
+    train_args, transfer_task = run_train_args(run_dir)
+    data_dir = args.data_dir or train_args['data_dir']
+
+    calibration, _ = domain_windows(source_train_set(run_dir, data_dir))
+    calibration = calibration[torch.randperm(len(calibration))[:args.calibration_samples]]
+    qpipeline = quantize_pipeline(pipeline, calibration, args.batch_size, args.backend)
+    torch.jit.save(torch.jit.script(qpipeline), args.out, _extra_files={'model_config.json': json.dumps(config)})
+    print('saved to {}'.format(args.out))
+
+    tasks = args.tasks or [t for t, task in TRANSFER_TASKS.items() if task['source'] == transfer_task[0]]
+    Dataset = getattr(datasets, train_args['data_name'])
+    x = calibration[:args.batch_size]
+    report = {
+        'artifact': args.out, 'backend': args.backend, 'calibration_samples': len(calibration),
+        'size_mb': {'float': model_size_mb(pipeline), 'int8': model_size_mb(qpipeline)},
+        'median_ms': {'float': float(np.median(time_calls(pipeline, x, repeat=args.repeat))),
+                      'int8': float(np.median(time_calls(qpipeline, x, repeat=args.repeat)))},
+        'tasks': {},
+    }
+    print('size {:.1f} MB -> {:.1f} MB, batch {} latency {:.2f} ms -> {:.2f} ms'.format(
+        report['size_mb']['float'], report['size_mb']['int8'], len(x),
+        report['median_ms']['float'], report['median_ms']['int8']))
+    print('{:<12} {:>10} {:>10} {:>10} {:>10}'.format('task', 'float acc', 'int8 acc', 'drop', 'agreement'))
+    for task_id in tasks:
+        target = TRANSFER_TASKS[task_id]['target']
+        _, target_val = Dataset(data_dir, [transfer_task[0], target], train_args['normlizetype']).domain_split(target)
+        windows, labels = domain_windows(target_val)
+        float_pred = predict(pipeline, windows, args.batch_size)
+        int8_pred = predict(qpipeline, windows, args.batch_size)
+        float_acc = float((float_pred == labels).float().mean())
+        int8_acc = float((int8_pred == labels).float().mean())
+        agreement = float((float_pred == int8_pred).float().mean())
+        report['tasks'][task_id] = {'target': target, 'windows': len(windows), 'float_acc': float_acc,
+                                    'int8_acc': int8_acc, 'agreement': agreement}
+        print('{:<12} {:>10.4f} {:>10.4f} {:>10.4f} {:>10.4f}'.format(task_id, float_acc, int8_acc,
+                                                                      float_acc - int8_acc, agreement))
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print('saved to {}'.format(args.report))
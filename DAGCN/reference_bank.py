@@ -0,0 +1,128 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""
+Build the reference bank of a trained run for batch-independent inference
+
+    python reference_bank.py --model ./checkpoint/DAGCN_Task_0to1_20251023_172653 --per_class 16 --mode prototype
+
+The CNN features (the MRF_GCN inputs) of the source_train split are computed once and a
+class-balanced subset is kept: randomly drawn samples, or k-means prototypes of each
+class. The bank is saved as reference_bank.pth in the run directory; inference.py and
+serve.py use it with --bank, then every window is classified in a graph with the bank
+nodes only, as in a training batch of per_class * num_classes + 1 samples.
+"""
+import os
+import json
+import argparse
+import warnings
+import torch
+import datasets
+from inference import load_model, find_best_model, BANK_FILE
+from utils.train_utils_combines import set_seed
+
+warnings.filterwarnings('ignore')
+
+
+def run_train_args(run_dir):
+    """
+    :return: the training arguments of a run and its parsed transfer_task
+    """
+    with open(os.path.join(run_dir, 'run_config.json'), 'r', encoding='utf-8') as f:
+        args = json.load(f)['args']
+    transfer_task = args['transfer_task']
+    if isinstance(transfer_task[0], str):
+        transfer_task = eval("".join(transfer_task))
+    return args, transfer_task
+
+
+def source_train_set(run_dir, data_dir=None):
+    """
+    The source_train split of the run, as in train_utils.setup
+    """
+    args, transfer_task = run_train_args(run_dir)
+    Dataset = getattr(datasets, args['data_name'])
+    source_train, _ = Dataset(data_dir or args['data_dir'], transfer_task,
+                              args['normlizetype']).domain_split(transfer_task[0], "源域")
+    return source_train
+
+
+def extract_features(model_all, dataset, batch_size=256, device='cpu'):
+    """
+    :return: the CNN features and labels of every sample of the dataset
+    """
+    loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, shuffle=False)
+    cnn = model_all[0].model_cnn
+    features, labels = [], []
+    with torch.inference_mode():
+        for inputs, targets in loader:
+            features.append(cnn(inputs.to(device)).cpu())
+            labels.append(targets)
+    return torch.cat(features), torch.cat(labels)
+
+
+def kmeans(x, k, iters=20):
+    centers = x[torch.randperm(len(x))[:k]].clone()
+    for _ in range(iters):
+        assign = torch.cdist(x, centers).argmin(dim=1)
+        for c in range(len(centers)):
+            if (assign == c).any():
+                centers[c] = x[assign == c].mean(dim=0)
+    return centers
+
+
+def select_bank(features, labels, per_class=16, mode='random'):
+    """
+    :param mode: 'random' keeps per_class samples of each class, 'prototype' per_class k-means centers
+    :return: (features, labels) of the bank
+    """
+    selected, selected_labels = [], []
+    for c in labels.unique(sorted=True):
+        x = features[labels == c]
+        if mode == 'random':
+            x = x[torch.randperm(len(x))[:per_class]]
+        elif mode == 'prototype':
+            x = kmeans(x, min(per_class, len(x)))
+        else:
+            raise ValueError('unknown bank mode {}'.format(mode))
+        selected.append(x)
+        selected_labels.append(torch.full((len(x),), int(c), dtype=torch.long))
+    return torch.cat(selected), torch.cat(selected_labels)
+
+
+def build_reference_bank(model_path, per_class=16, mode='random', data_dir=None, device='cpu'):
+    """
+    Build and save the bank of a run
+    :return: the path of the bank
+    """
+    if os.path.isdir(model_path):
+        model_path = find_best_model(model_path)
+    run_dir = os.path.dirname(os.path.abspath(model_path))
+    model_all, _ = load_model(model_path, device)
+    features, labels = extract_features(model_all, source_train_set(run_dir, data_dir), device=device)
+    features, labels = select_bank(features, labels, per_class, mode)
+    gcn = model_all[0].model_GCN
+    gcn.set_bank(features.to(device))
+    bank = {'features': features, 'atrr': gcn.bank_atrr.cpu(), 'labels': labels, 'mode': mode,
+            'per_class': per_class, 'model': os.path.basename(model_path)}
+    path = os.path.join(run_dir, BANK_FILE)
+    torch.save(bank, path)
+    return path
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Build the reference bank of a trained run')
+    parser.add_argument('--model', type=str, required=True, help='a *-best_model.pth file or a run directory')
+    parser.add_argument('--per_class', type=int, default=16, help='bank nodes per class')
+    parser.add_argument('--mode', type=str, choices=['random', 'prototype'], default='random',
+                        help='random source samples or k-means prototypes of each class')
+    parser.add_argument('--data_dir', type=str, default=None, help='the data directory, default the one of the run')
+    parser.add_argument('--device', type=str, default='cpu', help='the device to run on')
+    parser.add_argument('--seed', type=int, default=0, help='the random seed')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    set_seed(args.seed)
+    path = build_reference_bank(args.model, args.per_class, args.mode, args.data_dir, args.device)
+    print('saved to {}'.format(path))
@@ -0,0 +1,104 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+# DAGCN/scripts/amp_parity.py
+"""
+混合精度训练的精度对比
+以相同的种子分别用fp32和--amp指定的精度（bf16/fp16）训练所有12个迁移任务，
+逐任务比较目标域最后10轮平均准确率和训练用时；任一任务的准确率下降超过--tolerance时返回非零退出码
+单步吞吐量的对比见 benchmark.py --amp none bf16
+"""
+import os
+import sys
+import json
+import argparse
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from scripts.config import TRANSFER_TASKS, TRAIN_CONFIG, DATA_DIR, RESULTS_DIR
+from scripts.runner import run_tasks, run_key
+from scripts.scheduler import available_cpus, format_time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Accuracy parity of mixed precision training')
+    parser.add_argument('--amp', type=str, choices=['bf16', 'fp16'], default='bf16', help='the precision to compare')
+    parser.add_argument('--tasks', type=str, nargs='*', default=None, help='task ids to train, default all')
+    parser.add_argument('--seed', type=int, default=0, help='the training seed of both precisions')
+    parser.add_argument('--max_epoch', type=int, default=TRAIN_CONFIG['max_epoch'], help='max number of epoch')
+    parser.add_argument('--middle_epoch', type=int, default=TRAIN_CONFIG['middle_epoch'],
+                        help='the first epoch of the adaptation phase')
+    parser.add_argument('--data_dir', type=str, default=DATA_DIR, help='the directory of the data')
+    parser.add_argument('--out_dir', type=str, default=os.path.join(RESULTS_DIR, 'amp_parity'),
+                        help='the directory of the runs and the report')
+    parser.add_argument('--jobs', type=int, default=1, help='the number of tasks trained concurrently')
+    parser.add_argument('--threads_per_job', type=int, default=0,
+                        help='torch threads of each job, default all available cpus divided by jobs')
+    parser.add_argument('--tolerance', type=float, default=0.01, help='the allowed drop of the mean target accuracy')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    task_ids = args.tasks if args.tasks else list(TRANSFER_TASKS.keys())
+    jobs = max(1, min(args.jobs, len(task_ids)))
+    threads_per_job = args.threads_per_job or max(1, len(available_cpus()) // jobs)
+    config = dict(TRAIN_CONFIG, max_epoch=args.max_epoch, middle_epoch=args.middle_epoch)
+    # 两种精度的运行目录固定，再次运行时复用已完成的训练
+    parity_dir = args.out_dir
+
+    print("="*80)
+    print(f"  混合精度对比: fp32 vs {args.amp}")
+    print("="*80)
+    print(f"\n任务数: {len(task_ids)}，种子: {args.seed}，epoch: {args.max_epoch} (域适应从{args.middle_epoch}开始)")
+    print(f"并行任务数: {jobs}，每个任务线程数: {threads_per_job}\n")
+
+    results = {}
+    for precision in ['none', args.amp]:
+        states = run_tasks(task_ids, jobs=jobs, threads_per_job=threads_per_job, seeds=[args.seed],
+                           config=config, data_dir=args.data_dir,
+                           checkpoint_dir=os.path.join(parity_dir, precision), use_cache=True, amp=precision)
+        results[precision] = {task_id: states[run_key(task_id, args.seed)] for task_id in task_ids}
+
+    rows = []
+    print(f"\n{'任务':<12} {'fp32':>8} {args.amp:>8} {'差值':>8} {'fp32用时':>10} {args.amp + '用时':>10}")
+    print("-"*64)
+    for task_id in task_ids:
+        base, amp = results['none'][task_id], results[args.amp][task_id]
+        if base['status'] != 'done' or amp['status'] != 'done':
+            print(f"{task_id:<12} 训练失败")
+            rows.append({'task_id': task_id, 'failed': True})
+            continue
+        base_acc, amp_acc = base['result'].metrics['mean_acc'], amp['result'].metrics['mean_acc']
+        rows.append({'task_id': task_id, 'fp32_acc': base_acc, 'amp_acc': amp_acc, 'diff': amp_acc - base_acc,
+                     'fp32_elapsed': base['elapsed'], 'amp_elapsed': amp['elapsed'],
+                     'fp32_dir': base['save_dir'], 'amp_dir': amp['save_dir']})
+        print(f"{task_id:<12} {base_acc:>8.4f} {amp_acc:>8.4f} {amp_acc - base_acc:>+8.4f} "
+              f"{format_time(base['elapsed']):>10} {format_time(amp['elapsed']):>10}")
+
+    done = [r for r in rows if not r.get('failed')]
+    if done:
+        print("-"*64)
+        print(f"{'平均':<12} {sum(r['fp32_acc'] for r in done) / len(done):>8.4f} "
+              f"{sum(r['amp_acc'] for r in done) / len(done):>8.4f} "
+              f"{sum(r['diff'] for r in done) / len(done):>+8.4f}")
+        # 已缓存的运行用时记为0，不参与用时比较
+        timed = [r for r in done if r['fp32_elapsed'] > 0 and r['amp_elapsed'] > 0]
+        if timed:
+            speedup = sum(r['fp32_elapsed'] for r in timed) / sum(r['amp_elapsed'] for r in timed)
+            print(f"\n{args.amp} 相对fp32的训练加速比: {speedup:.2f}x ({len(timed)}个任务)")
+
+    report_path = os.path.join(parity_dir, f"parity_{args.amp}_{datetime.strftime(datetime.now(), '%Y%m%d_%H%M%S')}.json")
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump({'amp': args.amp, 'seed': args.seed, 'config': config, 'tasks': rows}, f, indent=2)
+    print(f"结果已保存: {report_path}")
+
+    failed = [r['task_id'] for r in rows if r.get('failed') or r['diff'] < -args.tolerance]
+    if failed:
+        print(f"\n✗ 准确率下降超过{args.tolerance}或训练失败的任务: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -44,6 +44,16 @@ TRAIN_CONFIG = {
     'last_batch': False,
 }
 
+# 超参数搜索空间（scripts/search.py）
+# 列表: 网格搜索的取值/随机搜索的候选；('uniform'|'loguniform', 下限, 上限): 仅随机搜索，连续采样
+SEARCH_SPACE = {
+    'lam_adversarial': [0.1, 0.5, 1.0],
+    'hidden_size': [256, 512, 1024],
+    'bottleneck_num': [128, 256],
+    'lr': [1e-4, 5e-4, 1e-3],
+    'middle_epoch': [10, 50, 100],
+}
+
 # 论文中其他方法的结果（Table II）
 # 这些是示例数据，需要根据论文实际数据填写
 PAPER_RESULTS = {
@@ -1,42 +1,18 @@
 # DAGCN/scripts/extract_results.py
 """
-从训练日志中提取最后10个epoch的平均准确率
+从结果数据库（results_db.py，增量导入train.log）中提取最后10个epoch的平均准确率
+多种子运行时按任务汇总各种子的均值、标准差和95%置信区间
 """
 import os
-import re
 import sys
 from pathlib import Path
 import numpy as np
 import csv
+from scipy import stats
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 from scripts.config import TRANSFER_TASKS, RESULTS_DIR, ANALYSIS_DIR
-
-
-def extract_accuracies_from_log(log_file):
-    """从日志文件提取所有epoch的准确率"""
-    if not os.path.exists(log_file):
-        return None
-    
-    with open(log_file, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-    
-    target_val_accs = []
-    epochs = []
-    
-    for line in lines:
-        # 提取target_val准确率
-        match = re.search(r'Epoch:\s+(\d+).*target_val-Acc:\s+([\d.]+)', line)
-        if match:
-            epoch = int(match.group(1))
-            acc = float(match.group(2))
-            epochs.append(epoch)
-            target_val_accs.append(acc)
-    
-    return {
-        'epochs': epochs,
-        'target_val_accs': target_val_accs
-    }
+from scripts import results_db
 
 
 def calculate_final_result(accs, last_n=10):
@@ -57,79 +33,129 @@ def calculate_final_result(accs, last_n=10):
     }
 
 
-def extract_all_results():
-    """提取所有任务的结果"""
-    
-    print("="*80)
-    print("  提取DAGCN所有任务的训练结果")
-    print("="*80)
-    
-    dagcn_dir = os.path.join(RESULTS_DIR, 'DAGCN')
-    
-    if not os.path.exists(dagcn_dir):
-        print(f"\n错误: 结果目录不存在: {dagcn_dir}")
-        return
-    
-    # 扫描所有任务目录
+def aggregate_seeds(values, confidence=0.95):
+    """多个种子结果的均值、标准差 (ddof=1) 和t分布置信区间半宽"""
+    values = np.asarray(values, dtype=float)
+    if len(values) < 2:
+        return {'mean': float(values.mean()), 'std': 0.0, 'ci': 0.0, 'n': len(values)}
+    std = float(values.std(ddof=1))
+    ci = float(stats.t.ppf((1 + confidence) / 2, len(values) - 1) * std / np.sqrt(len(values)))
+    return {'mean': float(values.mean()), 'std': std, 'ci': ci, 'n': len(values)}
+
+
+def process_run_dir(task_id, run_dir, accs, verbose=True):
+    """
+    计算单次运行的结果，verbose时打印并保存final_results.txt
+    accs: results_db.phase_accuracies查询到的准确率
+    return: final_result或None
+    """
+    if verbose:
+        print(f"  目录: {run_dir.name}")
+
+    # 计算最后10个epoch的结果
+    final_result = calculate_final_result(accs, last_n=10)
+
+    if final_result is None:
+        if verbose:
+            print(f"  ✗ epoch数量不足")
+        return None
+    if not verbose:
+        return final_result
+
+    print(f"  ✓ 最后10轮平均准确率: {final_result['mean']*100:.2f}% ± {final_result['std']*100:.2f}%")
+    print(f"    历史最佳: {final_result['best_overall']*100:.2f}% (Epoch {final_result['best_epoch']})")
+
+    # 保存每个任务的详细结果
+    result_file = run_dir / 'final_results.txt'
+    with open(result_file, 'w', encoding='utf-8') as f:
+        f.write("="*80 + "\n")
+        f.write(f"  {task_id}: {TRANSFER_TASKS[task_id]['name']}\n")
+        f.write("="*80 + "\n\n")
+        f.write(f"最后10个Epoch的平均结果:\n")
+        f.write(f"  平均准确率: {final_result['mean']*100:.2f}% ± {final_result['std']*100:.2f}%\n")
+        f.write(f"  最小值: {final_result['min']*100:.2f}%\n")
+        f.write(f"  最大值: {final_result['max']*100:.2f}%\n\n")
+        f.write(f"历史最佳准确率: {final_result['best_overall']*100:.2f}% (Epoch {final_result['best_epoch']})\n\n")
+        f.write(f"最后10个Epoch的详细数据:\n")
+        for i, acc in enumerate(final_result['last_n_values'], 1):
+            f.write(f"  Epoch {len(accs['epochs'])-10+i}: {acc*100:.2f}%\n")
+    return final_result
+
+
+def collect_task_results(conn, results_dir=RESULTS_DIR, verbose=True):
+    """
+    查询每个任务（每个种子最新的运行）的结果并按种子汇总
+    return: {task_id: 汇总结果}
+    """
     task_results = {}
     
     for task_id in TRANSFER_TASKS.keys():
-        # 查找匹配的目录（最新的）
-        pattern = f"DAGCN_{task_id}_*"
-        matching_dirs = sorted(Path(dagcn_dir).glob(pattern))
+        # 查找匹配的目录（每个种子最新的）
+        run_dirs = results_db.latest_runs(conn, task_id)
         
-        if not matching_dirs:
-            print(f"\n警告: 未找到任务 {task_id} 的结果")
+        if not run_dirs:
+            if verbose:
+                print(f"\n警告: 未找到任务 {task_id} 的结果")
             continue
         
-        # 使用最新的目录
-        latest_dir = matching_dirs[-1]
-        log_file = latest_dir / 'train.log'
-        
-        print(f"\n处理: {task_id}")
-        print(f"  目录: {latest_dir.name}")
-        
-        # 提取准确率
-        accs = extract_accuracies_from_log(log_file)
-        
-        if accs is None:
-            print(f"  ✗ 未找到日志文件")
-            continue
+        if verbose:
+            print(f"\n处理: {task_id}")
         
-        # 计算最后10个epoch的结果
-        final_result = calculate_final_result(accs, last_n=10)
+        seed_results = {}
+        for seed, run_dir in run_dirs.items():
+            if seed is not None and verbose:
+                print(f"  种子 {seed}:")
+            accs = results_db.phase_accuracies(conn, run_dir)
+            run_dir = Path(results_dir) / run_dir
+            final_result = process_run_dir(task_id, run_dir, accs, verbose)
+            if final_result is not None:
+                seed_results[seed] = (final_result, run_dir)
         
-        if final_result is None:
-            print(f"  ✗ epoch数量不足")
+        if not seed_results:
             continue
         
+        finals = [r for r, _ in seed_results.values()]
+        summary = aggregate_seeds([r['mean'] for r in finals])
+        best = max(finals, key=lambda r: r['best_overall'])
         task_results[task_id] = {
-            'mean_acc': final_result['mean'],
-            'std_acc': final_result['std'],
-            'best_acc': final_result['best_overall'],
-            'best_epoch': final_result['best_epoch'],
-            'last_10_accs': final_result['last_n_values'],
+            'mean_acc': summary['mean'],
+            'std_acc': float(np.mean([r['std'] for r in finals])),
+            'best_acc': best['best_overall'],
+            'best_epoch': best['best_epoch'],
+            'last_10_accs': finals[-1]['last_n_values'],
             'task_name': TRANSFER_TASKS[task_id]['name'],
-            'result_dir': str(latest_dir)
+            'result_dir': str(list(seed_results.values())[-1][1]),
+            'num_seeds': summary['n'],
+            'seed_std': summary['std'],
+            'ci95': summary['ci'],
         }
         
-        print(f"  ✓ 最后10轮平均准确率: {final_result['mean']*100:.2f}% ± {final_result['std']*100:.2f}%")
-        print(f"    历史最佳: {final_result['best_overall']*100:.2f}% (Epoch {final_result['best_epoch']})")
-        
-        # 保存每个任务的详细结果
-        result_file = latest_dir / 'final_results.txt'
-        with open(result_file, 'w', encoding='utf-8') as f:
-            f.write("="*80 + "\n")
-            f.write(f"  {task_id}: {TRANSFER_TASKS[task_id]['name']}\n")
-            f.write("="*80 + "\n\n")
-            f.write(f"最后10个Epoch的平均结果:\n")
-            f.write(f"  平均准确率: {final_result['mean']*100:.2f}% ± {final_result['std']*100:.2f}%\n")
-            f.write(f"  最小值: {final_result['min']*100:.2f}%\n")
-            f.write(f"  最大值: {final_result['max']*100:.2f}%\n\n")
-            f.write(f"历史最佳准确率: {final_result['best_overall']*100:.2f}% (Epoch {final_result['best_epoch']})\n\n")
-            f.write(f"最后10个Epoch的详细数据:\n")
-            for i, acc in enumerate(final_result['last_n_values'], 1):
-                f.write(f"  Epoch {len(accs['epochs'])-10+i}: {acc*100:.2f}%\n")
+        if summary['n'] > 1 and verbose:
+            print(f"  ✓ {summary['n']} 个种子: {summary['mean']*100:.2f}% ± {summary['std']*100:.2f}% "
+                  f"(95% CI ±{summary['ci']*100:.2f}%)")
+    
+    return task_results
+
+
+def extract_all_results():
+    """提取所有任务的结果"""
+    
+    print("="*80)
+    print("  提取DAGCN所有任务的训练结果")
+    print("="*80)
+    
+    dagcn_dir = os.path.join(RESULTS_DIR, 'DAGCN')
+    
+    if not os.path.exists(dagcn_dir):
+        print(f"\n错误: 结果目录不存在: {dagcn_dir}")
+        return
+    
+    # 增量导入新的日志内容
+    conn = results_db.connect(results_db.default_db_path(RESULTS_DIR))
+    runs, records = results_db.ingest(conn, RESULTS_DIR)
+    print(f"\n结果数据库: 扫描 {runs} 个运行，新导入 {records} 条epoch记录")
+    
+    task_results = collect_task_results(conn, RESULTS_DIR)
     
     # 保存汇总结果
     summary_csv = os.path.join(ANALYSIS_DIR, 'DAGCN_results_summary.csv')
@@ -137,7 +163,8 @@ def extract_all_results():
     
     with open(summary_csv, 'w', newline='', encoding='utf-8') as f:
         writer = csv.writer(f)
-        writer.writerow(['Task ID', 'Task Name', 'Mean Accuracy (%)', 'Std (%)', 'Best Accuracy (%)', 'Best Epoch'])
+        writer.writerow(['Task ID', 'Task Name', 'Mean Accuracy (%)', 'Std (%)', 'Best Accuracy (%)', 'Best Epoch',
+                         'Seeds', 'Seed Std (%)', 'CI95 (%)'])
         
         for task_id in sorted(task_results.keys()):
             result = task_results[task_id]
@@ -147,13 +174,16 @@ def extract_all_results():
                 f"{result['mean_acc']*100:.2f}",
                 f"{result['std_acc']*100:.2f}",
                 f"{result['best_acc']*100:.2f}",
-                result['best_epoch']
+                result['best_epoch'],
+                result['num_seeds'],
+                f"{result['seed_std']*100:.2f}",
+                f"{result['ci95']*100:.2f}"
             ])
         
         # 计算平均值
         if task_results:
             avg_mean = np.mean([r['mean_acc'] for r in task_results.values()])
-            writer.writerow(['Average', '', f"{avg_mean*100:.2f}", '', '', ''])
+            writer.writerow(['Average', '', f"{avg_mean*100:.2f}", '', '', '', '', '', ''])
     
     print(f"\n\n{'='*80}")
     print(f"  结果提取完成")
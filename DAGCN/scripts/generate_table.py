@@ -4,32 +4,28 @@
 """
 import os
 import sys
-import csv
 from pathlib import Path
 import numpy as np
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
-from scripts.config import TRANSFER_TASKS, PAPER_RESULTS, ANALYSIS_DIR
+from scripts.config import TRANSFER_TASKS, PAPER_RESULTS, RESULTS_DIR, ANALYSIS_DIR
+from scripts import results_db
+from scripts.extract_results import collect_task_results
 
 
 def load_dagcn_results():
-    """加载DAGCN的实验结果"""
-    csv_file = os.path.join(ANALYSIS_DIR, 'DAGCN_results_summary.csv')
+    """从结果数据库查询DAGCN的实验结果（先增量导入新的日志内容）"""
+    conn = results_db.connect(results_db.default_db_path(RESULTS_DIR))
+    results_db.ingest(conn, RESULTS_DIR)
+    task_results = collect_task_results(conn, RESULTS_DIR, verbose=False)
     
-    if not os.path.exists(csv_file):
-        print(f"错误: 未找到结果文件 {csv_file}")
-        print("请先运行 extract_results.py")
+    if not task_results:
+        print(f"错误: 结果数据库中没有DAGCN的训练结果 ({RESULTS_DIR})")
+        print("请先运行 train_all_tasks.py")
         return None
     
-    results = {}
-    with open(csv_file, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if row['Task ID'] == 'Average':
-                results['Average'] = float(row['Mean Accuracy (%)']) / 100
-            else:
-                task_id = row['Task ID']
-                results[task_id] = float(row['Mean Accuracy (%)']) / 100
+    results = {task_id: result['mean_acc'] for task_id, result in task_results.items()}
+    results['Average'] = np.mean(list(results.values()))
     
     return results
 
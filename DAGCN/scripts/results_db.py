@@ -0,0 +1,198 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+# DAGCN/scripts/results_db.py
+"""
+SQLite结果索引
+增量导入RESULTS_DIR下所有train.log：按文件记录已读取的字节偏移，只解析新增的行，
+日志被重写（变短或开头内容变化）时才重新导入。
+extract_results.py和generate_table.py直接查询该数据库，也可以用 --query 执行任意SQL，例如
+  SELECT task_id, seed, json_extract(args, '$.lr') FROM runs
+"""
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from scripts.config import RESULTS_DIR
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_dir TEXT PRIMARY KEY,   -- 相对RESULTS_DIR的目录，如 DAGCN/DAGCN_Task_0to1_20251023_172653
+    model TEXT,                 -- RESULTS_DIR下的一级目录，如 DAGCN、search
+    task_id TEXT,
+    seed INTEGER,
+    config_hash TEXT,
+    status TEXT,
+    args TEXT,                  -- 训练参数JSON，优先取run_config.json，否则取日志开头记录的参数
+    log_offset INTEGER DEFAULT 0,
+    log_head TEXT,
+    config_mtime INTEGER,
+    ingested REAL
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    run_dir TEXT,
+    epoch INTEGER,
+    phase TEXT,
+    loss REAL,
+    acc REAL,
+    cost REAL,
+    PRIMARY KEY (run_dir, epoch, phase)
+);
+"""
+
+EPOCH_PATTERN = re.compile(r'Epoch: (\d+) (\S+)-Loss: (\S+) \S+-Acc: ([\d.]+), Cost ([\d.]+) sec')
+ARG_PATTERN = re.compile(r'^\S+ \S+ (\w+): (.*)$')
+DIR_PATTERN = re.compile(r'^DAGCN_(.+?)_\d{8}_\d{6}(?:_seed(\d+))?$')
+HEAD_BYTES = 256
+
+
+def default_db_path(results_dir=RESULTS_DIR):
+    return os.path.join(results_dir, 'results.db')
+
+
+def connect(db_path=None):
+    conn = sqlite3.connect(db_path or default_db_path())
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def parse_header_args(text):
+    """日志开头（第一个epoch之前）逐行记录的训练参数"""
+    args = {}
+    for line in text.splitlines():
+        if '-----Epoch' in line:
+            break
+        match = ARG_PATTERN.match(line)
+        if match:
+            args[match.group(1)] = match.group(2)
+    return args
+
+
+def config_mtime(run_dir):
+    path = os.path.join(run_dir, 'run_config.json')
+    return os.stat(path).st_mtime_ns if os.path.exists(path) else None
+
+
+def read_run_config(run_dir):
+    try:
+        with open(os.path.join(run_dir, 'run_config.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def run_identity(rel_dir, args):
+    """从目录名（DAGCN_{task_id}_{时间}[_seedN]）或训练参数得到 (task_id, seed)"""
+    match = DIR_PATTERN.match(os.path.basename(rel_dir))
+    if match:
+        seed = match.group(2)
+        return match.group(1), None if seed is None else int(seed)
+    seed = args.get('seed')
+    seed = int(seed) if seed not in (None, '', 'None') else None
+    return args.get('task_id') or None, seed
+
+
+def ingest_run(conn, results_dir, run_dir):
+    """增量导入一个运行目录，return: 新导入的epoch记录数"""
+    rel_dir = os.path.relpath(run_dir, results_dir).replace(os.sep, '/')
+    log_file = os.path.join(run_dir, 'train.log')
+    size = os.path.getsize(log_file)
+    mtime = config_mtime(run_dir)
+    row = conn.execute('SELECT log_offset, log_head, config_mtime, config_hash, status, args FROM runs '
+                       'WHERE run_dir = ?', (rel_dir,)).fetchone()
+    if row is not None and row[0] == size and row[2] == mtime:
+        return 0
+    offset, head, old_mtime, config_hash, status, args = row if row else (0, None, None, None, None, None)
+
+    with open(log_file, 'rb') as f:
+        new_head = hashlib.sha1(f.read(HEAD_BYTES)).hexdigest()
+        if row is not None and (size < offset or (head != new_head and offset >= HEAD_BYTES)):
+            # 日志被重写，重新导入
+            conn.execute('DELETE FROM metrics WHERE run_dir = ?', (rel_dir,))
+            offset, args = 0, None
+        f.seek(offset)
+        chunk = f.read(size - offset)
+    # 只处理完整的行，未写完的行留到下次
+    chunk = chunk[:chunk.rfind(b'\n') + 1]
+    text = chunk.decode('utf-8', errors='ignore')
+
+    if mtime is not None and mtime != old_mtime:
+        run_config = read_run_config(run_dir)
+        config_hash, status = run_config.get('config_hash'), run_config.get('status')
+        args = json.dumps(run_config.get('args', {}), default=str)
+    elif args is None:
+        args = json.dumps(parse_header_args(text))
+    task_id, seed = run_identity(rel_dir, json.loads(args))
+
+    records = [(rel_dir, int(m.group(1)), m.group(2), float(m.group(3)), float(m.group(4)), float(m.group(5)))
+               for m in EPOCH_PATTERN.finditer(text)]
+    # 续训会重新记录同一epoch，以最新的为准
+    conn.executemany('INSERT OR REPLACE INTO metrics VALUES (?, ?, ?, ?, ?, ?)', records)
+    conn.execute('INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+        rel_dir, rel_dir.split('/')[0], task_id, seed, config_hash, status, args,
+        offset + len(chunk), new_head, mtime, time.time(),
+    ))
+    return len(records)
+
+
+def ingest(conn, results_dir=RESULTS_DIR):
+    """
+    导入results_dir下所有包含train.log的目录
+    return: (扫描的运行数, 新导入的epoch记录数)
+    """
+    runs, records = 0, 0
+    for root, dirs, files in os.walk(results_dir):
+        dirs.sort()
+        if 'train.log' in files:
+            runs += 1
+            records += ingest_run(conn, results_dir, root)
+    conn.commit()
+    return runs, records
+
+
+def latest_runs(conn, task_id, model='DAGCN'):
+    """
+    任务的结果目录，与按目录名查找的规则一致：
+    有多种子结果时返回每个种子最新的目录，否则返回最新的单次运行目录
+    return: {seed或None: 相对目录}
+    """
+    rows = conn.execute('SELECT run_dir, seed FROM runs WHERE model = ? AND task_id = ? ORDER BY run_dir',
+                        (model, task_id)).fetchall()
+    seeded = {seed: run_dir for run_dir, seed in rows if seed is not None}
+    if seeded:
+        return dict(sorted(seeded.items()))
+    return {None: rows[-1][0]} if rows else {}
+
+
+def phase_accuracies(conn, run_dir, phase='target_val'):
+    """return: 按epoch排序的 {'epochs', 'target_val_accs'}，供calculate_final_result使用"""
+    rows = conn.execute('SELECT epoch, acc FROM metrics WHERE run_dir = ? AND phase = ? ORDER BY epoch',
+                        (run_dir, phase)).fetchall()
+    return {'epochs': [epoch for epoch, _ in rows], 'target_val_accs': [acc for _, acc in rows]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Index training results in SQLite')
+    parser.add_argument('--db', type=str, default=None, help='the database file, default RESULTS_DIR/results.db')
+    parser.add_argument('--query', type=str, default=None, help='run a SQL query after ingestion')
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    start_time = time.time()
+    runs, records = ingest(conn)
+    print(f"扫描 {runs} 个运行，新导入 {records} 条epoch记录，用时 {time.time() - start_time:.2f} 秒")
+    if args.query:
+        cursor = conn.execute(args.query)
+        print('\t'.join(d[0] for d in cursor.description))
+        for row in cursor:
+            print('\t'.join(str(v) for v in row))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,324 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+# DAGCN/scripts/runner.py
+"""
+进程内任务运行器
+直接调用train_utils训练，不再为每个任务启动新的python子进程；
+同一进程内的任务共享已导入的模块和已加载的域数据
+"""
+import os
+import sys
+import json
+import time
+import logging
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import torch
+from train_advanced import parse_args, find_or_make_save_dir
+from utils.logger import setlogger
+from utils.train_utils_combines import train_utils, set_seed
+from utils.manifest import write_run_config, finish_run
+from scripts.config import TRANSFER_TASKS, TRAIN_CONFIG, DATA_DIR, RESULTS_DIR
+from scripts.extract_results import calculate_final_result
+from scripts.scheduler import partition_cpus
+
+
+RunResult = namedtuple('RunResult', ['task_id', 'save_dir', 'metrics', 'history', 'elapsed', 'seed', 'cached'],
+                       defaults=(None, False))
+
+# 按 (数据目录, 域ID) 缓存的域数据，进程内所有任务共享
+DATA_CACHE = {}
+
+
+def build_args(task_id, config=None, task_config=None, data_dir=DATA_DIR, checkpoint_dir=None, **overrides):
+    """以train_advanced.py的默认参数为基础，叠加config和任务设置"""
+    config = TRAIN_CONFIG if config is None else config
+    task_config = TRANSFER_TASKS[task_id] if task_config is None else task_config
+
+    args = parse_args([])
+    for key, value in config.items():
+        setattr(args, key, value)
+    args.data_dir = data_dir
+    args.transfer_task = [task_config['source'], task_config['target']]
+    args.checkpoint_dir = checkpoint_dir or os.path.join(RESULTS_DIR, 'DAGCN')
+    args.task_id = task_id
+    for key, value in overrides.items():
+        setattr(args, key, value)
+    return args
+
+
+def summarize(history, last_n=10):
+    """由train_utils返回的history计算与extract_results.py相同的最终指标"""
+    target = [h for h in history if h['phase'] == 'target_val']
+    source = [h for h in history if h['phase'] == 'source_val']
+    if not target:
+        return None
+    accs = {'epochs': [h['epoch'] for h in target], 'target_val_accs': [h['acc'] for h in target]}
+    final = calculate_final_result(accs, last_n=min(last_n, len(target)))
+    return {
+        'mean_acc': final['mean'],
+        'std_acc': final['std'],
+        'best_acc': final['best_overall'],
+        'best_epoch': final['best_epoch'],
+        'last_10_accs': final['last_n_values'],
+        'final_target_acc': target[-1]['acc'],
+        'final_source_acc': source[-1]['acc'] if source else None,
+    }
+
+
+def load_history(save_dir):
+    with open(os.path.join(save_dir, 'history.json'), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def cached_result(task_id, save_dir, seed=None):
+    """由相同配置已完成的运行目录恢复RunResult，用时记为0"""
+    print(f"跳过 {run_key(task_id, seed)}: 相同配置已训练完成 {save_dir}")
+    history = load_history(save_dir)
+    return RunResult(task_id, save_dir, summarize(history), history, 0.0, seed, cached=True)
+
+
+def start_run(args, save_dir, digest):
+    """设置日志并记录参数和配置哈希"""
+    setlogger(os.path.join(save_dir, 'train.log'))
+    for k, v in args.__dict__.items():
+        logging.info("{}: {}".format(k, v))
+    write_run_config(save_dir, args, digest)
+
+
+def run_task(task_id, config=None, task_config=None, data_dir=DATA_DIR, checkpoint_dir=None,
+             data_cache=DATA_CACHE, **overrides):
+    """
+    在当前进程中训练单个任务
+    config: 训练参数，默认TRAIN_CONFIG；overrides可覆盖任意train_advanced.py参数
+    use_cache=True 时跳过相同配置已完成的运行，并从未完成运行的最新检查点继续
+    return: RunResult(task_id, save_dir, metrics, history, elapsed)
+    """
+    args = build_args(task_id, config, task_config, data_dir, checkpoint_dir, **overrides)
+    save_dir, status, digest = find_or_make_save_dir(args)
+    if status == 'completed':
+        return cached_result(task_id, save_dir, args.seed)
+    start_run(args, save_dir, digest)
+
+    start_time = time.time()
+    trainer = train_utils(args, save_dir, data_cache=data_cache)
+    trainer.setup()
+    if status is not None:
+        trainer.resume_from_dir()
+    history = trainer.train()
+    elapsed = time.time() - start_time
+    metrics = summarize(history)
+    finish_run(save_dir, **metrics)
+
+    return RunResult(task_id, save_dir, metrics, history, elapsed, args.seed)
+
+
+def run_source_group(task_ids, config=None, data_dir=DATA_DIR, checkpoint_dir=None,
+                     data_cache=DATA_CACHE, fork_seeds=None, **overrides):
+    """
+    训练源域相同的一组任务：纯源域阶段 (epoch < middle_epoch) 只训练一次，
+    同时评估所有目标域，保存状态后再为每个目标域分别进行域适应阶段
+    fork_seeds: 给定时纯源域阶段只用overrides中的seed训练一次，
+                每个目标域再以fork_seeds中的每个种子重新设定随机数，分别进行域适应阶段
+    return: [RunResult, ...]，按task_ids（以及fork_seeds）的顺序
+    """
+    sources = {str(TRANSFER_TASKS[task_id]['source']) for task_id in task_ids}
+    if len(sources) != 1:
+        raise ValueError(f"任务的源域不一致: {task_ids}")
+    args = build_args(task_ids[0], config, None, data_dir, checkpoint_dir, **overrides)
+    if fork_seeds is None and (args.middle_epoch <= 0 or len(task_ids) == 1):
+        return [run_task(task_id, config, None, data_dir, checkpoint_dir, data_cache, **overrides)
+                for task_id in task_ids]
+    # 以相同种子单独训练时结果一致，只有fork_seeds需要记录纯源域阶段的种子
+    extra = {} if fork_seeds is None else {'pretrain_seed': args.seed}
+    seeds = fork_seeds or [args.seed]
+    forks = []
+    for task_id in task_ids:
+        for seed in seeds:
+            fork_args = build_args(task_id, config, None, data_dir, checkpoint_dir, **overrides)
+            fork_args.seed = seed
+            forks.append((task_id, seed, fork_args) + find_or_make_save_dir(fork_args, **extra))
+    results = {(task_id, seed): cached_result(task_id, save_dir, seed)
+               for task_id, seed, _, save_dir, status, _ in forks if status == 'completed'}
+    forks = [fork for fork in forks if fork[4] != 'completed']
+    if not forks:
+        return list(results.values())
+
+    # 纯源域阶段，每个目标域的验证集作为单独的phase评估
+    source = TRANSFER_TASKS[task_ids[0]]['source']
+    args.task_id = 'Source{}_pretrain'.format(''.join(str(d) for d in source))
+    pretrain_dir, status, digest = find_or_make_save_dir(args, stage='pretrain', targets=task_ids)
+    state_path = os.path.join(pretrain_dir, 'pretrain_state.tar')
+    start_time = time.time()
+    if status == 'completed':
+        print(f"跳过纯源域阶段: 相同配置已训练完成 {pretrain_dir}")
+        pretrain_history = load_history(pretrain_dir)
+    else:
+        start_run(args, pretrain_dir, digest)
+        trainer = train_utils(args, pretrain_dir, data_cache=data_cache)
+        trainer.setup()
+        trainer.val_phases = ['source_val']
+        for task_id in task_ids:
+            trainer.add_target_val('{}/target_val'.format(task_id), TRANSFER_TASKS[task_id]['target'])
+        trainer.end_epoch = args.middle_epoch
+        pretrain_history = trainer.train()
+        trainer.save_state(state_path)
+        with open(os.path.join(pretrain_dir, 'history.json'), 'w', encoding='utf-8') as f:
+            json.dump(pretrain_history, f)
+        finish_run(pretrain_dir)
+    pretrain_time = (time.time() - start_time) / len(forks)
+
+    # 每个目标域从共享状态继续训练域适应阶段
+    for task_id, seed, args, save_dir, status, digest in forks:
+        start_run(args, save_dir, digest)
+        logging.info("source-only epochs shared from {}".format(pretrain_dir))
+
+        start_time = time.time()
+        trainer = train_utils(args, save_dir, data_cache=data_cache)
+        trainer.setup()
+        trainer.load_state(state_path)
+        if status is None or not trainer.resume_from_dir():
+            if fork_seeds is not None:
+                set_seed(seed)
+            phases = {'source_train': 'source_train', 'source_val': 'source_val',
+                      '{}/target_val'.format(task_id): 'target_val'}
+            trainer.log_history([dict(h, phase=phases[h['phase']])
+                                 for h in pretrain_history if h['phase'] in phases])
+        history = trainer.train()
+        elapsed = time.time() - start_time + pretrain_time
+        metrics = summarize(history)
+        finish_run(save_dir, **metrics)
+        results[(task_id, seed)] = RunResult(task_id, save_dir, metrics, history, elapsed, seed)
+    return [results[(task_id, seed)] for task_id in task_ids for seed in seeds]
+
+
+def group_by_source(task_ids):
+    """按源域对任务分组，保持原有顺序"""
+    groups = {}
+    for task_id in task_ids:
+        groups.setdefault(str(TRANSFER_TASKS[task_id]['source']), []).append(task_id)
+    return list(groups.values())
+
+
+def run_key(task_id, seed=None):
+    """多种子时以 task_id@seedN 区分同一任务的各次运行"""
+    return task_id if seed is None else f"{task_id}@seed{seed}"
+
+
+def try_run(fn, task_ids, **kwargs):
+    """运行一个任务或一组任务并捕获异常，return: ([RunResult]或None, 错误信息, 用时)"""
+    start_time = time.time()
+    try:
+        if fn == 'group':
+            results = run_source_group(task_ids, **kwargs)
+        else:
+            results = [run_task(task_ids[0], **kwargs)]
+        return results, None, time.time() - start_time
+    except Exception as e:
+        logging.exception('{} failed'.format(', '.join(task_ids)))
+        return None, repr(e), time.time() - start_time
+
+
+def make_units(task_ids, share_pretrain=False, seeds=None, seed_adaptation_only=False):
+    """
+    把任务拆分为调度单位 (fn, task_ids, 单位参数, 运行键列表)
+    seeds: 种子列表，每个任务（或源域分组）对每个种子各运行一次
+    seed_adaptation_only: 纯源域阶段只用第一个种子训练一次，各种子只作用于域适应阶段
+    """
+    if seed_adaptation_only and seeds:
+        return [('group', group, {'seed': seeds[0], 'fork_seeds': list(seeds)},
+                 [run_key(t, seed) for t in group for seed in seeds]) for group in group_by_source(task_ids)]
+    units = []
+    for seed in (seeds or [None]):
+        unit_kwargs = {} if seed is None else {'seed': seed}
+        if share_pretrain:
+            units += [('group', group, unit_kwargs, [run_key(t, seed) for t in group])
+                      for group in group_by_source(task_ids)]
+        else:
+            units += [('task', [t], unit_kwargs, [run_key(t, seed)]) for t in task_ids]
+    return units
+
+
+def init_worker(slot_queue, threads_per_job):
+    """工作进程初始化：设置线程数并绑定CPU核心"""
+    cpus = slot_queue.get()
+    os.environ['OMP_NUM_THREADS'] = str(threads_per_job)
+    os.environ['MKL_NUM_THREADS'] = str(threads_per_job)
+    torch.set_num_threads(threads_per_job)
+    if cpus is not None and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+
+
+def run_tasks(task_ids, jobs=1, threads_per_job=1, retries=0, share_pretrain=False, seeds=None,
+              seed_adaptation_only=False, **kwargs):
+    """
+    在jobs个常驻工作进程中运行多个任务，每个进程跨任务复用导入的模块和域数据
+    share_pretrain: 源域相同的任务共享纯源域阶段，以源域分组为调度单位
+    seeds / seed_adaptation_only: 见make_units
+    return: {运行键: {'status', 'attempts', 'elapsed', 'save_dir', 'cached', 'result', 'log'}}
+    """
+    units = make_units(task_ids, share_pretrain, seeds, seed_adaptation_only)
+    state = {key: {'status': 'pending', 'attempts': 0, 'elapsed': 0.0, 'save_dir': None, 'cached': False,
+                   'result': None, 'log': None} for unit in units for key in unit[3]}
+    unit_state = [{'status': 'pending', 'attempts': 0} for _ in units]
+    wall_start = time.time()
+
+    def finish(index, results, error, elapsed):
+        keys = units[index][3]
+        unit_state[index]['status'] = 'done'
+        for key in keys:
+            state[key]['attempts'] = unit_state[index]['attempts']
+        if error is None:
+            for result in results:
+                key = run_key(result.task_id, result.seed)
+                state[key].update(status='done', elapsed=state[key]['elapsed'] + result.elapsed,
+                                  save_dir=result.save_dir, cached=result.cached, result=result,
+                                  log=os.path.join(result.save_dir, 'train.log'))
+                acc = result.metrics['mean_acc'] * 100 if result.metrics else float('nan')
+                print(f"\n✓ {key} 训练完成！用时: {result.elapsed/60:.2f} 分钟，最后10轮平均准确率: {acc:.2f}%")
+        else:
+            for key in keys:
+                state[key]['elapsed'] += elapsed / len(keys)
+            if unit_state[index]['attempts'] <= retries:
+                unit_state[index]['status'] = 'pending'
+                print(f"\n✗ {', '.join(keys)} 第{unit_state[index]['attempts']}次运行失败: {error}，准备重试")
+            else:
+                for key in keys:
+                    state[key]['status'] = 'failed'
+                print(f"\n✗ {', '.join(keys)} 训练失败: {error}")
+        done = sum(v['status'] == 'done' for v in state.values())
+        print(f"完成 {done}/{len(state)}，总用时 {(time.time() - wall_start)/60:.1f}min")
+
+    if jobs == 1:
+        torch.set_num_threads(threads_per_job)
+        for index, (fn, unit_ids, unit_kwargs, _) in enumerate(units):
+            while unit_state[index]['status'] == 'pending':
+                unit_state[index]['attempts'] += 1
+                finish(index, *try_run(fn, unit_ids, **kwargs, **unit_kwargs))
+        return state
+
+    ctx = multiprocessing.get_context('spawn')
+    slot_queue = ctx.Queue()
+    for cpus in partition_cpus(jobs, threads_per_job):
+        slot_queue.put(cpus)
+
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=ctx, initializer=init_worker,
+                             initargs=(slot_queue, threads_per_job)) as executor:
+        futures = {}
+        while True:
+            for index, (fn, unit_ids, unit_kwargs, _) in enumerate(units):
+                if unit_state[index]['status'] == 'pending':
+                    unit_state[index]['status'] = 'running'
+                    unit_state[index]['attempts'] += 1
+                    futures[executor.submit(try_run, fn, unit_ids, **kwargs, **unit_kwargs)] = index
+            if not futures:
+                break
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                finish(futures.pop(future), *future.result())
+    return state
@@ -0,0 +1,180 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+# DAGCN/scripts/scheduler.py
+"""
+并行任务调度器
+同时运行N个训练子进程，每个进程绑定独立的CPU核心和线程数，失败自动重试
+"""
+import os
+import re
+import sys
+import time
+import subprocess
+
+
+def available_cpus():
+    """返回当前进程可用的CPU核心列表"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def partition_cpus(jobs, threads_per_job):
+    """把可用核心切分成jobs个互不重叠的槽位，核心不够时返回None（不绑定）"""
+    cpus = available_cpus()
+    if jobs * threads_per_job > len(cpus):
+        return [None] * jobs
+    return [cpus[i * threads_per_job:(i + 1) * threads_per_job] for i in range(jobs)]
+
+
+def read_progress(log_file):
+    """从子进程输出的末尾读取当前epoch"""
+    try:
+        with open(log_file, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 4096))
+            tail = f.read().decode('utf-8', errors='ignore')
+    except OSError:
+        return ''
+    matches = re.findall(r'Epoch (\d+)/(\d+)', tail)
+    if not matches:
+        return ''
+    epoch, last = matches[-1]
+    return f"{int(epoch) + 1}/{int(last) + 1}"
+
+
+def read_run_dir(log_file):
+    """
+    从子进程输出中读取train_advanced.py按配置哈希选定的运行目录
+    return: (目录, 是否为已完成的缓存运行)，没有找到时为(None, False)
+    """
+    try:
+        with open(log_file, 'r', encoding='utf-8', errors='ignore') as f:
+            for line in f:
+                match = re.match(r'run directory: (.+) \((\w+)\)$', line.rstrip('\n'))
+                if match:
+                    return match.group(1), match.group(2) == 'completed'
+    except OSError:
+        pass
+    return None, False
+
+
+def format_time(seconds):
+    return f"{seconds/60:.1f}min"
+
+
+class TaskScheduler(object):
+    """
+    tasks: {task_id: cmd}，cmd为train_advanced.py的命令行参数列表
+    jobs: 同时运行的任务数
+    threads_per_job: 每个任务的torch/OMP线程数
+    retries: 失败后的最大重试次数
+    """
+
+    def __init__(self, tasks, log_dir, cwd, jobs=1, threads_per_job=1, retries=0, refresh=30):
+        self.tasks = tasks
+        self.log_dir = log_dir
+        self.cwd = cwd
+        self.jobs = jobs
+        self.threads_per_job = threads_per_job
+        self.retries = retries
+        self.refresh = refresh
+
+        self.slots = partition_cpus(jobs, threads_per_job)
+        self.state = {task_id: {'status': 'pending', 'attempts': 0, 'elapsed': 0.0, 'log': None,
+                                'save_dir': None, 'cached': False}
+                      for task_id in tasks}
+
+    def launch(self, task_id, slot):
+        """启动单个任务的子进程"""
+        state = self.state[task_id]
+        state['attempts'] += 1
+        state['status'] = 'running'
+        state['start'] = time.time()
+        state['slot'] = slot
+        state['log'] = os.path.join(self.log_dir, f"{task_id}_attempt{state['attempts']}.log")
+
+        cpus = self.slots[slot]
+        env = os.environ.copy()
+        env['OMP_NUM_THREADS'] = str(self.threads_per_job)
+        env['MKL_NUM_THREADS'] = str(self.threads_per_job)
+        cmd = [sys.executable] + self.tasks[task_id] + ['--num_threads', str(self.threads_per_job)]
+
+        preexec_fn = None
+        if cpus is not None and hasattr(os, 'sched_setaffinity'):
+            preexec_fn = lambda: os.sched_setaffinity(0, cpus)
+
+        log = open(state['log'], 'w', encoding='utf-8')
+        state['proc'] = subprocess.Popen(cmd, cwd=self.cwd, env=env, stdout=log, stderr=subprocess.STDOUT,
+                                         preexec_fn=preexec_fn)
+        state['log_handle'] = log
+
+    def poll(self, task_id):
+        """检查运行中的任务，返回是否已结束"""
+        state = self.state[task_id]
+        returncode = state['proc'].poll()
+        if returncode is None:
+            return False
+        state['log_handle'].close()
+        state['elapsed'] += time.time() - state['start']
+        if returncode == 0:
+            state['status'] = 'done'
+            state['save_dir'], state['cached'] = read_run_dir(state['log'])
+        elif state['attempts'] <= self.retries:
+            state['status'] = 'pending'
+            print(f"\n✗ {task_id} 第{state['attempts']}次运行失败 (返回码 {returncode})，准备重试")
+        else:
+            state['status'] = 'failed'
+            print(f"\n✗ {task_id} 训练失败 (返回码 {returncode})，日志: {state['log']}")
+        return True
+
+    def print_table(self, wall_start):
+        print(f"\n{'Task ID':<15} {'Status':<10} {'Attempt':<8} {'Epoch':<10} {'CPUs':<12} {'Elapsed':<10}")
+        print("-"*70)
+        for task_id, state in self.state.items():
+            elapsed = state['elapsed']
+            progress = ''
+            cpus = ''
+            if state['status'] == 'running':
+                elapsed += time.time() - state['start']
+                progress = read_progress(state['log'])
+                slot = self.slots[state['slot']]
+                cpus = f"{slot[0]}-{slot[-1]}" if slot else '-'
+            print(f"{task_id:<15} {state['status']:<10} {state['attempts']:<8} {progress:<10} {cpus:<12} "
+                  f"{format_time(elapsed):<10}")
+        done = sum(s['status'] == 'done' for s in self.state.values())
+        print("-"*70)
+        print(f"完成 {done}/{len(self.state)}，总用时 {format_time(time.time() - wall_start)}")
+
+    def run(self):
+        """运行所有任务直到全部成功或失败，返回 (state, 总墙钟时间)"""
+        os.makedirs(self.log_dir, exist_ok=True)
+        wall_start = time.time()
+        last_print = 0.0
+        free_slots = list(range(self.jobs))
+        running = []
+
+        while True:
+            changed = False
+            for task_id in list(running):
+                if self.poll(task_id):
+                    running.remove(task_id)
+                    free_slots.append(self.state[task_id]['slot'])
+                    changed = True
+
+            pending = [t for t, s in self.state.items() if s['status'] == 'pending']
+            while pending and free_slots:
+                task_id = pending.pop(0)
+                self.launch(task_id, free_slots.pop(0))
+                running.append(task_id)
+                changed = True
+
+            if not running:
+                break
+            if changed or time.time() - last_print > self.refresh:
+                self.print_table(wall_start)
+                last_print = time.time()
+            time.sleep(1)
+
+        self.print_table(wall_start)
+        return self.state, time.time() - wall_start
@@ -0,0 +1,327 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+# DAGCN/scripts/search.py
+"""
+超参数搜索
+在常驻进程中直接调用train_utils训练各个试验，支持网格/随机采样和异步逐次减半（ASHA）剪枝：
+每个试验先训练到最低一级的epoch预算，只有在同一级中排名前1/eta的试验才从检查点继续训练到下一级，
+其余试验提前停止。最后输出按得分排序的排行榜以及每个试验实际训练的epoch数和用时
+
+注意: 搜索middle_epoch时，低级预算小于middle_epoch的试验还没有进入域适应阶段，按纯源域模型参与排名
+"""
+import os
+import sys
+import ast
+import csv
+import json
+import math
+import time
+import random
+import logging
+import argparse
+import itertools
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import torch
+from utils.logger import setlogger
+from utils.train_utils_combines import train_utils
+from scripts.config import TRANSFER_TASKS, TRAIN_CONFIG, DATA_DIR, RESULTS_DIR, SEARCH_SPACE
+from scripts.runner import build_args, init_worker, DATA_CACHE
+from scripts.scheduler import partition_cpus, available_cpus, format_time
+
+
+def grid_trials(space):
+    """网格搜索：所有取值的笛卡尔积"""
+    for key, values in space.items():
+        if not isinstance(values, list):
+            raise ValueError(f"网格搜索只支持列表取值: {key}={values}")
+    keys = list(space.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*space.values())]
+
+
+def sample_value(rng, spec):
+    if isinstance(spec, list):
+        return rng.choice(spec)
+    kind, low, high = spec
+    if kind == 'uniform':
+        return rng.uniform(low, high)
+    if kind == 'loguniform':
+        return math.exp(rng.uniform(math.log(low), math.log(high)))
+    raise ValueError(f"未知的采样方式: {kind}")
+
+
+def random_trials(space, n_trials, seed=0):
+    """随机搜索：列表取值均匀选择，('uniform'|'loguniform', 下限, 上限)连续采样"""
+    rng = random.Random(seed)
+    return [{key: sample_value(rng, spec) for key, spec in space.items()} for _ in range(n_trials)]
+
+
+def make_rungs(max_epoch, min_epoch, eta):
+    """逐次减半的各级epoch预算 min_epoch * eta^k，最后一级为max_epoch"""
+    rungs = []
+    budget = max(1, min_epoch)
+    while budget < max_epoch:
+        rungs.append(budget)
+        budget *= eta
+    return rungs + [max_epoch]
+
+
+def score(history, metric='target_val', last_n=3):
+    """最近last_n个epoch的验证准确率均值"""
+    accs = [h['acc'] for h in history if h['phase'] == metric][-last_n:]
+    return sum(accs) / len(accs) if accs else 0.0
+
+
+def train_trial(task_id, params, save_dir, end_epoch, config=None, data_dir=DATA_DIR, seed=0,
+                metric='target_val', last_n=3):
+    """
+    把一个试验训练到end_epoch，目录中已有检查点时从检查点继续
+    return: (得分, 本次用时, 错误信息)
+    """
+    start_time = time.time()
+    try:
+        args = build_args(task_id, config, None, data_dir, os.path.dirname(save_dir), seed=seed, **params)
+        os.makedirs(save_dir, exist_ok=True)
+        setlogger(os.path.join(save_dir, 'train.log'))
+        trainer = train_utils(args, save_dir, data_cache=DATA_CACHE)
+        trainer.setup()
+        if not trainer.resume_from_dir():
+            for k, v in args.__dict__.items():
+                logging.info("{}: {}".format(k, v))
+        trainer.end_epoch = end_epoch
+        history = trainer.train()
+        return score(history, metric, last_n), time.time() - start_time, None
+    except Exception as e:
+        logging.exception('{} failed'.format(save_dir))
+        return None, time.time() - start_time, repr(e)
+
+
+class Search(object):
+    """
+    试验状态和ASHA晋级规则
+    trials: 参数字典列表
+    rungs: 各级epoch预算，只有一级时不剪枝，每个试验直接训练到最后
+    """
+
+    def __init__(self, trials, rungs, eta=3):
+        self.rungs = rungs
+        self.eta = eta
+        self.trials = [{'id': i, 'params': params, 'status': 'pending', 'rung': -1, 'epochs': 0,
+                        'elapsed': 0.0, 'score': None, 'rung_scores': [], 'error': None}
+                       for i, params in enumerate(trials)]
+        self.rung_results = [{} for _ in rungs]
+        self.promoted = [set() for _ in rungs]
+
+    def next_job(self):
+        """优先晋级某一级中排名前1/eta且尚未晋级的试验，否则开始一个新试验；return: (试验id, 级别) 或 None"""
+        for k in reversed(range(len(self.rungs) - 1)):
+            ranked = sorted(self.rung_results[k].items(), key=lambda item: -item[1])
+            for trial_id, _ in ranked[:len(ranked) // self.eta]:
+                if trial_id not in self.promoted[k]:
+                    self.promoted[k].add(trial_id)
+                    self.trials[trial_id]['status'] = 'running'
+                    return trial_id, k + 1
+        for trial in self.trials:
+            if trial['status'] == 'pending':
+                trial['status'] = 'running'
+                return trial['id'], 0
+        return None
+
+    def report(self, trial_id, rung, score, elapsed, error=None):
+        trial = self.trials[trial_id]
+        trial['elapsed'] += elapsed
+        if error is not None:
+            trial['status'] = 'failed'
+            trial['error'] = error
+            return
+        trial['rung'] = rung
+        trial['epochs'] = self.rungs[rung]
+        trial['score'] = score
+        trial['rung_scores'].append(score)
+        self.rung_results[rung][trial_id] = score
+        trial['status'] = 'completed' if rung == len(self.rungs) - 1 else 'paused'
+
+    def finish(self):
+        """搜索结束时仍停在中间级别的试验即被剪枝"""
+        for trial in self.trials:
+            if trial['status'] == 'paused':
+                trial['status'] = 'pruned'
+
+    def leaderboard(self):
+        """按到达的级别、再按该级得分排序"""
+        return sorted(self.trials, key=lambda t: (t['rung'], -1 if t['score'] is None else t['score']),
+                      reverse=True)
+
+
+def trial_dir(search_dir, trial_id):
+    return os.path.join(search_dir, 'trial_{:03d}'.format(trial_id))
+
+
+def run_search(search, search_dir, jobs=1, threads_per_job=1, **kwargs):
+    """在jobs个常驻工作进程中调度试验，直到没有可开始或可晋级的试验"""
+    def describe(trial_id, rung):
+        trial = search.trials[trial_id]
+        params = ', '.join(f"{k}={v:.3g}" if isinstance(v, float) else f"{k}={v}"
+                           for k, v in trial['params'].items())
+        return f"trial_{trial_id:03d} [{params}] 第{rung}级 ({search.rungs[rung]} epochs)"
+
+    def report(trial_id, rung, result):
+        search.report(trial_id, rung, *result)
+        trial = search.trials[trial_id]
+        if trial['status'] == 'failed':
+            print(f"✗ {describe(trial_id, rung)} 训练失败: {trial['error']}")
+        else:
+            print(f"✓ {describe(trial_id, rung)} 得分: {trial['score']*100:.2f}%，"
+                  f"累计用时 {format_time(trial['elapsed'])}")
+
+    if jobs == 1:
+        torch.set_num_threads(threads_per_job)
+        job = search.next_job()
+        while job is not None:
+            trial_id, rung = job
+            report(trial_id, rung, train_trial(params=search.trials[trial_id]['params'],
+                                               save_dir=trial_dir(search_dir, trial_id),
+                                               end_epoch=search.rungs[rung], **kwargs))
+            job = search.next_job()
+        search.finish()
+        return
+
+    ctx = multiprocessing.get_context('spawn')
+    slot_queue = ctx.Queue()
+    for cpus in partition_cpus(jobs, threads_per_job):
+        slot_queue.put(cpus)
+
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=ctx, initializer=init_worker,
+                             initargs=(slot_queue, threads_per_job)) as executor:
+        futures = {}
+        while True:
+            while len(futures) < jobs:
+                job = search.next_job()
+                if job is None:
+                    break
+                trial_id, rung = job
+                future = executor.submit(train_trial, params=search.trials[trial_id]['params'],
+                                         save_dir=trial_dir(search_dir, trial_id),
+                                         end_epoch=search.rungs[rung], **kwargs)
+                futures[future] = job
+            if not futures:
+                break
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                trial_id, rung = futures.pop(future)
+                report(trial_id, rung, future.result())
+    search.finish()
+
+
+def save_leaderboard(search, search_dir, keys):
+    """保存排行榜CSV和完整的试验记录"""
+    rows = []
+    for rank, trial in enumerate(search.leaderboard(), 1):
+        row = {'Rank': rank, 'Trial': 'trial_{:03d}'.format(trial['id'])}
+        row.update({key: trial['params'][key] for key in keys})
+        row.update({
+            'Status': trial['status'],
+            'Epochs': trial['epochs'],
+            'Time (min)': f"{trial['elapsed']/60:.2f}",
+            'Score (%)': '' if trial['score'] is None else f"{trial['score']*100:.2f}",
+        })
+        rows.append(row)
+
+    with open(os.path.join(search_dir, 'leaderboard.csv'), 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+    with open(os.path.join(search_dir, 'search.json'), 'w', encoding='utf-8') as f:
+        json.dump({'rungs': search.rungs, 'eta': search.eta, 'trials': search.trials}, f, indent=2)
+    return rows
+
+
+def print_leaderboard(rows, keys, top=20):
+    print(f"\n{'Rank':<5} {'Trial':<10} " + ' '.join(f"{key:<16}" for key in keys) +
+          f" {'Status':<10} {'Epochs':<7} {'Time':<9} {'Score':<8}")
+    print("-"*(45 + 17 * len(keys)))
+    for row in rows[:top]:
+        values = ' '.join(f"{row[key]:<16.4g}" if isinstance(row[key], float) else f"{str(row[key]):<16}"
+                          for key in keys)
+        print(f"{row['Rank']:<5} {row['Trial']:<10} {values} {row['Status']:<10} {row['Epochs']:<7} "
+              f"{row['Time (min)'] + 'min':<9} {row['Score (%)']:<8}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Hyperparameter search')
+    parser.add_argument('--task', type=str, default='Task_0to1', help='the transfer task to tune on')
+    parser.add_argument('--sampler', type=str, choices=['grid', 'random'], default='random',
+                        help='how trials are drawn from the search space')
+    parser.add_argument('--n_trials', type=int, default=20, help='the number of random trials')
+    parser.add_argument('--space', type=str, default=None,
+                        help='python literal dict overriding SEARCH_SPACE in config.py')
+    parser.add_argument('--pruner', type=str, choices=['asha', 'none'], default='asha',
+                        help='asha stops unpromising trials at intermediate epoch budgets')
+    parser.add_argument('--eta', type=int, default=3, help='the top 1/eta trials of a rung are promoted')
+    parser.add_argument('--min_epoch', type=int, default=10, help='the epoch budget of the lowest rung')
+    parser.add_argument('--max_epoch', type=int, default=TRAIN_CONFIG['max_epoch'], help='the full epoch budget')
+    parser.add_argument('--metric', type=str, choices=['target_val', 'source_val'], default='target_val',
+                        help='the validation phase used to rank trials')
+    parser.add_argument('--last_n', type=int, default=3, help='trials are scored by the mean of the last n epochs')
+    parser.add_argument('--seed', type=int, default=0, help='the training seed shared by all trials')
+    parser.add_argument('--jobs', type=int, default=1, help='the number of trials trained concurrently')
+    parser.add_argument('--threads_per_job', type=int, default=0,
+                        help='cpu threads of each trial, 0 splits the available cores evenly')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    space = ast.literal_eval(args.space) if args.space else SEARCH_SPACE
+    if args.sampler == 'grid':
+        trials = grid_trials(space)
+    else:
+        trials = random_trials(space, args.n_trials, args.seed)
+    if args.pruner == 'asha':
+        rungs = make_rungs(args.max_epoch, args.min_epoch, args.eta)
+    else:
+        rungs = [args.max_epoch]
+    jobs = max(1, min(args.jobs, len(trials)))
+    threads_per_job = args.threads_per_job or max(1, len(available_cpus()) // jobs)
+
+    timestamp = datetime.strftime(datetime.now(), '%Y%m%d_%H%M%S')
+    search_dir = os.path.join(RESULTS_DIR, 'search', f"{args.task}_{timestamp}")
+    os.makedirs(search_dir, exist_ok=True)
+
+    print("="*80)
+    print("  DAGCN 超参数搜索")
+    print("="*80)
+    print(f"\n任务: {args.task} ({TRANSFER_TASKS[args.task]['name']})，试验数: {len(trials)}，"
+          f"采样: {args.sampler}，剪枝: {args.pruner}")
+    print(f"各级epoch预算: {rungs}，排名指标: {args.metric} 最后{args.last_n}轮均值")
+    print(f"并行试验数: {jobs}，每个试验线程数: {threads_per_job}")
+    print(f"保存位置: {search_dir}\n")
+
+    config = dict(TRAIN_CONFIG, max_epoch=args.max_epoch)
+    search = Search(trials, rungs, args.eta)
+    wall_start = time.time()
+    run_search(search, search_dir, jobs=jobs, threads_per_job=threads_per_job, task_id=args.task,
+               config=config, data_dir=DATA_DIR, seed=args.seed, metric=args.metric, last_n=args.last_n)
+    total_time = time.time() - wall_start
+
+    keys = list(space.keys())
+    rows = save_leaderboard(search, search_dir, keys)
+    print_leaderboard(rows, keys)
+
+    epochs = sum(t['epochs'] for t in search.trials)
+    trial_time = sum(t['elapsed'] for t in search.trials)
+    counts = {status: sum(t['status'] == status for t in search.trials)
+              for status in ['completed', 'pruned', 'failed']}
+    print(f"\n完成 {counts['completed']}，剪枝 {counts['pruned']}，失败 {counts['failed']}")
+    print(f"总训练epoch数: {epochs} (不剪枝需 {len(trials) * args.max_epoch})，"
+          f"试验累计用时 {format_time(trial_time)}，墙钟时间 {format_time(total_time)}")
+    print(f"排行榜已保存: {os.path.join(search_dir, 'leaderboard.csv')}")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,11 +2,16 @@
 # -*- coding:utf-8 -*-
 """
 批量训练DAGCN的所有12个迁移任务
+支持多任务并行（--jobs）、按任务绑定CPU线程和失败重试
+--in_process 时在常驻进程内直接调用train_utils，省去每个任务的启动和数据加载开销
+--share_pretrain 时源域相同的任务只训练一次纯源域阶段，再分别进行域适应
+--seeds 时每个任务按每个种子各训练一次，由extract_results.py汇总均值/标准差/置信区间
+默认跳过配置哈希（参数、数据文件、代码版本）相同且已完成的训练，未完成的从最新检查点继续；--no_cache 强制重新训练
 """
 import os
 import sys
-import subprocess
 import time
+import argparse
 from datetime import datetime
 from pathlib import Path
 
@@ -14,32 +19,17 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from scripts.config import TRANSFER_TASKS, TRAIN_CONFIG, DATA_DIR, RESULTS_DIR
+from scripts.scheduler import TaskScheduler, available_cpus
+from scripts.runner import run_tasks, run_key
 
 
-def train_single_task(task_id, task_config, model_name='DAGCN'):
-    """训练单个任务"""
-    
-    # Create model parent directory with robust error handling
-    task_dir = os.path.join(RESULTS_DIR, model_name)
-    try:
-        # Ensure RESULTS_DIR exists first
-        if not os.path.exists(RESULTS_DIR):
-            os.makedirs(RESULTS_DIR, exist_ok=True)
-            print(f"Created results directory: {RESULTS_DIR}")
-        
-        # Then create task_dir
-        if not os.path.exists(task_dir):
-            os.makedirs(task_dir, exist_ok=True)
-            print(f"Created task directory: {task_dir}")
-    except Exception as e:
-        print(f"Error creating directory {task_dir}: {e}")
-        raise
-    
-    
-    # 构建训练命令
+def build_command(task_id, task_config, task_dir, seed=None, use_cache=True):
+    """构建单个任务的训练命令（不含python解释器）"""
     # 传递task_id参数，让train_advanced.py创建规范命名的目录
-    cmd = [
-        'python', 'train_advanced.py',
+    seed_args = [] if seed is None else ['--seed', str(seed)]
+    cache_args = ['--use_cache'] if use_cache else []
+    return [
+        'train_advanced.py',
         '--model_name', TRAIN_CONFIG['model_name'],
         '--data_dir', DATA_DIR,
         '--transfer_task', f"[{task_config['source']},{task_config['target']}]",
@@ -55,125 +45,135 @@ def train_single_task(task_id, task_config, model_name='DAGCN'):
         '--domain_adversarial', str(TRAIN_CONFIG['domain_adversarial']),
         '--hidden_size', str(TRAIN_CONFIG['hidden_size']),
         '--normlizetype', TRAIN_CONFIG['normlizetype'],
-    ]
-    
-    print(f"\n{'='*80}")
-    print(f"  开始训练: {task_id} ({task_config['name']})")
-    print(f"{'='*80}")
-    print(f"结果将保存为: DAGCN_{task_id}_YYYYMMDD_HHMMSS")
-    print(f"命令: {' '.join(cmd)}\n")
-    
-    # 执行训练
-    start_time = time.time()
-    
+    ] + seed_args + cache_args
+
+
+def write_task_config(save_dir, task_id, task_config, elapsed_time, attempts=1):
+    """保存任务配置"""
+    config_file = os.path.join(save_dir, 'task_config.txt')
+    with open(config_file, 'w', encoding='utf-8') as f:
+        f.write("="*60 + "\n")
+        f.write(f"  任务配置信息\n")
+        f.write("="*60 + "\n\n")
+        f.write(f"模型: DAGCN\n")
+        f.write(f"任务ID: {task_id}\n")
+        f.write(f"任务名称: {task_config['name']}\n")
+        f.write(f"源域: {task_config['source']} HP\n")
+        f.write(f"目标域: {task_config['target']} HP\n\n")
+        f.write(f"训练时间: {elapsed_time:.2f} 秒 ({elapsed_time/60:.2f} 分钟)\n")
+        f.write(f"运行次数: {attempts}\n")
+        f.write(f"训练状态: 成功完成\n\n")
+        f.write("训练参数:\n")
+        f.write("-"*60 + "\n")
+        for key, value in TRAIN_CONFIG.items():
+            f.write(f"  {key}: {value}\n")
+
+
+def make_task_dir(model_name='DAGCN'):
+    """创建结果父目录"""
+    task_dir = os.path.join(RESULTS_DIR, model_name)
     try:
-        # 切换到DAGCN目录
-        os.chdir(Path(__file__).parent.parent)
-        
-        # 运行训练
-        result = subprocess.run(cmd, check=True, capture_output=False, text=True)
-        
-        elapsed_time = time.time() - start_time
-        
-        # 找到实际创建的目录（最新的以 DAGCN_task_id 开头的）
-        import glob
-        pattern = os.path.join(task_dir, f'DAGCN_{task_id}_*')
-        matching_dirs = sorted(glob.glob(pattern), key=os.path.getmtime)
-        
-        if matching_dirs:
-            actual_save_dir = matching_dirs[-1]  # 最新的目录
-            
-            # 保存任务配置
-            config_file = os.path.join(actual_save_dir, 'task_config.txt')
-            with open(config_file, 'w', encoding='utf-8') as f:
-                f.write("="*60 + "\n")
-                f.write(f"  任务配置信息\n")
-                f.write("="*60 + "\n\n")
-                f.write(f"模型: DAGCN\n")
-                f.write(f"任务ID: {task_id}\n")
-                f.write(f"任务名称: {task_config['name']}\n")
-                f.write(f"源域: {task_config['source']} HP\n")
-                f.write(f"目标域: {task_config['target']} HP\n\n")
-                f.write(f"训练时间: {elapsed_time:.2f} 秒 ({elapsed_time/60:.2f} 分钟)\n")
-                f.write(f"训练状态: 成功完成\n\n")
-                f.write("训练参数:\n")
-                f.write("-"*60 + "\n")
-                for key, value in TRAIN_CONFIG.items():
-                    f.write(f"  {key}: {value}\n")
-            
-            print(f"\n✓ {task_id} 训练完成！用时: {elapsed_time/60:.2f} 分钟")
-            print(f"  结果保存在: {actual_save_dir}")
-            return True, actual_save_dir
-        else:
-            print(f"\n✗ 未找到训练结果目录")
-            return False, None
-            
-    except subprocess.CalledProcessError as e:
-        elapsed_time = time.time() - start_time
-        print(f"\n✗ {task_id} 训练失败！用时: {elapsed_time/60:.2f} 分钟")
-        print(f"错误信息: {str(e)}")
-        return False, None
+        os.makedirs(task_dir, exist_ok=True)
+    except Exception as e:
+        print(f"Error creating directory {task_dir}: {e}")
+        raise
+    return task_dir
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Train all transfer tasks')
+    parser.add_argument('--jobs', type=int, default=1, help='the number of tasks trained concurrently')
+    parser.add_argument('--threads_per_job', type=int, default=0,
+                        help='cpu threads of each task, 0 splits the available cores evenly')
+    parser.add_argument('--retries', type=int, default=1, help='the number of retries of a failed task')
+    parser.add_argument('--refresh', type=int, default=30, help='the interval (sec) of the progress table')
+    parser.add_argument('--tasks', type=str, nargs='*', default=None, help='task ids to train, default all')
+    parser.add_argument('--in_process', action='store_true',
+                        help='train inside long-lived worker processes instead of one subprocess per task')
+    parser.add_argument('--share_pretrain', action='store_true',
+                        help='train the source-only phase once per source domain (implies --in_process)')
+    parser.add_argument('--seeds', type=int, nargs='+', default=None, help='train every task once per seed')
+    parser.add_argument('--seed_adaptation_only', action='store_true',
+                        help='share one source-only phase between all seeds, seeds only vary the adaptation '
+                             '(implies --share_pretrain)')
+    parser.add_argument('--no_cache', action='store_true',
+                        help='retrain configs that have already been trained instead of reusing their results')
+    return parser.parse_args()
 
 
 def main():
-    """主函数：按顺序训练所有任务"""
-    
+    """主函数：并行训练所有任务"""
+    args = parse_args()
+    task_ids = args.tasks if args.tasks else list(TRANSFER_TASKS.keys())
+    runs = [(run_key(task_id, seed), task_id, seed) for seed in (args.seeds or [None]) for task_id in task_ids]
+    share_pretrain = args.share_pretrain or args.seed_adaptation_only
+    jobs = max(1, min(args.jobs, len(runs)))
+    threads_per_job = args.threads_per_job or max(1, len(available_cpus()) // jobs)
+
     print("="*80)
     print("  DAGCN 批量训练系统")
     print("="*80)
-    print(f"\n总任务数: {len(TRANSFER_TASKS)}")
-    print(f"预计总时间: {len(TRANSFER_TASKS) * 4} 分钟 (每个任务约4分钟)")
+    print(f"\n总任务数: {len(task_ids)}，种子: {args.seeds or '未设定'}，共 {len(runs)} 次训练")
+    print(f"并行任务数: {jobs}，每个任务线程数: {threads_per_job}，失败重试次数: {args.retries}")
     print(f"\n结果保存格式: DAGCN_Task_XtoY_YYYYMMDD_HHMMSS")
     print(f"保存位置: {RESULTS_DIR}/DAGCN/\n")
-    
+
     # 显示所有任务
     print("将要训练的任务:")
     print("-"*80)
-    for i, (task_id, task_config) in enumerate(TRANSFER_TASKS.items(), 1):
-        print(f"  {i:2d}. {task_id:<15} {task_config['name']}")
+    for i, task_id in enumerate(task_ids, 1):
+        print(f"  {i:2d}. {task_id:<15} {TRANSFER_TASKS[task_id]['name']}")
     print("-"*80)
-    
-    input("\n按回车键开始训练...")
-    
+
+    task_dir = make_task_dir()
+    if args.in_process or share_pretrain:
+        wall_start = time.time()
+        states = run_tasks(task_ids, jobs=jobs, threads_per_job=threads_per_job, retries=args.retries,
+                           share_pretrain=share_pretrain, seeds=args.seeds,
+                           seed_adaptation_only=args.seed_adaptation_only, data_dir=DATA_DIR,
+                           checkpoint_dir=task_dir, use_cache=not args.no_cache)
+        total_time = time.time() - wall_start
+    else:
+        commands = {key: build_command(task_id, TRANSFER_TASKS[task_id], task_dir, seed, not args.no_cache)
+                    for key, task_id, seed in runs}
+        scheduler = TaskScheduler(commands, log_dir=os.path.join(task_dir, 'logs'),
+                                  cwd=str(Path(__file__).parent.parent), jobs=jobs,
+                                  threads_per_job=threads_per_job, retries=args.retries, refresh=args.refresh)
+        states, total_time = scheduler.run()
+
     # 记录训练结果
     results = {}
     completed_tasks = []
     failed_tasks = []
-    
-    total_start_time = time.time()
-    
-    # 按顺序训练每个任务
-    for i, (task_id, task_config) in enumerate(TRANSFER_TASKS.items(), 1):
-        print(f"\n\n{'#'*80}")
-        print(f"  进度: {i}/{len(TRANSFER_TASKS)}")
-        print(f"{'#'*80}")
-        
-        success, save_dir = train_single_task(task_id, task_config)
-        
-        results[task_id] = {
+
+    for key, task_id, seed in runs:
+        state = states[key]
+        # 运行目录由train_advanced.py按配置哈希选定并报告，缓存命中的运行保留原有的任务配置
+        save_dir = state['save_dir'] if state['status'] == 'done' else None
+        success = save_dir is not None
+        if success:
+            if not state['cached']:
+                write_task_config(save_dir, task_id, TRANSFER_TASKS[task_id], state['elapsed'], state['attempts'])
+            completed_tasks.append(key)
+        else:
+            failed_tasks.append(key)
+
+        results[key] = {
             'success': success,
             'save_dir': save_dir,
-            'task_name': task_config['name']
+            'task_name': TRANSFER_TASKS[task_id]['name'],
+            'elapsed': state['elapsed'],
+            'attempts': state['attempts'],
+            'log': state['log'],
         }
-        
-        if success:
-            completed_tasks.append(task_id)
-        else:
-            failed_tasks.append(task_id)
-        
-        # 显示进度
-        print(f"\n当前进度: 完成 {len(completed_tasks)}/{len(TRANSFER_TASKS)} 个任务")
-        if failed_tasks:
-            print(f"失败任务: {', '.join(failed_tasks)}")
-    
+    task_time = sum(r['elapsed'] for r in results.values())
+
     # 总结
-    total_time = time.time() - total_start_time
-    
     print(f"\n\n{'='*80}")
     print(f"  训练完成总结")
     print(f"{'='*80}")
-    print(f"\n总用时: {total_time/60:.2f} 分钟")
-    print(f"成功: {len(completed_tasks)}/{len(TRANSFER_TASKS)} 个任务")
+    print(f"\n总用时: {total_time/60:.2f} 分钟 (各任务累计 {task_time/60:.2f} 分钟，加速比 {task_time/max(total_time, 1e-6):.2f}x)")
+    print(f"成功: {len(completed_tasks)}/{len(runs)} 个任务")
     
     if completed_tasks:
         print(f"\n✓ 完成的任务:")
@@ -186,6 +186,7 @@ def main():
         print(f"\n✗ 失败的任务:")
         for task_id in failed_tasks:
             print(f"  - {task_id}: {results[task_id]['task_name']}")
+            print(f"    日志: {results[task_id]['log']}")
     
     # 保存训练总结
     summary_file = os.path.join(RESULTS_DIR, 'DAGCN', 'training_summary.txt')
@@ -195,7 +196,10 @@ def main():
         f.write("="*80 + "\n\n")
         f.write(f"训练时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
         f.write(f"总用时: {total_time/60:.2f} 分钟\n")
-        f.write(f"成功任务: {len(completed_tasks)}/{len(TRANSFER_TASKS)}\n\n")
+        f.write(f"各任务累计用时: {task_time/60:.2f} 分钟\n")
+        f.write(f"并行加速比: {task_time/max(total_time, 1e-6):.2f}x\n")
+        f.write(f"并行任务数: {jobs}，每个任务线程数: {threads_per_job}\n")
+        f.write(f"成功任务: {len(completed_tasks)}/{len(runs)}\n\n")
         
         f.write("-"*80 + "\n")
         f.write("任务详情:\n")
@@ -204,13 +208,14 @@ def main():
         for task_id, result in results.items():
             f.write(f"{task_id}: {result['task_name']}\n")
             f.write(f"  状态: {'成功' if result['success'] else '失败'}\n")
+            f.write(f"  用时: {result['elapsed']/60:.2f} 分钟，运行次数: {result['attempts']}\n")
             if result['save_dir']:
                 f.write(f"  目录: {os.path.basename(result['save_dir'])}\n")
             f.write("\n")
     
     print(f"\n训练总结已保存到: {summary_file}")
     
-    if len(completed_tasks) == len(TRANSFER_TASKS):
+    if len(completed_tasks) == len(runs):
         print("\n🎉 所有任务训练完成！")
         print("\n下一步：运行以下命令提取结果")
         print("  cd D:\\桌面\\DAGCN-main\\DAGCN")
@@ -0,0 +1,260 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""
+Streaming diagnosis server: micro-batches vibration windows from many sensors
+
+    python serve.py --model ./checkpoint/DAGCN_Task_0to1_20251023_172653 --port 8000 --max_latency_ms 20
+
+    POST /predict  {"windows": [[...signal_size raw samples...], ...]}  or  {"window": [...]}
+    GET  /metrics  queueing, batching and latency statistics
+    GET  /health
+
+MRF_GCN builds its graph over the whole batch, so windows of concurrent requests are
+collected into one batch until --batch_size windows are waiting or the oldest one has
+waited --max_latency_ms, then scored with one forward pass. --unix_socket serves the
+same HTTP API on a Unix socket instead of TCP. With --bank every window is classified
+against the reference bank of the run (see reference_bank.py), so its prediction does not
+depend on the requests it is batched with.
+"""
+import json
+import time
+import asyncio
+import argparse
+import warnings
+from collections import deque
+import numpy as np
+import torch
+from inference import load_model, normalize_windows
+from utils.train_utils_combines import set_seed
+
+warnings.filterwarnings('ignore')
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 503: 'Service Unavailable'}
+
+
+class Micro_Batcher(object):
+    """
+    Collect the windows of concurrent requests into batches under a latency deadline
+    """
+    def __init__(self, model_all, config, batch_size=64, max_latency_ms=20.0, max_queue=4096, device='cpu',
+                 history=10000):
+        self.model_all = model_all
+        self.config = config
+        self.batch_size = batch_size
+        self.max_latency = max_latency_ms / 1000
+        self.max_queue = max_queue
+        self.device = device
+        self.queue = deque()
+        self.queued_windows = 0
+        self.wakeup = asyncio.Event()
+        self.started = time.time()
+        self.requests = 0
+        self.windows = 0
+        self.batches = 0
+        self.rejected = 0
+        # Recent per-request and per-batch measurements for the percentiles
+        self.queue_ms = deque(maxlen=history)
+        self.latency_ms = deque(maxlen=history)
+        self.batch_sizes = deque(maxlen=history)
+        self.inference_ms = deque(maxlen=history)
+
+    async def submit(self, windows):
+        """
+        :param windows: (n, signal_size) raw samples
+        :return: the per-window predictions of the request and its timings
+        """
+        if self.queued_windows + len(windows) > self.max_queue:
+            self.rejected += 1
+            raise OverflowError('queue is full')
+        future = asyncio.get_running_loop().create_future()
+        self.queue.append((windows, future, time.perf_counter()))
+        self.queued_windows += len(windows)
+        self.wakeup.set()
+        return await future
+
+    def forward(self, windows):
+        inputs = torch.from_numpy(normalize_windows(windows, self.config['normlizetype'])).unsqueeze(1)
+        with torch.inference_mode():
+            return torch.softmax(self.model_all(inputs.to(self.device)), dim=1).cpu().numpy()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self.queue:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+            # Wait for a full batch until the oldest window reaches its deadline
+            deadline = self.queue[0][2] + self.max_latency
+            while self.queued_windows < self.batch_size and time.perf_counter() < deadline:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), deadline - time.perf_counter())
+                except asyncio.TimeoutError:
+                    break
+
+            # Whole requests only, a request larger than batch_size gets a batch of its own
+            batch, count = [], 0
+            while self.queue and (not batch or count + len(self.queue[0][0]) <= self.batch_size):
+                item = self.queue.popleft()
+                batch.append(item)
+                count += len(item[0])
+            self.queued_windows -= count
+
+            start = time.perf_counter()
+            try:
+                probs = await loop.run_in_executor(None, self.forward, np.concatenate([w for w, _, _ in batch]))
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            end = time.perf_counter()
+            self.batches += 1
+            self.batch_sizes.append(count)
+            self.inference_ms.append((end - start) * 1000)
+
+            offset = 0
+            for windows, future, arrived in batch:
+                p = probs[offset:offset + len(windows)]
+                offset += len(windows)
+                self.requests += 1
+                self.windows += len(windows)
+                self.queue_ms.append((start - arrived) * 1000)
+                self.latency_ms.append((end - arrived) * 1000)
+                if future.done():
+                    continue
+                preds = p.argmax(axis=1)
+                future.set_result({
+                    'preds': preds.tolist(),
+                    'classes': [self.config['class_names'][i] for i in preds],
+                    'probs': p.round(6).tolist(),
+                    'batch_size': count,
+                    'queue_ms': (start - arrived) * 1000,
+                    'inference_ms': (end - start) * 1000,
+                    'latency_ms': (end - arrived) * 1000,
+                })
+
+    def metrics(self):
+        def percentiles(values):
+            if not values:
+                return None
+            values = np.array(values)
+            return {'mean': float(values.mean()), 'p50': float(np.percentile(values, 50)),
+                    'p90': float(np.percentile(values, 90)), 'p99': float(np.percentile(values, 99))}
+
+        uptime = time.time() - self.started
+        return {
+            'uptime_sec': uptime, 'requests': self.requests, 'windows': self.windows, 'batches': self.batches,
+            'rejected': self.rejected, 'queued_windows': self.queued_windows,
+            'windows_per_sec': self.windows / uptime if uptime > 0 else None,
+            'batch_size': percentiles(self.batch_sizes), 'queue_ms': percentiles(self.queue_ms),
+            'inference_ms': percentiles(self.inference_ms), 'latency_ms': percentiles(self.latency_ms),
+        }
+
+
+def parse_windows(body, signal_size):
+    request = json.loads(body)
+    windows = request['windows'] if 'windows' in request else [request['window']]
+    windows = np.asarray(windows, dtype=np.float32)
+    if windows.ndim != 2 or windows.shape[1] != signal_size or len(windows) == 0:
+        raise ValueError('expected windows of {} samples, got shape {}'.format(signal_size, list(windows.shape)))
+    return windows
+
+
+async def write_response(writer, status, payload):
+    body = json.dumps(payload).encode('utf-8')
+    writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n'.format(
+        status, REASONS[status], len(body)).encode('latin-1') + body)
+    await writer.drain()
+
+
+def make_handler(batcher):
+    signal_size = batcher.config['signal_size']
+
+    async def handle(reader, writer):
+        """
+        A minimal HTTP/1.1 server with keep-alive, enough for JSON requests
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path = request_line.decode('latin-1').split()[:2]
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                if path == '/predict' and method == 'POST':
+                    try:
+                        windows = parse_windows(body, signal_size)
+                    except (ValueError, KeyError, TypeError) as e:
+                        await write_response(writer, 400, {'error': str(e)})
+                    else:
+                        try:
+                            await write_response(writer, 200, await batcher.submit(windows))
+                        except OverflowError as e:
+                            await write_response(writer, 503, {'error': str(e)})
+                elif path == '/metrics' and method == 'GET':
+                    await write_response(writer, 200, batcher.metrics())
+                elif path == '/health' and method == 'GET':
+                    await write_response(writer, 200, {'status': 'ok'})
+                elif path in ('/predict', '/metrics', '/health'):
+                    await write_response(writer, 405, {'error': 'method not allowed'})
+                else:
+                    await write_response(writer, 404, {'error': 'not found'})
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+    return handle
+
+
+async def serve(args):
+    set_seed(args.seed)
+    model_all, config = load_model(args.model, args.device, args.bank)
+    batcher = Micro_Batcher(model_all, config, args.batch_size, args.max_latency_ms, args.max_queue, args.device)
+    handler = make_handler(batcher)
+    if args.unix_socket:
+        server = await asyncio.start_unix_server(handler, path=args.unix_socket)
+        print('serving on unix socket {}'.format(args.unix_socket))
+    else:
+        server = await asyncio.start_server(handler, args.host, args.port)
+        print('serving on http://{}:{}'.format(args.host, args.port))
+    batch_task = asyncio.create_task(batcher.run())
+    async with server:
+        await server.serve_forever()
+    batch_task.cancel()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Micro-batching diagnosis server')
+    parser.add_argument('--model', type=str, required=True, help='a *-best_model.pth file or a run directory')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='the address to listen on')
+    parser.add_argument('--port', type=int, default=8000, help='the port to listen on')
+    parser.add_argument('--unix_socket', type=str, default=None, help='listen on this unix socket instead')
+    parser.add_argument('--batch_size', type=int, default=64, help='the largest micro-batch in windows')
+    parser.add_argument('--max_latency_ms', type=float, default=20.0, help='the longest a window waits for a batch')
+    parser.add_argument('--max_queue', type=int, default=4096, help='queued windows before requests are rejected')
+    parser.add_argument('--device', type=str, default='cpu', help='the device to run on')
+    parser.add_argument('--num_threads', type=int, default=0, help='the number of cpu threads used by torch, 0 keeps the default')
+    parser.add_argument('--seed', type=int, default=0, help='the random seed, MRF_GCN drops random edges')
+    parser.add_argument('--bank', action='store_true', help='classify every window against the reference bank of the run')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
@@ -3,10 +3,14 @@
 
 import argparse
 import os
+import sys
 from datetime import datetime
 from utils.logger import setlogger
 import logging
 from utils.train_utils_combines import train_utils
+from utils.manifest import config_hash, find_run, write_run_config, finish_run
+from utils.feature_cache import load_backbone_state, backbone_hash
+from utils.distributed import init_distributed, is_main_process, get_world_size, broadcast_object, cleanup_distributed
 import torch
 import warnings
 print(torch.__version__)
@@ -14,7 +18,7 @@ warnings.filterwarnings('ignore')
 
 args = None
 
-def parse_args():
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(description='Train')
     # model and data parameters
     parser.add_argument('--model_name', type=str, default='DAGCN_features', help='the name of the model')
@@ -29,6 +33,24 @@ def parse_args():
     parser.add_argument("--pretrained", type=bool, default=False, help='whether to load the pretrained model')
     parser.add_argument('--batch_size', type=int, default=64, help='batchsize of the training process')
     parser.add_argument('--num_workers', type=int, default=0, help='the number of training process')
+    parser.add_argument('--seed', type=int, default=None, help='the random seed of torch, numpy and random')
+    parser.add_argument('--num_threads', type=int, default=0, help='the number of cpu threads used by torch, 0 keeps the default')
+    parser.add_argument('--accumulation_steps', type=int, default=1,
+                        help='micro-batches of batch_size whose gradients are accumulated per optimizer step')
+    parser.add_argument('--checkpoint_gcn', action='store_true',
+                        help='recompute the MultiChev/BatchNorm activations of MRF_GCN in backward to save memory')
+    parser.add_argument('--checkpoint_cnn', action='store_true',
+                        help='recompute the activations of the CNN stages in backward to save memory')
+    parser.add_argument('--dist_backend', type=str, default='gloo',
+                        help='the torch.distributed backend when started by torchrun, gloo runs on cpu')
+    parser.add_argument('--graph_mode', type=str, choices=['per_rank', 'all_gather'], default='per_rank',
+                        help='with DDP, one MRF_GCN graph per process or one graph over the all-gathered batches')
+    parser.add_argument('--amp', type=str, choices=['none', 'bf16', 'fp16'], default='none',
+                        help='train under autocast in bf16 or fp16, fp16 scales the gradients')
+    parser.add_argument('--backbone', type=str, default='',
+                        help='a *-best_model.pth or *_ckpt.tar whose CNN is frozen, the rest trains on its cached features')
+    parser.add_argument('--feature_cache_dir', type=str, default='',
+                        help='the directory of the cached backbone features, default checkpoint_dir/feature_cache')
 
     parser.add_argument('--bottleneck', type=bool, default=True, help='whether using the bottleneck layer')
     parser.add_argument('--bottleneck_num', type=int, default=256*1, help='whether using the bottleneck layer')
@@ -55,31 +77,37 @@ def parse_args():
     parser.add_argument('--middle_epoch', type=int, default=1, help='max number of epoch')
     parser.add_argument('--max_epoch', type=int, default=300, help='max number of epoch')
     parser.add_argument('--print_step', type=int, default=50, help='the interval of log training information')
+    parser.add_argument('--use_cache', action='store_true', help='skip a config that has been trained and resume an unfinished one')
+
+    # profiling
+    parser.add_argument('--profile', action='store_true', help='profile a window of source-only and adaptation steps')
+    parser.add_argument('--profile_wait', type=int, default=1, help='steps skipped before each profiling window')
+    parser.add_argument('--profile_warmup', type=int, default=1, help='warmup steps of each profiling window')
+    parser.add_argument('--profile_active', type=int, default=5, help='recorded steps of each profiling window')
+    parser.add_argument('--profile_row_limit', type=int, default=30, help='the number of ops in the profile tables')
     
     # æ–°å¢žï¼šä»»åŠ¡æ ‡è¯†ï¼ˆç”¨äºŽç›®å½•å‘½åï¼‰
     parser.add_argument('--task_id', type=str, default='', help='task identifier for saving results')
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     return args
 
 
-if __name__ == '__main__':
-
-    args = parse_args()
-    os.environ['CUDA_VISIBLE_DEVICES'] = args.cuda_device.strip()
-    
+def make_save_dir(args):
     # Prepare the saving path for the model
     # å¦‚æžœæŒ‡å®šäº†task_idï¼Œä½¿ç”¨å¸¦ä»»åŠ¡æ ‡è¯†çš„ç›®å½•å
     if args.task_id:
         # æ ¼å¼: DAGCN_Task_3to0_20241023_164239
         timestamp = datetime.strftime(datetime.now(), '%Y%m%d_%H%M%S')
         sub_dir = f"DAGCN_{args.task_id}_{timestamp}"
+        if args.seed is not None:
+            sub_dir += f"_seed{args.seed}"
     else:
         # åŽŸæ¥çš„æ ¼å¼: DAGCN_features_1023-164239
         sub_dir = args.model_name + '_' + datetime.strftime(datetime.now(), '%m%d-%H%M%S')
     
     save_dir = os.path.join(args.checkpoint_dir, sub_dir)
-    
+
     # Ensure directory creation succeeds (including all parent directories)
     try:
         # 直接创建最终目录（递归创建所有父目录）
@@ -88,14 +116,60 @@ if __name__ == '__main__':
     except Exception as e:
         print(f"创建目录 {save_dir} 失败: {e}")
         raise
+    return save_dir
+
+
+def find_or_make_save_dir(args, stage='full', **extra):
+    """
+    Reuse the directory of a previous run with the same config hash when use_cache is set
+    :return: (save_dir, status, digest), status is None for a new directory
+    """
+    if args.backbone:
+        # The weights decide the result, not the path they are loaded from
+        extra['backbone_weights'] = backbone_hash(load_backbone_state(args.backbone))
+    digest = config_hash(args, stage, **extra)
+    save_dir, status = find_run(args.checkpoint_dir, digest) if args.use_cache else (None, None)
+    if save_dir is None:
+        save_dir = make_save_dir(args)
+    return save_dir, status, digest
+
+
+if __name__ == '__main__':
+
+    args = parse_args()
+    os.environ['CUDA_VISIBLE_DEVICES'] = args.cuda_device.strip()
+    if args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
+    
+    # Started by torchrun: rank 0 picks the directory, logs and saves
+    distributed = init_distributed(args.dist_backend)
+    save_dir, status, digest = None, None, None
+    if is_main_process():
+        extra = {'world_size': get_world_size()} if distributed else {}
+        save_dir, status, digest = find_or_make_save_dir(args, **extra)
+    save_dir, status, digest = broadcast_object((save_dir, status, digest))
+    if is_main_process():
+        # Read by scripts/scheduler.py read_run_dir, the directory is picked by config hash
+        print('run directory: {} ({})'.format(save_dir, status or 'new'), flush=True)
+    if status == 'completed':
+        print('skip, the same config has been trained in {}'.format(save_dir))
+        cleanup_distributed()
+        sys.exit(0)
 
-    # set the logger
-    setlogger(os.path.join(save_dir, 'train.log'))
+    if is_main_process():
+        # set the logger
+        setlogger(os.path.join(save_dir, 'train.log'))
 
-    # save the args
-    for k, v in args.__dict__.items():
-        logging.info("{}: {}".format(k, v))
+        # save the args
+        for k, v in args.__dict__.items():
+            logging.info("{}: {}".format(k, v))
+        write_run_config(save_dir, args, digest)
 
     trainer = train_utils(args, save_dir)
     trainer.setup()
-    trainer.train()
\ No newline at end of file
+    if status is not None:
+        trainer.resume_from_dir()
+    trainer.train()
+    if is_main_process():
+        finish_run(save_dir, best_acc=trainer.best_acc)
+    cleanup_distributed()
\ No newline at end of file
@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+
+import os
+import torch.distributed as dist
+from torch import nn
+
+
+def init_distributed(backend='gloo'):
+    """
+    Join the process group when started by torchrun (WORLD_SIZE > 1)
+    :return: whether training is distributed
+    """
+    if int(os.environ.get('WORLD_SIZE', 1)) <= 1:
+        return False
+    if not dist.is_initialized():
+        dist.init_process_group(backend=backend)
+    return True
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def broadcast_object(obj, src=0):
+    """obj of rank src on every rank"""
+    if not is_distributed():
+        return obj
+    objects = [obj]
+    dist.broadcast_object_list(objects, src=src)
+    return objects[0]
+
+
+def cleanup_distributed():
+    if is_distributed():
+        dist.destroy_process_group()
+
+
+class Adaptation_Net(nn.Module):
+    """
+    The feature extractor, bottleneck, classifier and AdversarialNet as one module, so that
+    DistributedDataParallel reduces the gradients of a step in one pass
+    """
+    def __init__(self, model, bottleneck_layer, classifier_layer, adversarial_net=None):
+        super(Adaptation_Net, self).__init__()
+        self.model = model
+        self.bottleneck_layer = bottleneck_layer
+        self.classifier_layer = classifier_layer
+        self.adversarial_net = adversarial_net
+
+    def forward(self, inputs, adversarial=False):
+        """
+        :return: (features, outputs, the AdversarialNet output or None)
+        """
+        features = self.model(inputs)
+        if self.bottleneck_layer is not None:
+            features = self.bottleneck_layer(features)
+        outputs = self.classifier_layer(features)
+        adversarial_out = self.adversarial_net(features) if adversarial else None
+        return features, outputs, adversarial_out
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import torch
+from torch.utils.data import Dataset, DataLoader
+from utils.manifest import dataset_manifest
+
+BACKBONE_PREFIX = '0.model_cnn.'
+
+
+def load_backbone_state(path):
+    """
+    The CNN weights of a *-best_model.pth (model_all) or a *_ckpt.tar checkpoint
+    """
+    state = torch.load(path, map_location='cpu')
+    if 'model_state_dict' in state:
+        state = state['model_state_dict']
+    state = {k[len(BACKBONE_PREFIX):]: v for k, v in state.items() if k.startswith(BACKBONE_PREFIX)}
+    if not state:
+        raise ValueError('{} has no {} weights'.format(path, BACKBONE_PREFIX + '*'))
+    return state
+
+
+def backbone_hash(state):
+    """Hash of the backbone weights, the same for a .pth and a .tar of the same model"""
+    sha = hashlib.sha1()
+    for k in sorted(state):
+        sha.update(k.encode('utf-8'))
+        sha.update(state[k].detach().cpu().contiguous().numpy().tobytes())
+    return sha.hexdigest()
+
+
+def cache_key(weights, data_name, data_dir, domains, normlizetype, split):
+    """
+    :param weights: backbone_hash of the frozen backbone
+    :param split: 'train' or 'val' half of domain_split(domains)
+    """
+    config = {'backbone': weights, 'data_name': data_name, 'domains': sorted(int(d) for d in domains),
+              'normlizetype': normlizetype, 'split': split, 'dataset': dataset_manifest(data_dir, domains)}
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class Feature_Dataset(Dataset):
+    """(feature, label) pairs read from the memory-mapped store"""
+    def __init__(self, features, labels):
+        self.features = features
+        self.labels = labels
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, item):
+        return torch.from_numpy(np.array(self.features[item])), int(self.labels[item])
+
+
+def build_features(path, dataset, backbone, device, batch_size=256):
+    """
+    Run the backbone in eval mode over dataset once and write features.npy and labels.npy
+    to path. The files are written to a temporary directory and moved in place when complete,
+    so an interrupted run never leaves a partial store behind
+    """
+    tmp = path + '.tmp{}'.format(os.getpid())
+    os.makedirs(tmp, exist_ok=True)
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False)
+    features = None
+    labels = np.lib.format.open_memmap(os.path.join(tmp, 'labels.npy'), mode='w+', dtype=np.int64,
+                                       shape=(len(dataset),))
+    backbone.eval()
+    offset = 0
+    with torch.inference_mode():
+        for inputs, targets in loader:
+            outputs = backbone(inputs.to(device)).float().cpu().numpy()
+            if features is None:
+                features = np.lib.format.open_memmap(os.path.join(tmp, 'features.npy'), mode='w+',
+                                                     dtype=np.float32, shape=(len(dataset), outputs.shape[1]))
+            features[offset:offset + len(outputs)] = outputs
+            labels[offset:offset + len(outputs)] = targets.numpy()
+            offset += len(outputs)
+    features.flush()
+    labels.flush()
+    del features, labels
+    try:
+        os.replace(tmp, path)
+    except OSError:
+        # Another process completed the same store first
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def cached_features(cache_dir, key, dataset, backbone, device, batch_size=256):
+    """
+    :return: a Feature_Dataset of the backbone features of dataset, computed on the first call for key
+    """
+    path = os.path.join(cache_dir, key)
+    if not os.path.isdir(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        build_features(path, dataset, backbone, device, batch_size)
+    features = np.load(os.path.join(path, 'features.npy'), mmap_mode='r')
+    labels = np.load(os.path.join(path, 'labels.npy'))
+    if len(labels) != len(dataset):
+        raise ValueError('the feature cache {} does not match the dataset'.format(path))
+    return Feature_Dataset(features, labels)
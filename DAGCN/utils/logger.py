@@ -6,6 +6,10 @@ import logging
 def setlogger(path):
     logger = logging.getLogger()
     logger.setLevel(logging.INFO)
+    # Drop the handlers of a previous run in the same process
+    for handler in logger.handlers[:]:
+        logger.removeHandler(handler)
+        handler.close()
     logFormatter = logging.Formatter("%(asctime)s %(message)s", "%m-%d %H:%M:%S")
 
     fileHandler = logging.FileHandler(path)
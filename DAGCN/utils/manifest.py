@@ -0,0 +1,120 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+
+import os
+import glob
+import json
+import hashlib
+from datetime import datetime
+from datasets.CWRU import DOMAIN_MAP, CLASS_MAP
+
+# Arguments that only change where or how fast a run happens, not its result
+VOLATILE_ARGS = ['data_dir', 'checkpoint_dir', 'task_id', 'cuda_device', 'num_workers', 'num_threads',
+                 'print_step', 'resume', 'max_model_num', 'use_cache', 'profile', 'profile_wait',
+                 'profile_warmup', 'profile_active', 'profile_row_limit', 'checkpoint_gcn', 'checkpoint_cnn',
+                 'dist_backend', 'backbone', 'feature_cache_dir']
+
+# Source files whose content defines the training code version
+CODE_DIRS = ['models', 'loss', 'datasets', 'utils']
+CODE_FILES = ['train_advanced.py']
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def dataset_manifest(data_dir, domains):
+    """
+    List every .mat file of the given domains as (relative path, size, mtime)
+    """
+    manifest = []
+    for d in sorted(set(int(d) for d in domains)):
+        for cname in CLASS_MAP:
+            cdir = os.path.join(data_dir, cname, DOMAIN_MAP[d])
+            if not os.path.isdir(cdir):
+                continue
+            for fn in sorted(os.listdir(cdir)):
+                if fn.lower().endswith('.mat'):
+                    st = os.stat(os.path.join(cdir, fn))
+                    manifest.append([cname + '/' + DOMAIN_MAP[d] + '/' + fn, st.st_size, st.st_mtime_ns])
+    return manifest
+
+
+def code_version():
+    """
+    Hash of the training code, uncommitted edits included
+    """
+    sha = hashlib.sha1()
+    paths = [os.path.join(ROOT, f) for f in CODE_FILES]
+    for d in CODE_DIRS:
+        paths += glob.glob(os.path.join(ROOT, d, '**', '*.py'), recursive=True)
+    for path in sorted(paths):
+        sha.update(os.path.relpath(path, ROOT).replace(os.sep, '/').encode('utf-8'))
+        with open(path, 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+def effective_config(args, stage='full', **extra):
+    """
+    The content that determines the result of a run
+    :param stage: 'full' for a whole run, 'pretrain' for the source-only phase only
+    :param extra: settings that live outside args, e.g. the seed of a shared source-only phase
+    """
+    config = {k: v for k, v in sorted(args.__dict__.items()) if k not in VOLATILE_ARGS}
+    transfer_task = args.transfer_task
+    if isinstance(transfer_task[0], str):
+        transfer_task = eval("".join(transfer_task))
+    transfer_task = [list(map(int, domains)) for domains in transfer_task]
+    if stage == 'pretrain':
+        transfer_task = transfer_task[:1]
+    config['transfer_task'] = transfer_task
+    config['stage'] = stage
+    config['dataset'] = dataset_manifest(args.data_dir, sum(transfer_task, []))
+    config['code_version'] = code_version()
+    config.update(extra)
+    return config
+
+
+def config_hash(args, stage='full', **extra):
+    config = effective_config(args, stage, **extra)
+    return hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def write_run_config(save_dir, args, digest, status='running', **extra):
+    record = {'config_hash': digest, 'status': status, 'task_id': args.task_id,
+              'updated': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+              'args': {k: v for k, v in args.__dict__.items()}}
+    record.update(extra)
+    with open(os.path.join(save_dir, 'run_config.json'), 'w', encoding='utf-8') as f:
+        json.dump(record, f, indent=2, default=str)
+
+
+def finish_run(save_dir, **extra):
+    path = os.path.join(save_dir, 'run_config.json')
+    with open(path, 'r', encoding='utf-8') as f:
+        record = json.load(f)
+    record.update(extra)
+    record['status'] = 'completed'
+    record['updated'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(record, f, indent=2, default=str)
+
+
+def find_run(checkpoint_dir, digest):
+    """
+    Find a previous run with the same config hash, completed runs first, then the newest
+    :return: (save_dir, status) or (None, None)
+    """
+    found = []
+    for path in glob.glob(os.path.join(checkpoint_dir, '*', 'run_config.json')):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if record.get('config_hash') == digest:
+            found.append((record.get('status') == 'completed', os.path.getmtime(path),
+                          os.path.dirname(path), record.get('status')))
+    if not found:
+        return None, None
+    _, _, save_dir, status = max(found)
+    return save_dir, status
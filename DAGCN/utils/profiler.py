@@ -0,0 +1,63 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+
+import os
+import logging
+import torch
+from torch.profiler import profile, schedule, ProfilerActivity
+
+
+class Profile_Tool(object):
+    """
+    Capture a window of training steps with torch.profiler and export a chrome
+    trace plus a top-ops table for every window into save_dir/profile
+    """
+    def __init__(self, save_dir, wait=1, warmup=1, active=5, row_limit=30):
+        self.save_dir = os.path.join(save_dir, 'profile')
+        self.wait = wait
+        self.warmup = warmup
+        self.active = active
+        self.row_limit = row_limit
+        self.prof = None
+
+    def start(self, name):
+        self.stop()
+        os.makedirs(self.save_dir, exist_ok=True)
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        self.prof = profile(activities=activities,
+                            schedule=schedule(wait=self.wait, warmup=self.warmup, active=self.active, repeat=1),
+                            on_trace_ready=self.trace_handler(name),
+                            record_shapes=True,
+                            profile_memory=True)
+        self.prof.start()
+        logging.info('profiling {}: wait {} warmup {} active {} steps'.format(
+            name, self.wait, self.warmup, self.active))
+
+    def step(self):
+        if self.prof is not None:
+            self.prof.step()
+
+    def stop(self):
+        if self.prof is not None:
+            self.prof.stop()
+            self.prof = None
+
+    def trace_handler(self, name):
+        def fun1(prof):
+            trace_path = os.path.join(self.save_dir, '{}_trace.json'.format(name))
+            prof.export_chrome_trace(trace_path)
+
+            sort_by = 'self_cuda_time_total' if torch.cuda.is_available() else 'self_cpu_time_total'
+            table_path = os.path.join(self.save_dir, '{}_top_ops.txt'.format(name))
+            with open(table_path, 'w', encoding='utf-8') as f:
+                f.write('Top ops by self time\n')
+                f.write(prof.key_averages().table(sort_by=sort_by, row_limit=self.row_limit))
+                f.write('\n\nTop ops by self memory\n')
+                f.write(prof.key_averages().table(sort_by='self_cpu_memory_usage', row_limit=self.row_limit))
+                f.write('\n\nTop ops by input shape\n')
+                f.write(prof.key_averages(group_by_input_shape=True).table(sort_by=sort_by,
+                                                                           row_limit=self.row_limit))
+            logging.info('profile {} saved to {}'.format(name, self.save_dir))
+        return fun1
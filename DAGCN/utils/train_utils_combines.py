@@ -3,9 +3,14 @@
 
 import logging
 import os
+import glob
+import contextlib
+import json
 import time
 import warnings
 import math
+import random
+import numpy as np
 import torch
 from torch import nn
 from torch import optim
@@ -13,18 +18,36 @@ from utils.lr_scheduler import *
 import models
 import datasets
 from utils.save import Save_Tool
-from loss.DAN import DAN
+from utils.profiler import Profile_Tool
+from loss.DAN import DAN, DAN_Accumulator
+from utils.freeze import set_freeze_by_id
+from utils.feature_cache import load_backbone_state, backbone_hash, cache_key, cached_features
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data.distributed import DistributedSampler
+from utils.distributed import Adaptation_Net, is_distributed, is_main_process, get_world_size, broadcast_object
 
 
 
+AMP_DTYPES = {'none': None, 'bf16': torch.bfloat16, 'fp16': torch.float16}
 
 
+def set_seed(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    if torch.cuda.is_available():
+        torch.cuda.manual_seed_all(seed)
 
 
 class train_utils(object):
-    def __init__(self, args, save_dir):
+    def __init__(self, args, save_dir, data_cache=None):
         self.args = args
         self.save_dir = save_dir
+        self.data_cache = data_cache
+        self.val_phases = ['source_val', 'target_val']
+        self.history = []
+        # Called as callback(epoch, step, num_inputs) after every optimizer step
+        self.step_callbacks = []
 
     def setup(self):
         """
@@ -33,9 +56,20 @@ class train_utils(object):
         :return:
         """
         args = self.args
-
-        # Consider the gpu or cpu condition
-        if torch.cuda.is_available():
+        if args.seed is not None:
+            set_seed(args.seed)
+
+        # Consider the gpu or cpu condition, one device per process with DDP
+        self.distributed = is_distributed()
+        if self.distributed:
+            if torch.cuda.is_available():
+                self.device = torch.device("cuda", int(os.environ.get('LOCAL_RANK', 0)))
+                torch.cuda.set_device(self.device)
+            else:
+                self.device = torch.device("cpu")
+            self.device_count = 1
+            logging.info('using {} processes, batch size {} per process'.format(get_world_size(), args.batch_size))
+        elif torch.cuda.is_available():
             self.device = torch.device("cuda")
             self.device_count = torch.cuda.device_count()
             logging.info('using {} gpus'.format(self.device_count))
@@ -53,31 +87,21 @@ class train_utils(object):
         if isinstance(args.transfer_task[0],str):
            print(args.transfer_task)
            args.transfer_task= eval("".join(args.transfer_task))
-        self.datasets['source_train'], self.datasets['source_val'], self.datasets['target_train'], self.datasets['target_val'] = Dataset(args.data_dir, args.transfer_task, args.normlizetype).data_split(transfer_learning=True)
+        self.datasets['source_train'], self.datasets['source_val'], self.datasets['target_train'], self.datasets['target_val'] = Dataset(args.data_dir, args.transfer_task, args.normlizetype, cache=self.data_cache).data_split(transfer_learning=True)
 
 
-        self.dataloaders = {x: torch.utils.data.DataLoader(self.datasets[x], batch_size=args.batch_size,
-                                                           shuffle=(True if x.split('_')[1] == 'train' else False),
-                                                           num_workers=args.num_workers,
-                                                           pin_memory=(True if self.device == 'cuda' else False),
-                                                           drop_last=(True if args.last_batch and x.split('_')[1] == 'train' else False))
-                            for x in ['source_train', 'source_val', 'target_train', 'target_val']}
+        self.build_dataloaders()
 
-        # Define the model
-        self.model = getattr(models, args.model_name)(args.pretrained)
-        if args.bottleneck:
-            self.bottleneck_layer = nn.Sequential(nn.Linear(self.model.output_num(), args.bottleneck_num),
-                                                  nn.ReLU(inplace=True), nn.Dropout())
-            self.classifier_layer = nn.Linear(args.bottleneck_num, Dataset.num_classes)
-        else:
-            self.classifier_layer = nn.Linear(self.model.output_num(), Dataset.num_classes)
-
-        self.model_all = nn.Sequential(self.model, self.bottleneck_layer, self.classifier_layer)
-
-        if args.domain_adversarial:
-            self.max_iter = len(self.dataloaders['source_train'])*(args.max_epoch-args.middle_epoch)
-            self.AdversarialNet = getattr(models, 'AdversarialNet')(in_feature=self.model.output_num(),
-                                                                        hidden_size=args.hidden_size, max_iter=self.max_iter)
+        # Define the model, AdversarialNet counts optimizer steps
+        steps_per_epoch = math.ceil(len(self.dataloaders['source_train']) / args.accumulation_steps)
+        self.build_model(Dataset.num_classes, steps_per_epoch*(args.max_epoch-args.middle_epoch))
+        if args.accumulation_steps > 1:
+            # Decay the running statistics as much per optimizer step as with one forward per step
+            for m in self.model_all.modules():
+                if isinstance(m, nn.modules.batchnorm._BatchNorm) and m.momentum is not None:
+                    m.momentum = 1 - (1 - m.momentum) ** (1.0 / args.accumulation_steps)
+        if args.backbone:
+            self.use_backbone(args.backbone)
 
         if self.device_count > 1:
             self.model = torch.nn.DataParallel(self.model)
@@ -141,6 +165,9 @@ class train_utils(object):
 
         # Load the checkpoint
         self.start_epoch = 0
+        self.end_epoch = args.max_epoch
+        self.step = 0
+        self.best_acc = 0.0
         if args.resume:
             suffix = args.resume.rsplit('.', 1)[-1]
             if suffix == 'tar':
@@ -159,34 +186,275 @@ class train_utils(object):
         if args.domain_adversarial:
             self.AdversarialNet.to(self.device)
         self.classifier_layer.to(self.device)
+        # With a frozen backbone the inputs are its cached features
+        feature_extractor = getattr(self.model, 'module', self.model).model_GCN if args.backbone else self.model
+        self.adaptation_net = Adaptation_Net(feature_extractor, self.bottleneck_layer if args.bottleneck else None,
+                                             self.classifier_layer,
+                                             self.AdversarialNet if args.domain_adversarial else None)
+        self.net = self.adaptation_net
+        if self.distributed:
+            self.model.model_GCN.gather_nodes = args.graph_mode == 'all_gather'
+            self.model.model_GCN.graph_seed = args.seed or 0
+            # AdversarialNet is idle in the source-only epochs
+            self.net = DistributedDataParallel(self.adaptation_net,
+                                               device_ids=[self.device.index] if self.device.type == 'cuda' else None,
+                                               find_unused_parameters=True)
 
         # Define the adversarial loss
 
         self.adversarial_loss = nn.BCELoss()
 
         self.structure_loss = DAN
+        self.structure_accumulator = DAN_Accumulator() if args.accumulation_steps > 1 else None
 
         self.criterion = nn.CrossEntropyLoss()
 
+        # Mixed precision, fp16 gradients are scaled to keep them from underflowing
+        self.amp_dtype = AMP_DTYPES[args.amp]
+        self.scaler = torch.amp.GradScaler(self.device.type, enabled=args.amp == 'fp16')
+
+
+    def build_dataloaders(self):
+        args = self.args
+        # With DDP every process trains on its own shard of the source and target data
+        self.samplers = {}
+        if self.distributed:
+            self.samplers = {x: DistributedSampler(self.datasets[x], shuffle=True, seed=args.seed or 0,
+                                                   drop_last=args.last_batch)
+                             for x in ['source_train', 'target_train']}
+            # Only rank 0 evaluates, logs and saves
+            if not is_main_process():
+                self.val_phases = []
+        self.dataloaders = {x: torch.utils.data.DataLoader(self.datasets[x], batch_size=args.batch_size,
+                                                           shuffle=(True if x.split('_')[1] == 'train' and x not in self.samplers else False),
+                                                           sampler=self.samplers.get(x),
+                                                           num_workers=args.num_workers,
+                                                           pin_memory=(True if self.device == 'cuda' else False),
+                                                           drop_last=(True if args.last_batch and x.split('_')[1] == 'train' else False))
+                            for x in ['source_train', 'source_val', 'target_train', 'target_val']}
+
+    def use_backbone(self, path):
+        """
+        Load and freeze the CNN of a trained model and train on its features instead of the raw
+        windows. The features of every split are computed once and cached, so an epoch only runs
+        MRF_GCN, the bottleneck, classifier and AdversarialNet
+        """
+        args = self.args
+        state = load_backbone_state(path)
+        self.model.model_cnn.load_state_dict(state)
+        set_freeze_by_id(self.model, 1)
+        self.model.model_cnn.to(self.device)
+        self.backbone_weights = backbone_hash(state)
+        self.feature_cache_dir = args.feature_cache_dir or os.path.join(args.checkpoint_dir, 'feature_cache')
+        for x in ['source_train', 'source_val', 'target_train', 'target_val']:
+            domain, split = x.split('_')
+            self.datasets[x] = self.cached_dataset(self.datasets[x], args.transfer_task[0 if domain == 'source' else 1], split)
+        self.build_dataloaders()
+        logging.info('training on the cached features of {} in {}'.format(path, self.feature_cache_dir))
+
+    def cached_dataset(self, dataset, domains, split):
+        """The frozen backbone features of the split half of domain_split(domains)"""
+        args = self.args
+        key = cache_key(self.backbone_weights, args.data_name, args.data_dir, domains, args.normlizetype, split)
+        return cached_features(self.feature_cache_dir, key, dataset, self.model.model_cnn, self.device)
+
+    def build_model(self, num_classes, max_iter=10000.0):
+        """
+        Define the feature extractor, bottleneck, classifier and adversarial net, no data needed
+        """
+        args = self.args
+        self.model = getattr(models, args.model_name)(args.pretrained)
+        self.model.model_cnn.checkpoint = args.checkpoint_cnn
+        self.model.model_GCN.checkpoint = args.checkpoint_gcn
+        if args.bottleneck:
+            self.bottleneck_layer = nn.Sequential(nn.Linear(self.model.output_num(), args.bottleneck_num),
+                                                  nn.ReLU(inplace=True), nn.Dropout())
+            self.classifier_layer = nn.Linear(args.bottleneck_num, num_classes)
+        else:
+            self.classifier_layer = nn.Linear(self.model.output_num(), num_classes)
+
+        self.model_all = nn.Sequential(self.model, self.bottleneck_layer, self.classifier_layer)
+
+        if args.domain_adversarial:
+            self.max_iter = max_iter
+            self.AdversarialNet = getattr(models, 'AdversarialNet')(in_feature=self.model.output_num(),
+                                                                        hidden_size=args.hidden_size, max_iter=self.max_iter)
+            self.AdversarialNet.accumulation_steps = args.accumulation_steps
+
+    def model_config(self):
+        """
+        Everything besides the weights needed to run a saved model_all on raw recordings
+        """
+        args = self.args
+        Dataset = getattr(datasets, args.data_name)
+        return {'model_name': args.model_name, 'data_name': args.data_name, 'num_classes': Dataset.num_classes,
+                'class_names': Dataset.class_names, 'signal_size': Dataset.signal_size,
+                'inputchannel': Dataset.inputchannel, 'normlizetype': args.normlizetype,
+                'bottleneck': args.bottleneck, 'bottleneck_num': args.bottleneck_num,
+                'domain_adversarial': args.domain_adversarial, 'hidden_size': args.hidden_size}
+
+    def add_target_val(self, phase, target_N):
+        """
+        Evaluate an extra target domain as its own val phase
+        :param phase: the name of the phase in the log and history
+        :param target_N: the domain list of the extra target
+        """
+        args = self.args
+        if self.distributed and not is_main_process():
+            return
+        Dataset = getattr(datasets, args.data_name)
+        _, self.datasets[phase] = Dataset(args.data_dir, [args.transfer_task[0], target_N], args.normlizetype,
+                                          cache=self.data_cache).domain_split(target_N)
+        if args.backbone:
+            self.datasets[phase] = self.cached_dataset(self.datasets[phase], target_N, 'val')
+        self.dataloaders[phase] = torch.utils.data.DataLoader(self.datasets[phase], batch_size=args.batch_size,
+                                                              shuffle=False, num_workers=args.num_workers,
+                                                              pin_memory=(True if self.device == 'cuda' else False))
+        self.val_phases.append(phase)
+
+    def micro_batches(self, phase, adaptation, micro_step):
+        """
+        (inputs, labels) of phase on the device. In the adaptation epochs every source batch
+        is followed by a target batch of the same size, labels stay those of the source part
+        :param micro_step: the source batches drawn before, the target loader restarts with them
+        """
+        args = self.args
+        for inputs, labels in self.dataloaders[phase]:
+            if adaptation:
+                target_inputs, _ = next(self.iter_target)
+                # Make sure the source and the target batch have the same size
+                min_batch = min(inputs.size(0), target_inputs.size(0))
+                labels = labels[:min_batch]
+                inputs = torch.cat((inputs[:min_batch], target_inputs[:min_batch]), dim=0)
+                if (micro_step + 1) % len(self.dataloaders['target_train']) == 0:
+                    self.iter_target = iter(self.dataloaders['target_train'])
+                micro_step += 1
+            yield inputs.to(self.device), labels.to(self.device)
+
+    def get_rng_state(self):
+        state = {'torch': torch.get_rng_state()}
+        if torch.cuda.is_available():
+            state['cuda'] = torch.cuda.get_rng_state_all()
+        return state
+
+    def set_rng_state(self, state):
+        torch.set_rng_state(state['torch'])
+        if 'cuda' in state and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all(state['cuda'])
+
+    def save_state(self, save_path, epoch=None, step=None):
+        """
+        Save everything needed to continue training after epoch (default: self.end_epoch - 1)
+        """
+        args = self.args
+        state = {
+            'epoch': self.end_epoch - 1 if epoch is None else epoch,
+            'step': self.step if step is None else step,
+            'model_state_dict': self.model_all.state_dict(),
+            'optimizer_state_dict': self.optimizer.state_dict(),
+            'rng_state': self.get_rng_state(),
+            # Counters kept as plain attributes, outside the state dicts
+            'graph_step': getattr(self.model, 'module', self.model).model_GCN.graph_step,
+        }
+        if args.domain_adversarial:
+            state['adversarial_state_dict'] = self.AdversarialNet.state_dict()
+            state['adversarial_iter_num'] = getattr(self.AdversarialNet, 'module', self.AdversarialNet).iter_num
+        if self.scaler.is_enabled():
+            state['scaler_state_dict'] = self.scaler.state_dict()
+        torch.save(state, save_path)
+
+    def load_state(self, save_path):
+        """
+        Continue training from a state written by save_state
+        """
+        self.set_state(torch.load(save_path, map_location=self.device))
+
+    def set_state(self, state):
+        args = self.args
+        self.model_all.load_state_dict(state['model_state_dict'])
+        self.optimizer.load_state_dict(state['optimizer_state_dict'])
+        if args.domain_adversarial and 'adversarial_state_dict' in state:
+            self.AdversarialNet.load_state_dict(state['adversarial_state_dict'])
+            # The gradient reversal coefficient continues its ramp instead of restarting at 0
+            getattr(self.AdversarialNet, 'module', self.AdversarialNet).iter_num = state.get('adversarial_iter_num', 0)
+        getattr(self.model, 'module', self.model).model_GCN.graph_step = state.get('graph_step', 0)
+        if self.scaler.is_enabled() and 'scaler_state_dict' in state:
+            self.scaler.load_state_dict(state['scaler_state_dict'])
+        if 'rng_state' in state:
+            self.set_rng_state(state['rng_state'])
+        self.start_epoch = state['epoch'] + 1
+        self.step = state.get('step', 0)
+
+    def resume_from_dir(self):
+        """
+        Continue an interrupted run in self.save_dir from its newest epoch checkpoint. With DDP
+        only rank 0 reads the directory, which need not be shared between the machines, and
+        the other ranks get the checkpoint from it
+        :return: whether a checkpoint was found
+        """
+        args = self.args
+        state, history, latest = None, None, None
+        if is_main_process():
+            ckpts = glob.glob(os.path.join(self.save_dir, '*_ckpt.tar'))
+            history_path = os.path.join(self.save_dir, 'history.json')
+            if ckpts and os.path.exists(history_path):
+                latest = max(ckpts, key=lambda p: int(os.path.basename(p).split('_')[0]))
+                state = torch.load(latest, map_location='cpu')
+                with open(history_path, 'r', encoding='utf-8') as f:
+                    history = json.load(f)
+        state, history, latest = broadcast_object((state, history, latest))
+        if state is None:
+            return False
+        # DDP only broadcasts the parameters when it is built, every rank loads the same state instead
+        self.set_state(state)
+        self.history = [h for h in history if h['epoch'] < self.start_epoch]
+        self.best_acc = max([h['acc'] for h in self.history
+                             if h['phase'] == 'target_val' and h['epoch'] >= args.middle_epoch] or [0.0])
+        logging.info('resume from {}, epoch {}'.format(latest, self.start_epoch))
+        return True
+
+    def log_history(self, history):
+        """
+        Write epochs trained elsewhere into this log and history, e.g. a shared source-only phase
+        """
+        for h in history:
+            if h['phase'] == 'source_train':
+                logging.info('-'*5 + 'Epoch {}/{}'.format(h['epoch'], self.args.max_epoch - 1) + '-'*5)
+            logging.info('Epoch: {} {}-Loss: {:.4f} {}-Acc: {:.4f}, Cost {:.1f} sec'.format(
+                h['epoch'], h['phase'], h['loss'], h['phase'], h['acc'], h['cost']
+            ))
+        self.history.extend(history)
 
     def train(self):
         """
         Training process
-        :return:
+        :return: the per-epoch history, a list of {'epoch', 'phase', 'loss', 'acc', 'cost'}
         """
         args = self.args
 
-        step = 0
-        best_acc = 0.0
+        step = self.step
+        # Source batches drawn, accumulation_steps per optimizer step
+        micro_step = step * args.accumulation_steps
+        best_acc = self.best_acc
         batch_count = 0
         batch_loss = 0.0
         batch_acc = 0
         step_start = time.time()
 
         save_list = Save_Tool(max_num=args.max_model_num)
+        profile = args.profile and is_main_process()
+        if profile:
+            profiler = Profile_Tool(self.save_dir, wait=args.profile_wait, warmup=args.profile_warmup,
+                                    active=args.profile_active, row_limit=args.profile_row_limit)
         iter_num = 0
-        for epoch in range(self.start_epoch, args.max_epoch):
+        for epoch in range(self.start_epoch, self.end_epoch):
             logging.info('-'*5 + 'Epoch {}/{}'.format(epoch, args.max_epoch - 1) + '-'*5)
+            # Open a profiling window at the start of the source-only and the adaptation phase
+            if profile:
+                if epoch == self.start_epoch and epoch < args.middle_epoch:
+                    profiler.start('source_only')
+                elif epoch == max(self.start_epoch, args.middle_epoch):
+                    profiler.start('adaptation')
             # Update the learning rate
             if self.lr_scheduler is not None:
                 self.lr_scheduler.step(epoch)
@@ -194,15 +462,21 @@ class train_utils(object):
             else:
                 logging.info('current lr: {}'.format(args.lr))
 
-            iter_target = iter(self.dataloaders['target_train'])
-            len_target_loader = len(self.dataloaders['target_train'])
+            for sampler in self.samplers.values():
+                sampler.set_epoch(epoch)
+            # The source-only phase never draws target batches, so it does not depend on the target domain
+            if epoch >= args.middle_epoch:
+                self.iter_target = iter(self.dataloaders['target_train'])
             # Each epoch has a training and val phase
-            for phase in ['source_train', 'source_val', 'target_val']:
+            for phase in ['source_train'] + self.val_phases:
                 # Define the temp variable
                 epoch_start = time.time()
                 epoch_acc = 0
                 epoch_loss = 0.0
                 epoch_length = 0
+                # Evaluation must not consume the training random stream
+                if phase != 'source_train':
+                    rng_state = self.get_rng_state()
 
                 # Set model to train mode or test mode
                 if phase == 'source_train':
@@ -222,31 +496,36 @@ class train_utils(object):
 
 
 
-                for batch_idx, (inputs, labels) in enumerate(self.dataloaders[phase]):
-                    if phase != 'source_train' or epoch < args.middle_epoch:
-                        inputs = inputs.to(self.device)
-                        labels = labels.to(self.device)
+                batches = self.micro_batches(phase, epoch >= args.middle_epoch and phase == 'source_train', micro_step)
+                for batch_idx in range(len(self.dataloaders[phase])):
+                    if phase == 'source_train':
+                        # accumulation_steps micro-batches per optimizer step, fewer at the end of the epoch
+                        group_index = batch_idx % args.accumulation_steps
+                        group_len = min(args.accumulation_steps, len(self.dataloaders[phase]) - batch_idx + group_index)
+                        if group_index == 0:
+                            # The whole group is drawn first, the micro-batches are weighted by its source count
+                            group = [next(batches) for _ in range(group_len)]
+                            group_size = sum(labels.size(0) for _, labels in group)
+                            self.optimizer.zero_grad()
+                            group_inputs = 0
+                            if self.structure_accumulator is not None:
+                                self.structure_accumulator.reset()
+                            if args.domain_adversarial:
+                                getattr(self.AdversarialNet, 'module', self.AdversarialNet).micro_step = 0
+                        inputs, labels = group[group_index]
+                        # DDP reduces the gradients once per group
+                        last_in_group = group_index == group_len - 1
+                        sync = self.net.no_sync() if self.distributed and not last_in_group else contextlib.nullcontext()
                     else:
-                        source_inputs = inputs
-                        target_inputs, target_labels = next(iter_target)
-                        # ç¡®ä¿æºåŸŸå’Œç›®æ ‡åŸŸbatchå¤§å°ç›¸åŒ
-                        min_batch = min(source_inputs.size(0), target_inputs.size(0))
-                        source_inputs = source_inputs[:min_batch]
-                        target_inputs = target_inputs[:min_batch]
-                        labels = labels[:min_batch]
-    
-                        inputs = torch.cat((source_inputs, target_inputs), dim=0)
-                        inputs = inputs.to(self.device)
-                        labels = labels.to(self.device)
-                    if (step + 1) % len_target_loader == 0:
-                        iter_target = iter(self.dataloaders['target_train'])
-
-                    with torch.set_grad_enabled(phase == 'source_train'):
-                        # forward
-                        features = self.model(inputs)
-                        if args.bottleneck:
-                            features = self.bottleneck_layer(features)
-                        outputs = self.classifier_layer(features)
+                        inputs, labels = next(batches)
+                        sync = contextlib.nullcontext()
+
+                    with torch.set_grad_enabled(phase == 'source_train'), sync, \
+                            torch.autocast(self.device.type, dtype=self.amp_dtype, enabled=self.amp_dtype is not None):
+                        # forward, the evaluation on rank 0 alone bypasses DDP
+                        net = self.net if phase == 'source_train' else self.adaptation_net
+                        features, outputs, adversarial_out = net(
+                            inputs, adversarial=phase == 'source_train' and epoch >= args.middle_epoch)
 
                         if phase != 'source_train' or epoch < args.middle_epoch:
                             logits = outputs
@@ -263,10 +542,19 @@ class train_utils(object):
                             domain_label_source = torch.ones(labels.size(0)).float()
                             domain_label_target = torch.zeros(inputs.size(0)-labels.size(0)).float()
                             adversarial_label = torch.cat((domain_label_source, domain_label_target), dim=0).to(self.device)
-                            adversarial_out = self.AdversarialNet(features)
-                            adversarial_loss = self.adversarial_loss(adversarial_out, adversarial_label.unsqueeze(1))  
-                            structure_loss = self.structure_loss(features.narrow(0, 0, labels.size(0)),
-                                                               features.narrow(0, labels.size(0),inputs.size(0) - labels.size(0)))
+                            # The kernel exponentials of DAN and the log of BCELoss stay in fp32
+                            with torch.autocast(self.device.type, enabled=False):
+                                adversarial_loss = self.adversarial_loss(adversarial_out.float(),
+                                                                         adversarial_label.unsqueeze(1))
+                                features_fp32 = features.float()
+                                source_features = features_fp32.narrow(0, 0, labels.size(0))
+                                target_features = features_fp32.narrow(0, labels.size(0),inputs.size(0) - labels.size(0))
+                                if self.structure_accumulator is None:
+                                    structure_loss = self.structure_loss(source_features, target_features)
+                                else:
+                                    # Weighted by labels.size(0) / group_size below, the shares of the group add up
+                                    structure_loss = self.structure_accumulator(
+                                        source_features, target_features, group_size) * group_size / labels.size(0)
 
                             if args.trade_off_adversarial == 'Cons':
                                 lam_adversarial = args.lam_adversarial
@@ -288,41 +576,52 @@ class train_utils(object):
 
                         # Calculate the training information
                         if phase == 'source_train':
-                            # backward
-                            self.optimizer.zero_grad()
-                            loss.backward()
-                            self.optimizer.step()
-
+                            # backward, the gradients of the group add up to the mean over its source samples
+                            self.scaler.scale(loss * labels.size(0) / group_size).backward()
+                            micro_step += 1
+                            group_inputs += inputs.size(0)
                             batch_loss += loss_temp
                             batch_acc += correct
                             batch_count += labels.size(0)
-                            # Print the training information
-                            if step % args.print_step == 0:
-                                batch_loss = batch_loss / batch_count
-                                batch_acc = batch_acc / batch_count
-                                temp_time = time.time()
-                                train_time = temp_time - step_start
-                                step_start = temp_time
-                                batch_time = train_time / args.print_step if step != 0 else train_time
-                                sample_per_sec = 1.0 * batch_count / train_time
-                                logging.info('Epoch: {} [{}/{}], Train Loss: {:.4f} Train Acc: {:.4f},'
-                                             '{:.1f} examples/sec {:.2f} sec/batch'.format(
-                                    epoch, batch_idx * len(labels), len(self.dataloaders[phase].dataset),
-                                    batch_loss, batch_acc, sample_per_sec, batch_time
-                                ))
-                                batch_acc = 0
-                                batch_loss = 0.0
-                                batch_count = 0
-                            step += 1
+                            if last_in_group:
+                                self.scaler.step(self.optimizer)
+                                self.scaler.update()
+                                if profile:
+                                    profiler.step()
+                                for callback in self.step_callbacks:
+                                    callback(epoch, step, group_inputs)
+
+                                # Print the training information
+                                if step % args.print_step == 0:
+                                    batch_loss = batch_loss / batch_count
+                                    batch_acc = batch_acc / batch_count
+                                    temp_time = time.time()
+                                    train_time = temp_time - step_start
+                                    step_start = temp_time
+                                    batch_time = train_time / args.print_step if step != 0 else train_time
+                                    sample_per_sec = 1.0 * batch_count / train_time
+                                    logging.info('Epoch: {} [{}/{}], Train Loss: {:.4f} Train Acc: {:.4f},'
+                                                 '{:.1f} examples/sec {:.2f} sec/batch'.format(
+                                        epoch, batch_idx * len(labels), len(self.dataloaders[phase].dataset),
+                                        batch_loss, batch_acc, sample_per_sec, batch_time
+                                    ))
+                                    batch_acc = 0
+                                    batch_loss = 0.0
+                                    batch_count = 0
+                                step += 1
 
                 # Print the train and val information via each epoch
 
                 epoch_loss = epoch_loss / epoch_length
                 epoch_acc = epoch_acc / epoch_length
+                if phase != 'source_train':
+                    self.set_rng_state(rng_state)
 
                 logging.info('Epoch: {} {}-Loss: {:.4f} {}-Acc: {:.4f}, Cost {:.1f} sec'.format(
                     epoch, phase, epoch_loss, phase, epoch_acc, time.time() - epoch_start
                 ))
+                self.history.append({'epoch': epoch, 'phase': phase, 'loss': epoch_loss, 'acc': epoch_acc,
+                                     'cost': time.time() - epoch_start})
                 # save the model
                 if phase == 'target_val':
                     # Ensure save directory exists with robust error handling
@@ -350,12 +649,10 @@ class train_utils(object):
                     # 确保保存目录存在
                     os.makedirs(self.save_dir, exist_ok=True)
 
-                    torch.save({
-                        'epoch': epoch,
-                        'optimizer_state_dict': self.optimizer.state_dict(),
-                        'model_state_dict': model_state_dic
-                    }, save_path)
+                    self.save_state(save_path, epoch, step)
                     save_list.update(save_path)
+                    with open(os.path.join(self.save_dir, 'history.json'), 'w', encoding='utf-8') as f:
+                        json.dump(self.history, f)
                     # save the best model according to the val accuracy
                     if (epoch_acc > best_acc or epoch > args.max_epoch-2) and (epoch > args.middle_epoch-1):
                         best_acc = epoch_acc
@@ -368,20 +665,11 @@ class train_utils(object):
                         if not os.path.exists(os.path.dirname(best_model_path)):
                             os.makedirs(os.path.dirname(best_model_path), exist_ok=True)
                         torch.save(model_state_dic, best_model_path)
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+                        with open(os.path.join(self.save_dir, 'model_config.json'), 'w', encoding='utf-8') as f:
+                            json.dump(self.model_config(), f, indent=2)
+
+        if profile:
+            profiler.stop()
+        self.step = step
+        self.best_acc = best_acc
+        return self.history